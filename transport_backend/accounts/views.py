@@ -1,4 +1,3 @@
-import random
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework_simplejwt.views import TokenObtainPairView
@@ -9,6 +8,7 @@ from django.contrib.auth import get_user_model
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from .serializers import UserSerializer, PasswordResetConfirmSerializer, PasswordResetSerializer
+from core.identifiers import temp_nin
 import requests
 from google.oauth2 import id_token
 from google.auth.transport import requests as google_requests
@@ -26,10 +26,8 @@ logger = logging.getLogger(__name__)
 User = get_user_model()
 
 def generate_temp_nin():
-    while True:
-        fake_nin = f"9{random.randint(10**9, 10**10 - 1)}"
-        if not User.objects.filter(nin=fake_nin).exists():
-            return fake_nin
+    # Unique by construction, no lookup against User.nin
+    return temp_nin()
 
 @api_view(['POST'])
 def signup(request):
@@ -121,7 +119,7 @@ def google_auth(request):
             defaults={
                 'first_name': user_info.get('given_name', ''),
                 'last_name': user_info.get('family_name', ''),
-                'nin': generate_temp_nin(),
+                'nin': generate_temp_nin,  # Only allocated when the user is created
                 'role': 'passenger',
             }
         )
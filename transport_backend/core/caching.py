@@ -0,0 +1,302 @@
+import hashlib
+import logging
+import time
+from datetime import datetime
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+metrics.register(
+    "trip_search_cache.hit",
+    "trip_search_cache.miss",
+    "trip_search_cache.rebuild",
+    "trip_search_cache.wait",
+    "trip_search_cache.fallback",
+    "trip_search_cache.invalidated_scopes",
+    "conditional_get.not_modified",
+)
+
+VERSION_PREFIX = "version:"
+SEARCH_PREFIX = "tripsearch:"
+SEARCH_KEY_PARAMS = ("origin_id", "destination_id", "date")
+
+# Cities, parks, routes and buses: everything nested in catalog and trip payloads
+CATALOG_SCOPE = "catalog"
+
+
+# ---------------------------------------------------------------------------
+# Version markers
+# ---------------------------------------------------------------------------
+
+def _new_version():
+    # Microsecond timestamps: cheap, unique enough and still increasing
+    # after a marker has been evicted from the cache.
+    return time.time_ns() // 1000
+
+
+def get_version(scope):
+    key = VERSION_PREFIX + scope
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _new_version(), None)
+        version = cache.get(key)
+    return version
+
+
+def get_versions(scopes):
+    """Versions of several scopes with a single cache round trip."""
+    found = cache.get_many([VERSION_PREFIX + scope for scope in scopes])
+    versions = {}
+    for scope in scopes:
+        version = found.get(VERSION_PREFIX + scope)
+        versions[scope] = version if version is not None else get_version(scope)
+    return versions
+
+
+def bump_versions(scopes):
+    if not scopes:
+        return
+    version = _new_version()
+    cache.set_many({VERSION_PREFIX + scope: version for scope in scopes}, None)
+
+
+def trip_scope(trip_id):
+    return f"trip:{trip_id}"
+
+
+def booking_scope(booking_id):
+    return f"booking:{booking_id}"
+
+
+# ---------------------------------------------------------------------------
+# Trip search cache
+# ---------------------------------------------------------------------------
+
+def search_scope(origin_id, destination_id, travel_date):
+    return f"search:{origin_id}:{destination_id}:{travel_date.isoformat()}"
+
+
+def trip_search_scope(origin_park_id, destination_park_id, departure_datetime):
+    travel_date = timezone.localtime(departure_datetime).date()
+    return search_scope(origin_park_id, destination_park_id, travel_date)
+
+
+def trip_search_request_scope(query_params):
+    """(scope, travel date) of a park-to-park search request, or None."""
+    try:
+        origin_id = int(query_params.get("origin_id", ""))
+        destination_id = int(query_params.get("destination_id", ""))
+        travel_date = datetime.strptime(query_params.get("date", ""), "%Y-%m-%d").date()
+    except ValueError:
+        return None
+    return search_scope(origin_id, destination_id, travel_date), travel_date
+
+
+def trip_search_cache_key(query_params):
+    """
+    (cache key, travel date) for a trip search request, or None when the
+    request is not cacheable (missing or malformed origin/destination/date).
+
+    The scope version is part of the key, so invalidating a route/date only
+    has to bump its version; every variant of that search (page, fields...)
+    is dropped at once and simply expires from the cache.
+    """
+    found = trip_search_request_scope(query_params)
+    if found is None:
+        return None
+
+    scope, travel_date = found
+    extra = sorted(
+        (name, value)
+        for name, values in query_params.lists()
+        if name not in SEARCH_KEY_PARAMS
+        for value in values
+    )
+    variant = hashlib.md5(repr(extra).encode()).hexdigest() if extra else "-"
+    return f"{SEARCH_PREFIX}{scope}:{get_version(scope)}:{variant}", travel_date
+
+
+def trip_search_cache_timeout(travel_date):
+    timeout = settings.TRIP_SEARCH_CACHE_TIMEOUT
+    if travel_date == timezone.localdate():
+        # Today's results drop trips as they depart, keep them short-lived
+        timeout = min(timeout, settings.TRIP_SEARCH_CACHE_TODAY_TIMEOUT)
+    return timeout
+
+
+def get_or_build(key, builder, timeout):
+    """
+    Return the cached value for `key`, building it with `builder()` on a miss.
+
+    Only one caller rebuilds a missing entry; concurrent callers wait for it
+    to appear instead of all hitting the database at once.
+    """
+    value = cache.get(key)
+    if value is not None:
+        metrics.incr("trip_search_cache.hit")
+        return value
+
+    metrics.incr("trip_search_cache.miss")
+    lock_key = f"{key}:lock"
+    lock_timeout = settings.TRIP_SEARCH_CACHE_LOCK_TIMEOUT
+    if cache.add(lock_key, 1, lock_timeout):
+        try:
+            metrics.incr("trip_search_cache.rebuild")
+            value = builder()
+            cache.set(key, value, timeout)
+            return value
+        finally:
+            cache.delete(lock_key)
+
+    deadline = time.monotonic() + lock_timeout
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        value = cache.get(key)
+        if value is not None:
+            metrics.incr("trip_search_cache.wait")
+            return value
+        if cache.get(lock_key) is None:
+            break  # The rebuilding request failed, don't wait any longer
+
+    metrics.incr("trip_search_cache.fallback")
+    return builder()
+
+
+class _PendingInvalidation:
+    """on_commit callback collecting every trip touched by one transaction."""
+
+    def __init__(self):
+        self.trip_ids = set()
+        self.scopes = set()
+        self.versions = set()
+        self.seats = {}
+        self.done = False
+
+    def __call__(self):
+        self.done = True
+        _invalidate_now(self.trip_ids, self.scopes, self.versions, self.seats)
+
+
+def _invalidate_now(trip_ids, scopes, versions=(), seats=None):
+    from .models import Trip
+    from .seatmap import log_seat_changes
+
+    if seats:
+        log_seat_changes(seats)
+
+    scopes = set(scopes)
+    if trip_ids:
+        rows = Trip.objects.filter(id__in=trip_ids).values_list(
+            "route__origin_park_id", "route__destination_park_id", "departure_datetime"
+        )
+        scopes.update(
+            trip_search_scope(origin_id, destination_id, departure)
+            for origin_id, destination_id, departure in rows
+            if departure is not None
+        )
+    # Trip versions back the ETags of anything showing the trip's seats
+    bump_versions(scopes | set(versions) | {trip_scope(trip_id) for trip_id in trip_ids})
+    metrics.incr("trip_search_cache.invalidated_scopes", len(scopes))
+
+
+def _pending_invalidation():
+    connection = transaction.get_connection()
+    if not connection.in_atomic_block:
+        return None
+    # Only merge into a callback of the same savepoint, so it is discarded
+    # together with whatever a rolled back savepoint registered
+    current = set(connection.savepoint_ids)
+    for savepoint_ids, func, _robust in connection.run_on_commit:
+        if isinstance(func, _PendingInvalidation) and not func.done and set(savepoint_ids) == current:
+            return func
+    pending = _PendingInvalidation()
+    transaction.on_commit(pending)
+    return pending
+
+
+def invalidate_trip_search(trip_ids=(), scopes=(), seats=None):
+    """
+    Drop cached searches for the routes/dates of the given trips once the
+    current transaction commits. Calls made inside one transaction are merged
+    so a booking touching several rows only resolves its trips once.
+    `seats` ({trip_id: seat numbers}) goes to the seat map change log.
+    """
+    pending = _pending_invalidation()
+    if pending is None:
+        _invalidate_now(set(trip_ids), scopes, seats=seats)
+        return
+    pending.trip_ids.update(trip_ids)
+    pending.scopes.update(scopes)
+    for trip_id, seat_numbers in (seats or {}).items():
+        pending.seats.setdefault(trip_id, set()).update(seat_numbers)
+
+
+def touch_versions(scopes):
+    """Bump version markers (catalog, bookings...) once the transaction commits."""
+    pending = _pending_invalidation()
+    if pending is None:
+        bump_versions(set(scopes))
+        return
+    pending.versions.update(scopes)
+
+
+# ---------------------------------------------------------------------------
+# Conditional GET
+# ---------------------------------------------------------------------------
+
+def conditional_get(scopes_for, clock_for=None):
+    """
+    ETag / Last-Modified support for a view method, driven by version markers.
+
+    `scopes_for(view, request, *args, **kwargs)` returns the scopes the
+    response depends on (or None to skip). Responses that also change with
+    time (today's search drops departed trips) pass `clock_for`, returning
+    the unix time the current response became valid. The ETag hashes it and
+    the versions with the full path, the Accept header and the user, so a
+    matching If-None-Match (or an If-Modified-Since not older than the newest
+    version) answers 304 without touching the database for the payload or
+    running the serializer. Versions are microsecond timestamps, the newest
+    one is the Last-Modified date; HTTP dates only have second precision so
+    clients should prefer the ETag.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(view, request, *args, **kwargs):
+            scopes = scopes_for(view, request, *args, **kwargs)
+            if scopes is None:
+                return method(view, request, *args, **kwargs)
+
+            versions = get_versions(sorted(scopes))
+            clock = clock_for(view, request, *args, **kwargs) if clock_for else 0
+            fingerprint = repr((
+                sorted(versions.items()),
+                clock,
+                request.get_full_path(),
+                request.META.get("HTTP_ACCEPT", ""),
+                getattr(request.user, "pk", None),
+            ))
+            etag = quote_etag(hashlib.md5(fingerprint.encode()).hexdigest())
+            # Rounded up so a change later in the same second is not reported as older
+            last_modified = max(-(-max(versions.values()) // 1_000_000), clock)
+
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is not None:
+                metrics.incr("conditional_get.not_modified")
+            else:
+                response = method(view, request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+            response.headers["ETag"] = etag
+            response.headers["Last-Modified"] = http_date(last_modified)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,196 @@
+"""
+In-memory grid index of active bus parks for "parks near me" lookups.
+
+Parks are bucketed into square cells of PARK_INDEX_CELL_DEGREES. A radius
+query only looks at the cells overlapping the radius' bounding box, and a
+nearest-N query walks rings of cells outwards from the caller's cell until no
+unvisited cell can hold anything closer than the N-th park found so far.
+"""
+import logging
+import math
+import threading
+import time
+from collections import namedtuple
+
+from django.conf import settings
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+metrics.register("park_index.rebuilds", "park_index.park_updates")
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+IndexedPark = namedtuple('IndexedPark', ['id', 'name', 'code', 'city_id', 'city_name', 'latitude', 'longitude'])
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class ParkIndex:
+    """
+    Active parks bucketed by grid cell.
+
+    Like the journey planner timetable, updates swap in new containers
+    instead of mutating them, so concurrent queries read a consistent index.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cells = {}
+        self._by_park = {}
+        self.built_at = None
+
+    @property
+    def cell_degrees(self):
+        return settings.PARK_INDEX_CELL_DEGREES
+
+    def _cell(self, latitude, longitude):
+        return (math.floor(latitude / self.cell_degrees), math.floor(longitude / self.cell_degrees))
+
+    # -- maintenance -------------------------------------------------------
+
+    def _rows(self, **filters):
+        from .models import BusPark
+
+        return BusPark.objects.filter(status='active', **filters).values_list(
+            'id', 'name', 'code', 'city_id', 'city__name', 'latitude', 'longitude'
+        )
+
+    def rebuild(self):
+        cells = {}
+        by_park = {}
+        for row in self._rows():
+            park = IndexedPark(*row)
+            cells.setdefault(self._cell(park.latitude, park.longitude), []).append(park)
+            by_park[park.id] = park
+        with self._lock:
+            self._cells = {cell: tuple(parks) for cell, parks in cells.items()}
+            self._by_park = by_park
+            self.built_at = time.monotonic()
+        metrics.incr("park_index.rebuilds")
+        logger.info(f"Park index rebuilt with {len(by_park)} parks in {len(cells)} cells")
+
+    def invalidate(self):
+        with self._lock:
+            self.built_at = None
+
+    def ensure_fresh(self):
+        built_at = self.built_at
+        if built_at is None or time.monotonic() - built_at > settings.PARK_INDEX_REFRESH_SECONDS:
+            self.rebuild()
+
+    def refresh_parks(self, park_ids):
+        """Re-read the given parks; inactive or deleted ones leave the index."""
+        if self.built_at is None:
+            return  # Nothing built yet, the next query builds from scratch
+
+        fresh = {row[0]: IndexedPark(*row) for row in self._rows(id__in=park_ids)}
+        with self._lock:
+            cells = dict(self._cells)
+            by_park = dict(self._by_park)
+            for park_id in park_ids:
+                old = by_park.pop(park_id, None)
+                if old is not None:
+                    cell = self._cell(old.latitude, old.longitude)
+                    remaining = tuple(park for park in cells[cell] if park.id != park_id)
+                    if remaining:
+                        cells[cell] = remaining
+                    else:
+                        del cells[cell]
+                park = fresh.get(park_id)
+                if park is not None:
+                    cell = self._cell(park.latitude, park.longitude)
+                    cells[cell] = cells.get(cell, ()) + (park,)
+                    by_park[park_id] = park
+            self._cells = cells
+            self._by_park = by_park
+        metrics.incr("park_index.park_updates")
+
+    # -- queries -----------------------------------------------------------
+
+    def get(self, park_id):
+        return self._by_park.get(park_id)
+
+    def within(self, latitude, longitude, radius_km):
+        """(distance_km, park) for every park within radius_km, nearest first."""
+        cells = self._cells
+        lat_span = radius_km / KM_PER_DEGREE
+        # Longitude degrees shrink towards the poles; size the box for its widest latitude
+        widest = min(89.0, abs(latitude) + lat_span)
+        lng_span = min(180.0, radius_km / (KM_PER_DEGREE * math.cos(math.radians(widest))))
+        low_row, low_col = self._cell(latitude - lat_span, longitude - lng_span)
+        high_row, high_col = self._cell(latitude + lat_span, longitude + lng_span)
+
+        found = []
+        for row in range(low_row, high_row + 1):
+            for col in range(low_col, high_col + 1):
+                for park in cells.get((row, col), ()):
+                    distance = haversine_km(latitude, longitude, park.latitude, park.longitude)
+                    if distance <= radius_km:
+                        found.append((distance, park))
+        found.sort(key=lambda item: (item[0], item[1].id))
+        return found
+
+    def nearest(self, latitude, longitude, limit, max_radius_km=None):
+        """(distance_km, park) for the `limit` nearest parks, nearest first."""
+        cells = self._cells
+        if not cells:
+            return []
+        center_row, center_col = self._cell(latitude, longitude)
+        rows = [cell[0] for cell in cells]
+        cols = [cell[1] for cell in cells]
+        max_ring = max(
+            abs(center_row - min(rows)), abs(center_row - max(rows)),
+            abs(center_col - min(cols)), abs(center_col - max(cols)),
+        )
+
+        found = []
+        for ring in range(max_ring + 1):
+            for cell in self._ring(center_row, center_col, ring):
+                for park in cells.get(cell, ()):
+                    found.append((haversine_km(latitude, longitude, park.latitude, park.longitude), park))
+            found.sort(key=lambda item: (item[0], item[1].id))
+            # Anything beyond this ring is at least `ring` whole cells away
+            widest = min(89.0, abs(latitude) + (ring + 1) * self.cell_degrees)
+            reach = ring * self.cell_degrees * KM_PER_DEGREE * math.cos(math.radians(widest))
+            if len(found) >= limit and found[limit - 1][0] <= reach:
+                break
+            if max_radius_km is not None and reach > max_radius_km:
+                break
+
+        if max_radius_km is not None:
+            found = [item for item in found if item[0] <= max_radius_km]
+        return found[:limit]
+
+    @staticmethod
+    def _ring(center_row, center_col, ring):
+        if ring == 0:
+            yield center_row, center_col
+            return
+        for col in range(center_col - ring, center_col + ring + 1):
+            yield center_row - ring, col
+            yield center_row + ring, col
+        for row in range(center_row - ring + 1, center_row + ring):
+            yield row, center_col - ring
+            yield row, center_col + ring
+
+
+def describe(distance_km, park):
+    return {
+        "id": park.id,
+        "name": park.name,
+        "code": park.code,
+        "city": {"id": park.city_id, "name": park.city_name},
+        "latitude": park.latitude,
+        "longitude": park.longitude,
+        "distance_km": round(distance_km, 2),
+    }
+
+
+park_index = ParkIndex()
@@ -0,0 +1,189 @@
+"""
+Seat holds of unpaid bookings, and the status changes that follow.
+
+A booking is created pending with its seats assigned and taken off the trip,
+and holds them until hold_expires_at. Paying clears the expiry; bookings
+still pending past it are released by the `release_expired_holds` command,
+a batch at a time, in a fixed number of set-based statements per batch.
+Live bookings whose trip has departed read as completed right away (see
+with_current_status()) and are stored so by `complete_departed_bookings`.
+"""
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, CharField, F, IntegerField, Sum, Value, When
+from django.utils import timezone
+
+from . import metrics, search_index, waitlist
+from .caching import booking_scope, invalidate_trip_search, touch_versions
+
+logger = logging.getLogger(__name__)
+
+metrics.register(
+    "booking_holds.released", "booking_holds.paid_after_release",
+    "booking_holds.reaper_runs", "booking_holds.hold_minutes", "booking_holds.reaper_interval_seconds",
+    "booking_holds.last_run_at", "booking_holds.last_run_ms", "booking_holds.last_run_released",
+    "booking_holds.oldest_expired_seconds", "bookings.completed",
+)
+
+# Bookings whose seats are still taken off their trip
+LIVE_STATUSES = ("pending", "confirmed")
+
+
+def hold_expiry(now=None):
+    return (now or timezone.now()) + timedelta(minutes=settings.BOOKING_HOLD_MINUTES)
+
+
+def release_bookings(bookings, payment_status="failed"):
+    """
+    Cancel the live bookings of `bookings` (a queryset, locked by the caller
+    when other writers may release the same rows) and give their seats back
+    to their trips, or to the passengers waitlisted on them. A payment_status
+    of None leaves it as it is. Returns the ids released.
+    """
+    from .models import Booking, SeatAssignment, Trip
+
+    with transaction.atomic():
+        booking_ids = list(bookings.filter(status__in=LIVE_STATUSES).values_list('id', flat=True))
+        if not booking_ids:
+            return []
+        # The legs of an unpaid cart are held and let go together
+        booking_ids += Booking.objects.filter(
+            status="pending",
+            cart__in=Booking.objects.filter(id__in=booking_ids, status="pending").values('cart'),
+        ).exclude(id__in=booking_ids).values_list('id', flat=True)
+        returned = dict(
+            Booking.objects.filter(id__in=booking_ids).exclude(trip=None)
+            .values_list('trip_id').annotate(seats=Sum('seat_count')).order_by()
+        )
+        seats = {}
+        assignments = SeatAssignment.objects.filter(booking_id__in=booking_ids)
+        for trip_id, seat_number in assignments.values_list('trip_id', 'seat_number'):
+            seats.setdefault(trip_id, []).append(seat_number)
+
+        changes = {"status": "cancelled", "hold_expires_at": None}
+        if payment_status is not None:
+            changes["payment_status"] = payment_status
+        Booking.objects.filter(id__in=booking_ids).update(**changes)
+        assignments.delete()
+        if returned:
+            Trip.objects.filter(id__in=returned).update(available_seats=F('available_seats') + Case(
+                *[When(id=trip_id, then=Value(count)) for trip_id, count in returned.items()],
+                default=Value(0), output_field=IntegerField(),
+            ))
+            for trip_id, taken in waitlist.promote(list(returned)).items():
+                seats.setdefault(trip_id, []).extend(taken)
+
+        # update() sends no signals
+        search_index.sync_trips(list(returned))
+        invalidate_trip_search(trip_ids=returned, seats=seats)
+        touch_versions([booking_scope(booking_id) for booking_id in booking_ids])
+    return booking_ids
+
+
+def confirm_payment(booking):
+    """
+    Mark a paid booking confirmed and end its hold. A booking whose hold was
+    already released keeps its cancelled status, its seats may be resold.
+    """
+    from .models import Booking
+
+    with transaction.atomic():
+        booking = Booking.objects.select_for_update().get(pk=booking.pk)
+        booking.payment_status = "successful"
+        if booking.status == "cancelled":
+            metrics.incr("booking_holds.paid_after_release")
+            logger.warning(f"Booking {booking.payment_reference} was paid after its seat hold was released, refund it")
+        else:
+            booking.status = "confirmed"
+            booking.hold_expires_at = None
+        booking.save()
+    return booking
+
+
+def confirm_payments(bookings):
+    """
+    confirm_payment() for all the bookings one payment covers (the legs of a
+    cart). If any was already released, the others are released too: a
+    passenger is refunded rather than left with part of a journey.
+    """
+    from .models import Booking
+
+    with transaction.atomic():
+        # Locked through an id subquery: `bookings` may join the cart, and rows on the
+        # nullable side of an outer join cannot be locked on PostgreSQL
+        legs = list(Booking.objects.select_for_update().filter(id__in=bookings.values('id')).order_by('id'))
+        if any(leg.status == "cancelled" for leg in legs) and len(legs) > 1:
+            release_bookings(Booking.objects.filter(id__in=[leg.id for leg in legs]), payment_status=None)
+        return [confirm_payment(leg) for leg in legs]
+
+
+def with_current_status(bookings, now=None):
+    """Annotate `current_status`: the stored status, or completed for a live booking whose trip has departed."""
+    return bookings.annotate(current_status=Case(
+        When(status__in=LIVE_STATUSES, trip__departure_datetime__lt=now or timezone.now(), then=Value("completed")),
+        default=F('status'), output_field=CharField(),
+    ))
+
+
+def complete_departed_bookings(batch_size=None, now=None):
+    """Store the completed status of live bookings whose trip has departed, batch by batch. Returns how many."""
+    from .models import Booking
+
+    batch_size = batch_size or settings.BOOKING_COMPLETION_BATCH_SIZE
+    departed = Booking.objects.filter(status__in=LIVE_STATUSES, trip__departure_datetime__lt=now or timezone.now())
+    completed = 0
+    while True:
+        with transaction.atomic():
+            batch = list(departed.order_by('id').values_list('id', flat=True)[:batch_size])
+            if batch:
+                completed += Booking.objects.filter(id__in=batch, status__in=LIVE_STATUSES).update(
+                    status="completed", hold_expires_at=None
+                )
+                touch_versions([booking_scope(booking_id) for booking_id in batch])
+        if len(batch) < batch_size:
+            break
+    metrics.incr("bookings.completed", completed)
+    if completed:
+        logger.info(f"Completed {completed} bookings of departed trips")
+    return completed
+
+
+def release_expired_holds(batch_size=None, now=None):
+    """Cancel pending bookings whose hold expired, batch by batch. Returns how many."""
+    from .models import Booking
+
+    batch_size = batch_size or settings.BOOKING_HOLD_REAPER_BATCH_SIZE
+    now = now or timezone.now()
+    started = time.monotonic()
+    expired = Booking.objects.filter(status="pending", hold_expires_at__lt=now)
+
+    oldest = expired.order_by('hold_expires_at').values_list('hold_expires_at', flat=True).first()
+    released = 0
+    while True:
+        with transaction.atomic():
+            # Rows another worker (or a payment) holds are left for the next run
+            batch = list(
+                expired.select_for_update(skip_locked=True).order_by('hold_expires_at')
+                .values_list('id', flat=True)[:batch_size]
+            )
+            if batch:
+                released += len(release_bookings(Booking.objects.filter(id__in=batch)))
+        if len(batch) < batch_size:
+            break
+
+    metrics.incr("booking_holds.reaper_runs")
+    metrics.incr("booking_holds.released", released)
+    metrics.set_value("booking_holds.hold_minutes", settings.BOOKING_HOLD_MINUTES)
+    metrics.set_value("booking_holds.reaper_interval_seconds", settings.BOOKING_HOLD_REAPER_INTERVAL_SECONDS)
+    metrics.set_value("booking_holds.last_run_at", now.isoformat())
+    metrics.set_value("booking_holds.last_run_ms", round((time.monotonic() - started) * 1000, 1))
+    metrics.set_value("booking_holds.last_run_released", released)
+    # How late the reaper is: a growing value means the interval or batch size is too small
+    metrics.set_value("booking_holds.oldest_expired_seconds", round((now - oldest).total_seconds()) if oldest else 0)
+    if released:
+        logger.info(f"Released {released} expired seat holds")
+    return released
@@ -0,0 +1,156 @@
+"""
+Idempotency-Key support for unsafe endpoints that clients retry.
+
+The first request with a key claims an IdempotencyKey row (the unique
+(user, scope, key) index makes the claim atomic), runs the view and stores
+its response on the row. Repeats within IDEMPOTENCY_KEY_TTL_HOURS get that
+response back, marked with an Idempotent-Replayed header, instead of running
+again. A repeat that arrives while the first request is still running polls
+the row until it finishes (up to IDEMPOTENCY_WAIT_SECONDS). Claims are made
+in autocommit, outside the view's own transactions.
+"""
+import hashlib
+import json
+import logging
+import time
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+metrics.register(
+    "idempotency.stored", "idempotency.replayed", "idempotency.waited", "idempotency.conflicts",
+    "idempotency.purged",
+)
+
+HEADER = "Idempotency-Key"
+MAX_KEY_LENGTH = 255
+POLL_SECONDS = 0.1
+
+
+def request_fingerprint(request):
+    body = json.dumps(request.data, sort_keys=True, cls=DjangoJSONEncoder, default=str)
+    return hashlib.sha256(f"{request.method} {request.path} {body}".encode()).hexdigest()
+
+
+def _claim(user, scope, key, fingerprint):
+    """The new in-progress row, or the existing one for this key."""
+    from .models import IdempotencyKey
+
+    now = timezone.now()
+    try:
+        with transaction.atomic():
+            return True, IdempotencyKey.objects.create(
+                user=user, scope=scope, key=key, request_hash=fingerprint,
+                expires_at=now + timedelta(hours=settings.IDEMPOTENCY_KEY_TTL_HOURS),
+            )
+    except IntegrityError:
+        pass
+    existing = IdempotencyKey.objects.filter(user=user, scope=scope, key=key).first()
+    if existing is None:
+        return _claim(user, scope, key, fingerprint)  # Deleted meanwhile
+    abandoned = (
+        existing.status_code is None
+        and existing.created_at < now - timedelta(seconds=settings.IDEMPOTENCY_LOCK_SECONDS)
+    )
+    if existing.expires_at <= now or abandoned:
+        # Expired, or its request died before storing a response: start over
+        IdempotencyKey.objects.filter(pk=existing.pk, created_at=existing.created_at).delete()
+        return _claim(user, scope, key, fingerprint)
+    return False, existing
+
+
+def _wait_for_response(record):
+    from .models import IdempotencyKey
+
+    deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_SECONDS
+    metrics.incr("idempotency.waited")
+    while record is not None and record.status_code is None and time.monotonic() < deadline:
+        time.sleep(POLL_SECONDS)
+        record = IdempotencyKey.objects.filter(pk=record.pk).first()
+    return record
+
+
+def _replay(record):
+    metrics.incr("idempotency.replayed")
+    return Response(record.response_body, status=record.status_code, headers={"Idempotent-Replayed": "true"})
+
+
+def idempotent(scope):
+    """
+    Honour an Idempotency-Key header on a view method (`scope` names the
+    endpoint). Requests without the header run as usual. Server errors and
+    exceptions are not stored, so the client can retry them.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(view, request, *args, **kwargs):
+            key = request.headers.get(HEADER)
+            if not key or not request.user.is_authenticated:
+                return method(view, request, *args, **kwargs)
+            if len(key) > MAX_KEY_LENGTH:
+                return Response(
+                    {"error": f"{HEADER} must be at most {MAX_KEY_LENGTH} characters."},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+
+            fingerprint = request_fingerprint(request)
+            claimed, record = _claim(request.user, scope, key, fingerprint)
+            if not claimed:
+                if record.request_hash != fingerprint:
+                    metrics.incr("idempotency.conflicts")
+                    return Response(
+                        {"error": f"This {HEADER} was already used for a different request."},
+                        status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                    )
+                if record.status_code is None:
+                    record = _wait_for_response(record)
+                if record is None or record.status_code is None:
+                    return Response(
+                        {"error": f"A request with this {HEADER} is still in progress, retry later."},
+                        status=status.HTTP_409_CONFLICT,
+                    )
+                return _replay(record)
+
+            try:
+                response = method(view, request, *args, **kwargs)
+            except Exception:
+                record.delete()
+                raise
+            if response.status_code >= 500:
+                record.delete()
+                return response
+            record.status_code = response.status_code
+            record.response_body = json.loads(json.dumps(response.data, cls=DjangoJSONEncoder))
+            record.save(update_fields=["status_code", "response_body"])
+            metrics.incr("idempotency.stored")
+            return response
+        return wrapper
+    return decorator
+
+
+def purge_expired(batch_size=None):
+    """Delete expired keys batch by batch, returns how many."""
+    from .models import IdempotencyKey
+
+    batch_size = batch_size or settings.IDEMPOTENCY_PURGE_BATCH_SIZE
+    expired = IdempotencyKey.objects.filter(expires_at__lte=timezone.now())
+    purged = 0
+    while True:
+        batch = list(expired.values_list('pk', flat=True)[:batch_size])
+        if not batch:
+            break
+        purged += IdempotencyKey.objects.filter(pk__in=batch).delete()[0]
+        if len(batch) < batch_size:
+            break
+    metrics.incr("idempotency.purged", purged)
+    return purged
@@ -0,0 +1,104 @@
+"""
+Collision-free identifiers without read-before-write.
+
+Each kind of identifier draws numbers from a named IdentifierSequence row.
+A process reserves IDENTIFIER_BLOCK_SIZE numbers at a time with one
+UPDATE ... RETURNING and hands them out from memory, so most allocations
+touch no table at all and no two allocations ever share a number. Blocks are
+reserved on the "identifiers" database alias, a persistent autocommit
+connection of its own: like a database sequence, a reservation survives the
+caller's transaction rolling back, so a rolled back block is never handed
+out again. SQLite (development and tests) allows one writer at a time, so
+there the caller's connection is used.
+
+Numbers are then encoded into the existing formats with a check character.
+"""
+import string
+import threading
+
+from django.conf import settings
+from django.db import connection, connections
+
+BASE36 = string.digits + string.ascii_uppercase
+
+# Reference codes keep their five characters: REF-<date>-<plate>-<4 base36
+# digits><check>. The digits are the sequence number scrambled by a
+# multiplier coprime to 36, so they do not look sequential and only repeat
+# every 36 ** 4 (~1.7M) bookings, by then on another date or bus.
+REF_CODE_DIGITS = 4
+REF_CODE_SPACE = 36 ** REF_CODE_DIGITS
+REF_CODE_MULTIPLIER = 1030241
+
+IDENTIFIER_DB_ALIAS = "identifiers"
+
+# Temporary NINs are "90" + 8 digits + a Luhn digit. Random ones were "9"
+# followed by a number from 10**9 up, so they never start with "90".
+TEMP_NIN_PREFIX = "90"
+TEMP_NIN_DIGITS = 8
+
+
+def check_character(code, alphabet=BASE36):
+    """Luhn mod N check character of `code` over `alphabet`."""
+    base = len(alphabet)
+    total = 0
+    for position, char in enumerate(reversed(code)):
+        addend = alphabet.index(char) * (2 if position % 2 == 0 else 1)
+        total += addend // base + addend % base
+    return alphabet[-total % base]
+
+
+def is_valid(code, alphabet=BASE36):
+    return len(code) > 1 and check_character(code[:-1], alphabet) == code[-1]
+
+
+def encode(number, width, alphabet=BASE36):
+    base = len(alphabet)
+    chars = []
+    for _ in range(width):
+        number, remainder = divmod(number, base)
+        chars.append(alphabet[remainder])
+    return ''.join(reversed(chars))
+
+
+class BlockAllocator:
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._next = 0
+        self._end = 0  # Exclusive
+
+    def _reserve_block(self, size):
+        from .models import IdentifierSequence
+
+        table = connection.ops.quote_name(IdentifierSequence._meta.db_table)
+        sql = f"UPDATE {table} SET next_value = next_value + %s WHERE name = %s RETURNING next_value"
+        db = connections[IDENTIFIER_DB_ALIAS] if connection.vendor != 'sqlite' else connection
+        with db.cursor() as cursor:
+            cursor.execute(sql, [size, self.name])
+            row = cursor.fetchone()
+        if row is None:
+            raise LookupError(f"No identifier sequence named {self.name!r}, run the core migrations")
+        return row[0] - size, row[0]
+
+    def next(self):
+        with self._lock:
+            if self._next >= self._end:
+                self._next, self._end = self._reserve_block(settings.IDENTIFIER_BLOCK_SIZE)
+            number = self._next
+            self._next += 1
+        return number
+
+
+booking_references = BlockAllocator("booking_reference")
+temp_nins = BlockAllocator("temp_nin")
+
+
+def booking_reference_code():
+    number = booking_references.next() * REF_CODE_MULTIPLIER % REF_CODE_SPACE
+    code = encode(number, REF_CODE_DIGITS)
+    return code + check_character(code)
+
+
+def temp_nin():
+    digits = TEMP_NIN_PREFIX + encode(temp_nins.next() % 10 ** TEMP_NIN_DIGITS, TEMP_NIN_DIGITS, string.digits)
+    return digits + check_character(digits, string.digits)
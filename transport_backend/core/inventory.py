@@ -0,0 +1,120 @@
+"""
+Consistency of Trip.available_seats with the seats actually assigned.
+
+SeatAssignment rows are the truth: the (trip, seat_number) constraint is
+what stops a seat being sold twice. A trip's available_seats should be its
+bus's total_seats less its assigned seats; check() finds the upcoming trips
+where it is not with one aggregate query, and repair() resets them in bulk.
+Seat rows still held by cancelled bookings are freed first, and the seats
+repair() gives back go to the trips' waitlists.
+"""
+import logging
+import time
+
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import metrics, search_index, waitlist
+from .caching import invalidate_trip_search
+from .holds import LIVE_STATUSES
+
+logger = logging.getLogger(__name__)
+
+metrics.register(
+    "seat_inventory.runs", "seat_inventory.repaired_trips", "seat_inventory.freed_seats",
+    "seat_inventory.last_run_at", "seat_inventory.last_run_ms", "seat_inventory.checked_trips",
+    "seat_inventory.drifted_trips", "seat_inventory.drifted_seats",
+)
+
+
+def _assigned_seats():
+    from .models import SeatAssignment
+
+    return Coalesce(Subquery(
+        SeatAssignment.objects.filter(trip=OuterRef('pk')).order_by().values('trip')
+        .annotate(seats=Count('id')).values('seats'),
+        output_field=IntegerField(),
+    ), Value(0))
+
+
+def _upcoming_trips(now):
+    from .models import Trip
+
+    return Trip.objects.filter(departure_datetime__gt=now)
+
+
+def _stale_assignments(now):
+    from .models import SeatAssignment
+
+    return SeatAssignment.objects.filter(trip__departure_datetime__gt=now).exclude(booking__status__in=LIVE_STATUSES)
+
+
+def check(now=None):
+    """
+    Drift of every upcoming trip whose counter is off, as
+    [(trip_id, available_seats, expected)], plus the number of seats held by
+    cancelled bookings.
+    """
+    now = now or timezone.now()
+    drift = list(
+        _upcoming_trips(now)
+        .annotate(expected=F('bus__total_seats') - _assigned_seats())
+        .exclude(available_seats=F('expected'))
+        .order_by('id').values_list('id', 'available_seats', 'expected')
+    )
+    return drift, _stale_assignments(now).count()
+
+
+def repair(trip_ids, now=None):
+    """Free stale seats and recount `trip_ids` (and the trips stale seats were freed on). Returns the trips reset."""
+    from .models import Bus, Trip
+
+    now = now or timezone.now()
+    with transaction.atomic():
+        stale = _stale_assignments(now)
+        freed = {}
+        for trip_id, seat_number in stale.values_list('trip_id', 'seat_number'):
+            freed.setdefault(trip_id, []).append(seat_number)
+        trip_ids = sorted(set(trip_ids) | set(freed))
+        if not trip_ids:
+            return []
+        # Bookings take seats with an UPDATE of the trip row issued last, so once
+        # the rows are locked the count below sees every booking that touched them
+        list(Trip.objects.select_for_update().filter(id__in=trip_ids).order_by('id').values_list('id'))
+        if freed:
+            stale.delete()
+        Trip.objects.filter(id__in=trip_ids).update(available_seats=Subquery(
+            Bus.objects.filter(pk=OuterRef('bus_id')).values('total_seats')
+        ) - _assigned_seats())
+        seats = {trip_id: list(seat_numbers) for trip_id, seat_numbers in freed.items()}
+        for trip_id, taken in waitlist.promote(trip_ids, now=now).items():
+            seats.setdefault(trip_id, []).extend(taken)
+        search_index.sync_trips(trip_ids)
+        invalidate_trip_search(trip_ids=trip_ids, seats=seats)
+    metrics.incr("seat_inventory.freed_seats", sum(len(seats) for seats in freed.values()))
+    return trip_ids
+
+
+def run(dry_run=False, now=None):
+    """Check every upcoming trip and, unless `dry_run`, repair the ones that drifted. Returns the drift found."""
+    now = now or timezone.now()
+    started = time.monotonic()
+    drift, stale = check(now)
+
+    metrics.incr("seat_inventory.runs")
+    metrics.set_value("seat_inventory.checked_trips", _upcoming_trips(now).count())
+    metrics.set_value("seat_inventory.drifted_trips", len(drift))
+    metrics.set_value("seat_inventory.drifted_seats", sum(abs(available - expected) for _, available, expected in drift))
+    for trip_id, available, expected in drift:
+        logger.warning(f"Trip {trip_id} shows {available} available seats, its seat assignments leave {expected}")
+    if stale:
+        logger.warning(f"{stale} seats are still assigned to cancelled bookings")
+    if not dry_run and (drift or stale):
+        repaired = repair([trip_id for trip_id, _, _ in drift], now=now)
+        metrics.incr("seat_inventory.repaired_trips", len(repaired))
+        logger.info(f"Recounted the seats of {len(repaired)} trips")
+    metrics.set_value("seat_inventory.last_run_at", now.isoformat())
+    metrics.set_value("seat_inventory.last_run_ms", round((time.monotonic() - started) * 1000, 1))
+    return drift, stale
@@ -0,0 +1,272 @@
+"""
+In-memory timetable and connection-scan journey planner.
+
+Every upcoming Trip on an active Route is one connection (park -> park with a
+departure and an arrival time). Connections are kept sorted by departure so
+a query is a single forward scan: a connection can only be boarded from a
+label whose arrival (plus the transfer time) is before its departure, and
+every such label was produced by a connection scanned earlier. Transfers
+happen at the city level, so changing parks inside a transit city is covered
+by the minimum transfer time.
+"""
+import bisect
+import logging
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.utils import timezone
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+metrics.register("journey_planner.rebuilds", "journey_planner.trip_updates")
+
+Connection = namedtuple('Connection', [
+    'departure', 'trip_id', 'arrival', 'origin_park_id', 'destination_park_id',
+    'origin_city_id', 'destination_city_id', 'price',
+])
+
+# A partial journey ending at a city: arrival time, total price, number of
+# legs, the connection that got there and the label it continued from.
+Label = namedtuple('Label', ['arrival', 'cost', 'legs', 'connection', 'parent'])
+
+
+def _travel_seconds(duration_min, distance_km):
+    if duration_min:
+        return duration_min * 60
+    return distance_km / settings.JOURNEY_PLANNER_AVERAGE_SPEED_KMH * 3600
+
+
+class Timetable:
+    """
+    Connections for trips departing within JOURNEY_PLANNER_HORIZON_DAYS.
+
+    Updates replace the connection list instead of mutating it, so a query
+    running in another thread keeps scanning a consistent snapshot.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._connections = []
+        self._by_trip = {}
+        self.park_names = {}
+        self.built_at = None
+
+    # -- maintenance -------------------------------------------------------
+
+    def _rows(self, **filters):
+        from .models import Trip
+
+        now = timezone.now()
+        return Trip.objects.filter(
+            departure_datetime__gte=now,
+            departure_datetime__lt=now + timedelta(days=settings.JOURNEY_PLANNER_HORIZON_DAYS),
+            route__status='active',
+            **filters
+        ).values_list(
+            'id', 'departure_datetime', 'seat_price',
+            'route__estimated_duration_min', 'route__distance_km',
+            'route__origin_park_id', 'route__destination_park_id',
+            'route__origin_park__city_id', 'route__destination_park__city_id',
+            'route__origin_park__name', 'route__destination_park__name',
+        )
+
+    def _to_connection(self, row):
+        (trip_id, departure, price, duration_min, distance_km, origin_park_id, destination_park_id,
+         origin_city_id, destination_city_id, origin_name, destination_name) = row
+        self.park_names[origin_park_id] = origin_name
+        self.park_names[destination_park_id] = destination_name
+        departs = departure.timestamp()
+        return Connection(
+            departure=departs,
+            trip_id=trip_id,
+            arrival=departs + _travel_seconds(duration_min, distance_km),
+            origin_park_id=origin_park_id,
+            destination_park_id=destination_park_id,
+            origin_city_id=origin_city_id,
+            destination_city_id=destination_city_id,
+            price=price or 0,
+        )
+
+    def rebuild(self):
+        connections = sorted(self._to_connection(row) for row in self._rows())
+        with self._lock:
+            self._connections = connections
+            self._by_trip = {connection.trip_id: connection for connection in connections}
+            self.built_at = time.monotonic()
+        metrics.incr("journey_planner.rebuilds")
+        logger.info(f"Journey planner timetable rebuilt with {len(connections)} connections")
+
+    def invalidate(self):
+        with self._lock:
+            self.built_at = None
+
+    def ensure_fresh(self):
+        built_at = self.built_at
+        if built_at is None or time.monotonic() - built_at > settings.JOURNEY_PLANNER_REFRESH_SECONDS:
+            self.rebuild()
+
+    def refresh_trips(self, trip_ids=(), route_ids=()):
+        """Re-read the given trips (or every trip on the given routes)."""
+        if self.built_at is None:
+            return  # Nothing built yet, the next query builds from scratch
+
+        from .models import Trip
+
+        filters = {'id__in': trip_ids} if trip_ids else {'route_id__in': route_ids}
+        fresh = [self._to_connection(row) for row in self._rows(**filters)]
+        stale = set(trip_ids)
+        if route_ids:
+            stale.update(Trip.objects.filter(route_id__in=route_ids).values_list('id', flat=True))
+
+        with self._lock:
+            connections = list(self._connections)
+            by_trip = dict(self._by_trip)
+            for trip_id in stale:
+                old = by_trip.pop(trip_id, None)
+                if old is not None:
+                    del connections[bisect.bisect_left(connections, old)]
+            for connection in fresh:
+                bisect.insort(connections, connection)
+                by_trip[connection.trip_id] = connection
+            self._connections = connections
+            self._by_trip = by_trip
+        metrics.incr("journey_planner.trip_updates")
+
+    def remove_trip(self, trip_id):
+        with self._lock:
+            old = self._by_trip.get(trip_id)
+            if old is None:
+                return
+            connections = list(self._connections)
+            del connections[bisect.bisect_left(connections, old)]
+            by_trip = dict(self._by_trip)
+            del by_trip[trip_id]
+            self._connections = connections
+            self._by_trip = by_trip
+
+    # -- queries -----------------------------------------------------------
+
+    def _window(self, depart_after, window_seconds):
+        connections = self._connections
+        start = bisect.bisect_left(connections, (depart_after,))
+        end = bisect.bisect_left(connections, (depart_after + window_seconds,))
+        return connections, start, end
+
+    def earliest_arrival(self, origin_parks, destination_parks, depart_after, window_seconds,
+                         min_transfer, max_legs, excluded_trips=frozenset()):
+        """Connection scan keeping the earliest arrival per (legs, city)."""
+        connections, start, end = self._window(depart_after, window_seconds)
+        best = [dict() for _ in range(max_legs + 1)]
+        found = None
+
+        for index in range(start, end):
+            connection = connections[index]
+            if found is not None and connection.departure >= found.arrival:
+                break  # Nothing departing later can arrive earlier
+            if connection.trip_id in excluded_trips:
+                continue
+
+            parents = []
+            if connection.origin_park_id in origin_parks:
+                parents.append(None)
+            for legs in range(1, max_legs):
+                label = best[legs].get(connection.origin_city_id)
+                if label is not None and label.arrival + min_transfer <= connection.departure:
+                    parents.append(label)
+
+            for parent in parents:
+                legs = parent.legs + 1 if parent else 1
+                cost = (parent.cost if parent else 0) + connection.price
+                label = Label(connection.arrival, cost, legs, connection, parent)
+                current = best[legs].get(connection.destination_city_id)
+                if current is None or label.arrival < current.arrival:
+                    best[legs][connection.destination_city_id] = label
+                if connection.destination_park_id in destination_parks:
+                    if found is None or (label.arrival, label.legs, label.cost) < (found.arrival, found.legs, found.cost):
+                        found = label
+        return found
+
+    def cheapest(self, origin_parks, destination_parks, depart_after, window_seconds,
+                 min_transfer, max_legs, excluded_trips=frozenset()):
+        """Connection scan keeping Pareto-optimal (arrival, cost, legs) labels per city."""
+        connections, start, end = self._window(depart_after, window_seconds)
+        labels = {}
+        found = None
+
+        for index in range(start, end):
+            connection = connections[index]
+            if connection.trip_id in excluded_trips:
+                continue
+
+            # Cheapest way to board this connection for each number of legs so far
+            boarding = {}
+            if connection.origin_park_id in origin_parks:
+                boarding[0] = None
+            for label in labels.get(connection.origin_city_id, ()):
+                if label.legs < max_legs and label.arrival + min_transfer <= connection.departure:
+                    current = boarding.get(label.legs)
+                    if current is None or label.cost < current.cost:
+                        boarding[label.legs] = label
+
+            for legs, parent in boarding.items():
+                label = Label(
+                    connection.arrival,
+                    (parent.cost if parent else 0) + connection.price,
+                    legs + 1,
+                    connection,
+                    parent,
+                )
+                if connection.destination_park_id in destination_parks:
+                    if found is None or (label.cost, label.arrival, label.legs) < (found.cost, found.arrival, found.legs):
+                        found = label
+                city_labels = labels.setdefault(connection.destination_city_id, [])
+                if any(
+                    other.arrival <= label.arrival and other.cost <= label.cost and other.legs <= label.legs
+                    for other in city_labels
+                ):
+                    continue
+                city_labels[:] = [
+                    other for other in city_labels
+                    if not (label.arrival <= other.arrival and label.cost <= other.cost and label.legs <= other.legs)
+                ]
+                city_labels.append(label)
+        return found
+
+    def describe(self, label):
+        if label is None:
+            return None
+        legs = []
+        while label is not None:
+            connection = label.connection
+            legs.append({
+                "trip_id": connection.trip_id,
+                "origin_park": {"id": connection.origin_park_id, "name": self.park_names.get(connection.origin_park_id)},
+                "destination_park": {
+                    "id": connection.destination_park_id,
+                    "name": self.park_names.get(connection.destination_park_id),
+                },
+                "departure_datetime": _as_datetime(connection.departure),
+                "arrival_datetime": _as_datetime(connection.arrival),
+                "price": connection.price,
+            })
+            label = label.parent
+        legs.reverse()
+        return {
+            "departure_datetime": legs[0]["departure_datetime"],
+            "arrival_datetime": legs[-1]["arrival_datetime"],
+            "total_price": sum(leg["price"] for leg in legs),
+            "transfers": len(legs) - 1,
+            "legs": legs,
+        }
+
+
+def _as_datetime(timestamp):
+    return timezone.localtime(datetime.fromtimestamp(timestamp, tz=dt_timezone.utc))
+
+
+timetable = Timetable()
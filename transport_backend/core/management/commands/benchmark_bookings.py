@@ -0,0 +1,311 @@
+"""
+Concurrent booking benchmark and seat inventory check.
+
+Builds its own throwaway network, then fires booking, cancellation and
+payment (initialize + callback) requests through the API from a pool of
+threads, at one hot trip or spread over many, with Paystack stubbed out.
+Reports throughput and p50/p99 latency per operation, the time spent in
+row-locking statements (SELECT ... FOR UPDATE and trip seat updates, which
+includes waiting for the lock), and checks the inventory afterwards.
+
+SQLite serializes every write, so point DATABASE_URL at a local PostgreSQL
+to measure real contention.
+"""
+import random
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from datetime import timedelta
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count, F, Q
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from core.models import City, BusPark, Route, Bus, Trip, Booking, SeatAssignment
+
+User = get_user_model()
+
+PREFIX = "bench"
+LOCKING_SQL = ('FOR UPDATE', 'UPDATE "core_trip"')
+OPERATIONS = ('book', 'cancel', 'pay')
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[round(fraction * (len(values) - 1))]
+
+
+class StubResponse:
+    def __init__(self, payload):
+        self.payload = payload
+
+    def json(self):
+        return self.payload
+
+
+class StubPaystack:
+    """Answers the payment views' Paystack calls; `failure_rate` of verifications fail."""
+
+    def __init__(self, failure_rate, seed):
+        self.failure_rate = failure_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def post(self, url, **kwargs):
+        return StubResponse({"status": True, "data": {"authorization_url": "https://checkout.paystack.test/bench"}})
+
+    def get(self, url, **kwargs):
+        with self.lock:
+            failed = self.rng.random() < self.failure_rate
+        return StubResponse({"status": True, "data": {"status": "failed" if failed else "success"}})
+
+
+class BenchmarkRun:
+    def __init__(self, trips, users, options):
+        self.trips = trips
+        self.users = users
+        self.options = options
+        self.lock = threading.Lock()
+        self.remaining = options['requests']
+        self.latencies = defaultdict(list)
+        self.outcomes = defaultdict(Counter)
+        self.lock_times = []
+        self.live_bookings = []  # (user, booking id, payment reference)
+        weights = dict(part.split('=') for part in options['mix'].split(','))
+        self.operations = [operation for operation in OPERATIONS if int(weights.get(operation, 0)) > 0]
+        self.weights = [int(weights[operation]) for operation in self.operations]
+
+    def time_locking_sql(self, execute, sql, params, many, context):
+        if not any(marker in sql for marker in LOCKING_SQL):
+            return execute(sql, params, many, context)
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self.lock:
+                self.lock_times.append(elapsed)
+
+    def take_request(self):
+        with self.lock:
+            if self.remaining <= 0:
+                return False
+            self.remaining -= 1
+            return True
+
+    def take_booking(self, rng):
+        with self.lock:
+            if not self.live_bookings:
+                return None
+            return self.live_bookings.pop(rng.randrange(len(self.live_bookings)))
+
+    def worker(self, seed, close_connection=True):
+        rng = random.Random(seed)
+        try:
+            with connection.execute_wrapper(self.time_locking_sql):
+                while self.take_request():
+                    operation = rng.choices(self.operations, self.weights)[0]
+                    booking = None if operation == 'book' else self.take_booking(rng)
+                    if booking is None:
+                        operation = 'book'
+                    started = time.perf_counter()
+                    try:
+                        status_code = getattr(self, operation)(rng, booking)
+                        outcome = 'ok' if status_code < 400 else 'rejected' if status_code < 500 else 'error'
+                    except Exception:
+                        outcome = 'error'
+                    elapsed = time.perf_counter() - started
+                    with self.lock:
+                        self.latencies[operation].append(elapsed)
+                        self.outcomes[operation][outcome] += 1
+        finally:
+            if close_connection:
+                connection.close()
+
+    def client(self, user):
+        client = APIClient(SERVER_NAME=settings.ALLOWED_HOSTS[0])
+        client.force_authenticate(user)
+        return client
+
+    def book(self, rng, booking):
+        trip = rng.choice(self.trips)
+        user = rng.choice(self.users)
+        count = rng.randint(1, self.options['seats'])
+        payload = {'trip': trip.id, 'seat_count': count, 'price': trip.seat_price * count}
+        if self.options['seat_choice'] == 'auto':
+            payload['auto_assign'] = True
+        else:
+            payload['seat_numbers'] = rng.sample(range(1, trip.bus.total_seats + 1), count)
+        response = self.client(user).post(reverse('booking-create'), payload, format='json')
+        if response.status_code == 201:
+            created = response.data['booking']
+            with self.lock:
+                self.live_bookings.append((user, created['id'], created['ref_number']))
+        return response.status_code
+
+    def cancel(self, rng, booking):
+        user, booking_id, reference = booking
+        response = self.client(user).patch(
+            reverse('bookings-detail', args=[booking_id]), {'status': 'cancelled'}, format='json'
+        )
+        return response.status_code
+
+    def pay(self, rng, booking):
+        user, booking_id, reference = booking
+        client = self.client(user)
+        response = client.post(reverse('initialize-payment'), {'booking_id': booking_id}, format='json')
+        if response.status_code >= 400:
+            return response.status_code
+        return client.get(reverse('payment-callback'), {'reference': reference}).status_code
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks concurrent bookings, cancellations and payments and checks the seat inventory afterwards.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--trips', type=int, default=1, help='1 for a single hot departure.')
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument('--seats', type=int, default=2, help='Largest group size per booking.')
+        parser.add_argument('--bus-seats', type=int, default=40)
+        parser.add_argument('--seat-choice', choices=['auto', 'random'], default='random',
+                            help='random picks explicit seats, so requests race for the same ones.')
+        parser.add_argument('--mix', default='book=6,cancel=2,pay=2', help='Relative weights of book, cancel, pay.')
+        parser.add_argument('--payment-failure-rate', type=float, default=0.2)
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--keep', action='store_true', help='Keep the generated data for inspection.')
+
+    def handle(self, *args, **options):
+        if connection.vendor == 'sqlite' and options['concurrency'] > 1:
+            self.stdout.write(self.style.WARNING(
+                "SQLite allows one writer at a time, expect 'database is locked' errors; use PostgreSQL for contention numbers."
+            ))
+        created = {'city': None, 'parks': [], 'route': None, 'buses': [], 'trips': [], 'users': []}
+        try:
+            self.create_network(created, options)
+            run = BenchmarkRun(created['trips'], created['users'], options)
+            stub = StubPaystack(options['payment_failure_rate'], options['seed'])
+            with mock.patch('core.views.requests.post', stub.post), mock.patch('core.views.requests.get', stub.get):
+                started = time.perf_counter()
+                if options['concurrency'] == 1:
+                    run.worker(options['seed'], close_connection=False)
+                else:
+                    threads = [
+                        threading.Thread(target=run.worker, args=(options['seed'] + index,))
+                        for index in range(options['concurrency'])
+                    ]
+                    for thread in threads:
+                        thread.start()
+                    for thread in threads:
+                        thread.join()
+                elapsed = time.perf_counter() - started
+
+            self.report(run, options, elapsed)
+            problems = self.check_invariants(created['trips'])
+        finally:
+            if not options['keep']:
+                self.delete_network(created)
+
+        for problem in problems:
+            self.stdout.write(self.style.ERROR(problem))
+        if problems:
+            raise CommandError(f'{len(problems)} inventory invariant(s) violated.')
+        self.stdout.write(self.style.SUCCESS('Invariants: OK (no double-booked seat, available seats match assignments)'))
+
+    def create_network(self, created, options):
+        """Fill `created` as rows are made, so a failure part way still leaves them to delete_network."""
+        # Unique per run, so kept or crashed runs never clash on the unique codes, slugs and plates
+        run_id = uuid.uuid4().hex[:8]
+        tag = f"{PREFIX}-{run_id}"
+        city = created['city'] = City.objects.create(
+            name=f"Bench {tag}", state="Bench", slug=tag, latitude=6.5, longitude=3.4
+        )
+        origin = BusPark.objects.create(name=f"{tag} A", code=f"B{run_id}A", city=city, latitude=6.5, longitude=3.4)
+        created['parks'].append(origin)
+        destination = BusPark.objects.create(
+            name=f"{tag} B", code=f"B{run_id}B", city=city, latitude=6.6, longitude=3.5
+        )
+        created['parks'].append(destination)
+        route = created['route'] = Route.objects.create(
+            origin_park=origin, destination_park=destination, distance_km=20, estimated_duration_min=45
+        )
+        # Far enough out that cancellations are allowed
+        departure = timezone.now() + timedelta(days=3)
+        for index in range(options['trips']):
+            bus = Bus.objects.create(number_plate=f"{tag}-{index}"[-20:], total_seats=options['bus_seats'], park=origin)
+            created['buses'].append(bus)
+            created['trips'].append(Trip.objects.create(
+                route=route, bus=bus, departure_datetime=departure + timedelta(minutes=index),
+                seat_price=1000, available_seats=bus.total_seats,
+            ))
+        for index in range(options['users']):
+            created['users'].append(User.objects.create_user(email=f"{tag}-{index}@bench.invalid", password=None))
+
+    def delete_network(self, created):
+        User.objects.filter(id__in=[user.id for user in created['users']]).delete()
+        Trip.objects.filter(id__in=[trip.id for trip in created['trips']]).delete()
+        if created['route'] is not None:
+            created['route'].delete()
+        Bus.objects.filter(id__in=[bus.id for bus in created['buses']]).delete()
+        BusPark.objects.filter(id__in=[park.id for park in created['parks']]).delete()
+        if created['city'] is not None:
+            created['city'].delete()
+
+    def report(self, run, options, elapsed):
+        total = sum(len(latencies) for latencies in run.latencies.values())
+        self.stdout.write(
+            f"{total} requests in {elapsed:.2f}s ({total / elapsed:.1f} req/s), "
+            f"{options['concurrency']} threads, {options['trips']} trip(s), {connection.vendor}"
+        )
+        self.stdout.write(f"{'operation':<10}{'count':>7}{'ok':>7}{'rejected':>10}{'errors':>8}{'p50 ms':>9}{'p99 ms':>9}")
+        for operation in OPERATIONS:
+            latencies = run.latencies.get(operation)
+            if not latencies:
+                continue
+            outcomes = run.outcomes[operation]
+            self.stdout.write(
+                f"{operation:<10}{len(latencies):>7}{outcomes['ok']:>7}{outcomes['rejected']:>10}{outcomes['error']:>8}"
+                f"{percentile(latencies, 0.5) * 1000:>9.1f}{percentile(latencies, 0.99) * 1000:>9.1f}"
+            )
+        self.stdout.write(
+            f"Row-locking statements: {len(run.lock_times)}, {sum(run.lock_times):.3f}s in total, "
+            f"p50 {percentile(run.lock_times, 0.5) * 1000:.2f} ms, p99 {percentile(run.lock_times, 0.99) * 1000:.2f} ms"
+        )
+
+    def check_invariants(self, trips):
+        problems = []
+        live = Q(seat_assignments__booking__status__in=["pending", "confirmed"])
+        rows = Trip.objects.filter(id__in=[trip.id for trip in trips]).annotate(
+            live_seats=Count('seat_assignments', filter=live),
+            stale_seats=Count('seat_assignments', filter=~live),
+        ).values_list('id', 'available_seats', 'bus__total_seats', 'live_seats', 'stale_seats')
+        for trip_id, available, total, live_seats, stale_seats in rows:
+            if available != total - live_seats:
+                problems.append(
+                    f"Trip {trip_id}: available_seats is {available}, capacity minus assigned seats is {total - live_seats}"
+                )
+            if stale_seats:
+                problems.append(f"Trip {trip_id}: {stale_seats} seat(s) still assigned to inactive bookings")
+
+        doubled = SeatAssignment.objects.filter(trip__in=trips).values('trip_id', 'seat_number').annotate(
+            copies=Count('id')
+        ).filter(copies__gt=1)
+        for row in doubled:
+            problems.append(f"Trip {row['trip_id']}: seat {row['seat_number']} booked {row['copies']} times")
+
+        mismatched = Booking.objects.filter(trip__in=trips, status__in=["pending", "confirmed"]).annotate(
+            assigned=Count('seat_assignments')
+        ).exclude(assigned=F('seat_count'))
+        for booking_id, seat_count, assigned in mismatched.values_list('id', 'seat_count', 'assigned'):
+            problems.append(f"Booking {booking_id}: {seat_count} seats paid for, {assigned} assigned")
+        return problems
@@ -0,0 +1,31 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core import inventory
+
+
+class Command(BaseCommand):
+    help = "Finds upcoming trips whose available_seats disagrees with their seat assignments and recounts them."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report drift without repairing it.')
+        parser.add_argument(
+            '--loop', action='store_true',
+            help='Keep running every SEAT_INVENTORY_CHECK_INTERVAL_SECONDS instead of once.',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            drift, stale = inventory.run(dry_run=options['dry_run'])
+            for trip_id, available, expected in drift:
+                self.stdout.write(f'Trip {trip_id}: {available} available, expected {expected}')
+            summary = f'{len(drift)} trips drifted, {stale} seats held by cancelled bookings'
+            if options['dry_run'] or not (drift or stale):
+                self.stdout.write(self.style.SUCCESS(f'{summary}.'))
+            else:
+                self.stdout.write(self.style.SUCCESS(f'{summary}; repaired.'))
+            if not options['loop']:
+                return
+            time.sleep(settings.SEAT_INVENTORY_CHECK_INTERVAL_SECONDS)
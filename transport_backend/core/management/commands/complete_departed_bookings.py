@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core import holds
+
+
+class Command(BaseCommand):
+    help = 'Marks pending and confirmed bookings of departed trips completed, in bulk (e.g. hourly from cron).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.BOOKING_COMPLETION_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        completed = holds.complete_departed_bookings(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Completed {completed} bookings of departed trips.'))
@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core import idempotency
+
+
+class Command(BaseCommand):
+    help = 'Deletes Idempotency-Key results older than IDEMPOTENCY_KEY_TTL_HOURS.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.IDEMPOTENCY_PURGE_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        purged = idempotency.purge_expired(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Purged {purged} expired idempotency keys.'))
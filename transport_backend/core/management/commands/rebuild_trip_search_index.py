@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core import search_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the denormalized trip search table (TripSearchEntry) from trips and bookings.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--prune', action='store_true', help='Only drop entries of departed trips.')
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        if options['prune']:
+            deleted = search_index.prune()
+            self.stdout.write(self.style.SUCCESS(f'Pruned {deleted} departed trip entries.'))
+            return
+
+        # One transaction: searches keep reading the old entries until the new ones are in
+        with transaction.atomic():
+            total = search_index.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {total} trip search entries.'))
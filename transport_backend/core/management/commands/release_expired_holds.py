@@ -0,0 +1,25 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core import holds
+
+
+class Command(BaseCommand):
+    help = 'Cancels unpaid bookings whose seat hold expired and gives their seats back to the trip.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.BOOKING_HOLD_REAPER_BATCH_SIZE)
+        parser.add_argument(
+            '--loop', action='store_true',
+            help='Keep running every BOOKING_HOLD_REAPER_INTERVAL_SECONDS instead of once (e.g. from cron).',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            released = holds.release_expired_holds(batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f'Released {released} expired seat holds.'))
+            if not options['loop']:
+                return
+            time.sleep(settings.BOOKING_HOLD_REAPER_INTERVAL_SECONDS)
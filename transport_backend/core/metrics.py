@@ -0,0 +1,39 @@
+import logging
+
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "metrics:"
+
+# Every metric a module reports is registered here at import time so the
+# metrics endpoint can read them all back in a single get_many().
+_registered = set()
+
+
+def register(*names):
+    _registered.update(names)
+
+
+def incr(name, delta=1):
+    """Increment a counter kept in the shared cache."""
+    key = KEY_PREFIX + name
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        # First use (or evicted): create it, then increment atomically
+        cache.add(key, 0, None)
+        try:
+            cache.incr(key, delta)
+        except ValueError:
+            logger.warning(f"Could not increment metric {name}")
+
+
+def set_value(name, value):
+    """Record a gauge (last run duration, last batch size, ...)."""
+    cache.set(KEY_PREFIX + name, value, None)
+
+
+def snapshot():
+    values = cache.get_many([KEY_PREFIX + name for name in _registered])
+    return {name: values.get(KEY_PREFIX + name, 0) for name in sorted(_registered)}
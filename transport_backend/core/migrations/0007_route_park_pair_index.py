@@ -0,0 +1,17 @@
+# Generated by Django 5.1.7 on 2026-10-18 06:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_seatassignment'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='route',
+            index=models.Index(fields=['origin_park', 'destination_park'], name='route_park_pair_idx'),
+        ),
+    ]
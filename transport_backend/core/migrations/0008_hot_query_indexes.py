@@ -0,0 +1,43 @@
+# Generated by Django 5.1.7 on 2026-10-18 06:35
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_route_park_pair_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='city',
+            options={},
+        ),
+        migrations.AlterModelOptions(
+            name='trip',
+            options={},
+        ),
+        migrations.RemoveIndex(
+            model_name='seatassignment',
+            name='core_seatas_trip_id_6547c0_idx',
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['user', 'created_at'], name='booking_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(condition=models.Q(('status__in', ['pending', 'confirmed'])), fields=['trip', 'seat_count'], name='booking_active_seats_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='trip',
+            index=models.Index(fields=['route', 'departure_datetime'], name='trip_route_departure_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='trip',
+            index=models.Index(fields=['bus', 'departure_datetime'], name='trip_bus_departure_idx'),
+        ),
+    ]
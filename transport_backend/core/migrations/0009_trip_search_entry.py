@@ -0,0 +1,93 @@
+# Generated by Django 5.1.7 on 2026-10-18 06:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+
+def populate_search_entries(apps, schema_editor):
+    # A frozen copy of core.search_index as of this migration, so later
+    # changes to the index code do not change what it does
+    Trip = apps.get_model('core', 'Trip')
+    TripSearchEntry = apps.get_model('core', 'TripSearchEntry')
+
+    active = Q(bookings__status__in=["pending", "confirmed"])
+    rows = Trip.objects.filter(
+        departure_datetime__gte=timezone.now()
+    ).annotate(
+        active_bookings_count=Count('bookings', filter=active),
+        active_seats_taken=Sum('bookings__seat_count', filter=active),
+    ).order_by('id').values_list(
+        'id', 'route_id', 'bus_id', 'route__origin_park_id', 'route__destination_park_id',
+        'route__origin_park__city_id', 'route__destination_park__city_id',
+        'route__origin_park__name', 'route__destination_park__name', 'bus__number_plate',
+        'route__distance_km', 'departure_datetime', 'seat_price', 'available_seats', 'bus__total_seats',
+        'active_bookings_count', 'active_seats_taken',
+        'route__status', 'route__origin_park__status', 'route__destination_park__status',
+    )
+    TripSearchEntry.objects.bulk_create((
+        TripSearchEntry(
+            trip_id=trip_id,
+            route_id=route_id,
+            bus_id=bus_id,
+            origin_park_id=origin_park_id,
+            destination_park_id=destination_park_id,
+            origin_city_id=origin_city_id,
+            destination_city_id=destination_city_id,
+            origin_park_name=origin_park_name,
+            destination_park_name=destination_park_name,
+            bus_number_plate=number_plate,
+            distance_km=distance_km,
+            travel_date=timezone.localtime(departure).date(),
+            departure_datetime=departure,
+            seat_price=seat_price,
+            available_seats=available_seats,
+            total_seats=total_seats,
+            bookings_count=bookings_count,
+            seats_taken=seats_taken or 0,
+            bookable=route_status == 'active' and origin_status == 'active' and destination_status == 'active',
+        )
+        for (trip_id, route_id, bus_id, origin_park_id, destination_park_id, origin_city_id, destination_city_id,
+             origin_park_name, destination_park_name, number_plate, distance_km, departure, seat_price,
+             available_seats, total_seats, bookings_count, seats_taken,
+             route_status, origin_status, destination_status) in rows.iterator(chunk_size=2000)
+    ), batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TripSearchEntry',
+            fields=[
+                ('trip', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_entry', serialize=False, to='core.trip')),
+                ('route_id', models.BigIntegerField()),
+                ('bus_id', models.BigIntegerField()),
+                ('origin_park_id', models.BigIntegerField()),
+                ('destination_park_id', models.BigIntegerField()),
+                ('origin_city_id', models.BigIntegerField()),
+                ('destination_city_id', models.BigIntegerField()),
+                ('origin_park_name', models.CharField(max_length=100)),
+                ('destination_park_name', models.CharField(max_length=100)),
+                ('bus_number_plate', models.CharField(max_length=20)),
+                ('distance_km', models.FloatField()),
+                ('travel_date', models.DateField()),
+                ('departure_datetime', models.DateTimeField()),
+                ('seat_price', models.FloatField(null=True)),
+                ('available_seats', models.PositiveIntegerField(null=True)),
+                ('total_seats', models.PositiveIntegerField()),
+                ('bookings_count', models.PositiveIntegerField(default=0)),
+                ('seats_taken', models.PositiveIntegerField(default=0)),
+                ('bookable', models.BooleanField(default=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['origin_park_id', 'destination_park_id', 'departure_datetime', 'trip'], name='tripsearch_park_pair_idx'), models.Index(fields=['origin_city_id', 'destination_city_id', 'departure_datetime', 'trip'], name='tripsearch_city_pair_idx')],
+            },
+        ),
+        migrations.RunPython(populate_search_entries, migrations.RunPython.noop),
+    ]
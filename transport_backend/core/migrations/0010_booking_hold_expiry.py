@@ -0,0 +1,36 @@
+# Generated by Django 5.1.7 on 2026-10-18 06:56
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F
+
+
+def expire_existing_holds(apps, schema_editor):
+    # Unpaid bookings made before holds existed expire as if they had one
+    Booking = apps.get_model('core', 'Booking')
+    Booking.objects.filter(status='pending').update(
+        hold_expires_at=F('created_at') + timedelta(minutes=settings.BOOKING_HOLD_MINUTES)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_trip_search_entry'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='booking',
+            name='hold_expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['hold_expires_at'], name='booking_hold_expiry_idx'),
+        ),
+        migrations.RunPython(expire_existing_holds, migrations.RunPython.noop),
+    ]
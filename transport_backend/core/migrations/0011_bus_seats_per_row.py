@@ -0,0 +1,19 @@
+# Generated by Django 5.1.7 on 2026-10-18 06:59
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_booking_hold_expiry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bus',
+            name='seats_per_row',
+            field=models.PositiveSmallIntegerField(default=4, validators=[django.core.validators.MinValueValidator(1)]),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.7 on 2026-10-18 07:04
+
+from django.db import migrations, models
+
+
+def create_sequences(apps, schema_editor):
+    IdentifierSequence = apps.get_model('core', 'IdentifierSequence')
+    for name in ('booking_reference', 'temp_nin'):
+        IdentifierSequence.objects.get_or_create(name=name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_bus_seats_per_row'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdentifierSequence',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('next_value', models.BigIntegerField(default=1)),
+            ],
+        ),
+        migrations.RunPython(create_sequences, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,7 @@
+from django.core.validators import MinValueValidator
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
 
 
 class City(models.Model):
@@ -11,7 +13,6 @@ class City(models.Model):
 
     class Meta:
         unique_together = ('name', 'state')
-        ordering = ['state', 'name']
 
     def __str__(self):
         return f"{self.name}, {self.state}"
@@ -39,6 +40,12 @@ class Route(models.Model):
     estimated_duration_min = models.PositiveIntegerField(null=True, blank=True)
     status = models.CharField(max_length=20, choices=[('active', 'Active'), ('disabled', 'Disabled')], default='active')
 
+    class Meta:
+        indexes = [
+            # Park-pair lookups for city-to-city search
+            models.Index(fields=['origin_park', 'destination_park'], name='route_park_pair_idx'),
+        ]
+
     def __str__(self):
         return f"{self.origin_park.name} ➜ {self.destination_park.name}"
 
@@ -62,6 +69,8 @@ class Bus(models.Model):
 
     number_plate = models.CharField(max_length=20, unique=True)
     total_seats = models.PositiveIntegerField(default=24)
+    # Seat layout: seats are numbered row by row from the front
+    seats_per_row = models.PositiveSmallIntegerField(default=4, validators=[MinValueValidator(1)])
     park = models.ForeignKey('BusPark', on_delete=models.CASCADE, related_name='buses')
     driver_name = models.CharField(max_length=100, blank=True, null=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='available')
@@ -84,18 +93,24 @@ class Trip(models.Model):
 
     class Meta:
         unique_together = ('route', 'bus', 'departure_datetime')
-        ordering = ['departure_datetime']
+        indexes = [
+            # Search: park pair -> routes -> departures in a time range
+            models.Index(fields=['route', 'departure_datetime'], name='trip_route_departure_idx'),
+            # Bus clash checks when scheduling trips
+            models.Index(fields=['bus', 'departure_datetime'], name='trip_bus_departure_idx'),
+        ]
 
     def __str__(self):
-        return f"{self.route} on {self.departure_datetime.date()}"
+        return f"{self.route} on {self.travel_date}"
 
     @property
     def travel_date(self):
-        return self.departure_datetime.date()
+        # Travel days are Lagos days, not UTC days
+        return timezone.localtime(self.departure_datetime).date()
 
     @property
     def departure_time(self):
-        return self.departure_datetime.time()
+        return timezone.localtime(self.departure_datetime).time()
 
     def save(self, *args, **kwargs):
         # If creating a new Trip and no explicit 'available_seats', 
@@ -107,6 +122,68 @@ class Trip(models.Model):
             raise ValueError("Available seats cannot exceed the bus total seats.")
         super().save(*args, **kwargs)
 
+class IdentifierSequence(models.Model):
+    """Next free number of an identifier kind, handed out in blocks by core.identifiers."""
+    name = models.CharField(max_length=50, primary_key=True)
+    next_value = models.BigIntegerField(default=1)
+
+    def __str__(self):
+        return f"{self.name} at {self.next_value}"
+
+
+class TripSearchEntry(models.Model):
+    """
+    Denormalized search row for an upcoming trip, kept in step with Trip,
+    Booking, Route, BusPark and Bus writes by core.search_index so searches
+    read one table without joins or booking aggregates.
+    """
+    trip = models.OneToOneField(Trip, on_delete=models.CASCADE, primary_key=True, related_name='search_entry')
+    route_id = models.BigIntegerField()
+    bus_id = models.BigIntegerField()
+    origin_park_id = models.BigIntegerField()
+    destination_park_id = models.BigIntegerField()
+    origin_city_id = models.BigIntegerField()
+    destination_city_id = models.BigIntegerField()
+    origin_park_name = models.CharField(max_length=100)
+    destination_park_name = models.CharField(max_length=100)
+    bus_number_plate = models.CharField(max_length=20)
+    distance_km = models.FloatField()
+    travel_date = models.DateField()  # Local (Lagos) day of departure
+    departure_datetime = models.DateTimeField()
+    seat_price = models.FloatField(null=True)
+    available_seats = models.PositiveIntegerField(null=True)
+    total_seats = models.PositiveIntegerField()
+    bookings_count = models.PositiveIntegerField(default=0)
+    seats_taken = models.PositiveIntegerField(default=0)
+    # City searches only offer active routes between active parks
+    bookable = models.BooleanField(default=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['origin_park_id', 'destination_park_id', 'departure_datetime', 'trip'],
+                name='tripsearch_park_pair_idx',
+            ),
+            models.Index(
+                fields=['origin_city_id', 'destination_city_id', 'departure_datetime', 'trip'],
+                name='tripsearch_city_pair_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f"Search entry for trip {self.trip_id}"
+
+
+class BookingCart(models.Model):
+    """Bookings on several trips (e.g. a return journey) made in one request and paid with one reference."""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='booking_carts')
+    payment_reference = models.CharField(max_length=100, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Cart {self.payment_reference}"
+
+
 class Booking(models.Model):
     STATUS_CHOICES = (
         ('confirmed', 'Confirmed'),
@@ -131,6 +208,27 @@ class Booking(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     # How many seats this booking is actually taking
     seat_count = models.PositiveIntegerField(default=1)
+    # Unpaid bookings hold their seats until then (see core.holds); cleared once paid
+    hold_expires_at = models.DateTimeField(null=True, blank=True)
+    # Set when booked as one leg of a cart; the cart's legs are paid for, confirmed and released together
+    cart = models.ForeignKey(BookingCart, on_delete=models.SET_NULL, null=True, blank=True, related_name='bookings')
+
+    class Meta:
+        indexes = [
+            # A passenger's bookings, newest first
+            models.Index(fields=['user', 'created_at'], name='booking_user_created_idx'),
+            # The hold reaper's scan, oldest expiry first
+            models.Index(
+                fields=['hold_expires_at'], name='booking_hold_expiry_idx',
+                condition=models.Q(status='pending'),
+            ),
+            # Seat/booking totals per trip only ever look at live bookings;
+            # including seat_count lets them be answered from the index alone
+            models.Index(
+                fields=['trip', 'seat_count'], name='booking_active_seats_idx',
+                condition=models.Q(status__in=['pending', 'confirmed']),
+            ),
+        ]
 
     def __str__(self):
          return f"{self.user.email} | {self.trip.route.origin_park.name} → {self.trip.route.destination_park.name}"
@@ -142,10 +240,8 @@ class SeatAssignment(models.Model):
     seat_number = models.PositiveIntegerField()
 
     class Meta:
-        unique_together = ('trip', 'seat_number')  # Ensure a seat is only booked once per trip
-        indexes = [
-            models.Index(fields=['trip', 'seat_number']),
-        ]
+        # Ensure a seat is only booked once per trip; its unique index also serves (trip, seat) lookups
+        unique_together = ('trip', 'seat_number')
 
     def __str__(self):
         return f"Seat {self.seat_number} for Booking {self.booking.id} on Trip {self.trip.id}"
@@ -153,4 +249,52 @@ class SeatAssignment(models.Model):
     def clean(self):
         # Validate that seat_number is within the bus's total seats
         if self.seat_number < 1 or self.seat_number > self.trip.bus.total_seats:
-            raise models.ValidationError(f"Seat number must be between 1 and {self.trip.bus.total_seats}.")
\ No newline at end of file
+            raise models.ValidationError(f"Seat number must be between 1 and {self.trip.bus.total_seats}.")
+
+class IdempotencyKey(models.Model):
+    """Result of a request sent with an Idempotency-Key header, replayed by core.idempotency."""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='idempotency_keys')
+    scope = models.CharField(max_length=50)  # The endpoint the key was used on
+    key = models.CharField(max_length=255)
+    request_hash = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)  # None while the request runs
+    response_body = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        unique_together = ('user', 'scope', 'key')
+
+    def __str__(self):
+        return f"{self.scope} key {self.key} of user {self.user_id}"
+
+
+class WaitlistEntry(models.Model):
+    """A passenger queued for seats on a sold-out trip, see core.waitlist."""
+    STATUS_CHOICES = (
+        ('waiting', 'Waiting'),
+        ('promoted', 'Promoted'),  # Given a pending booking holding the freed seats
+        ('left', 'Left'),
+    )
+
+    trip = models.ForeignKey(Trip, on_delete=models.CASCADE, related_name='waitlist')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='waitlist_entries')
+    seat_count = models.PositiveIntegerField(default=1, validators=[MinValueValidator(1)])
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='waiting')
+    created_at = models.DateTimeField(auto_now_add=True)
+    booking = models.ForeignKey(Booking, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    promoted_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['trip', 'user'], condition=models.Q(status='waiting'), name='waitlist_one_entry_per_passenger',
+            ),
+        ]
+        indexes = [
+            # A trip's queue in order, and positions in it
+            models.Index(fields=['trip', 'created_at'], name='waitlist_queue_idx', condition=models.Q(status='waiting')),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} waiting for {self.seat_count} seats on Trip {self.trip_id} ({self.status})"
@@ -0,0 +1,209 @@
+"""
+In-process typeahead index over city names/states and park names/codes.
+
+Every word of a place is indexed by each of its prefixes (from
+PLACE_SUGGEST_MIN_FUZZY_PREFIX letters on) and by those prefixes with one
+letter deleted. A query word is looked up as-is and with each of its letters
+deleted, which finds every word starting within one edit of it ("ibaden" ->
+"ibadan") with a handful of dictionary lookups, whatever the catalog size.
+Shorter one-word queries ("i", "ib") match too many places to rank per
+request, their top results are ranked once at build time.
+"""
+import bisect
+import heapq
+import logging
+import re
+import threading
+import time
+import unicodedata
+from collections import namedtuple
+
+from django.conf import settings
+from django.db.models import Count
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+metrics.register("place_suggest.rebuilds")
+
+Place = namedtuple('Place', ['key', 'kind', 'popularity', 'label', 'payload'])
+
+
+def normalize(text):
+    text = unicodedata.normalize('NFKD', text or '').encode('ascii', 'ignore').decode()
+    return re.sub(r'[^a-z0-9]+', ' ', text.lower()).split()
+
+
+def _deletions(word):
+    return {word[:index] + word[index + 1:] for index in range(len(word))}
+
+
+class PlaceIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._words = []     # sorted distinct words, for short prefixes
+        self._by_word = {}   # word -> place keys
+        self._prefixes = {}  # prefix or prefix minus one letter -> words
+        self._short = {}     # (short prefix, kind) -> best places
+        self._places = {}
+        self.built_at = None
+
+    # -- maintenance -------------------------------------------------------
+
+    def _popularity(self):
+        from .models import Booking
+
+        counts = {}
+        live = Booking.objects.exclude(status='cancelled').exclude(trip=None)
+        for side in ('origin_park', 'destination_park'):
+            rows = live.values_list(f'trip__route__{side}', f'trip__route__{side}__city').annotate(total=Count('id'))
+            for park_id, city_id, total in rows:
+                counts[('park', park_id)] = counts.get(('park', park_id), 0) + total
+                counts[('city', city_id)] = counts.get(('city', city_id), 0) + total
+        return counts
+
+    def _catalog(self, popularity):
+        from .models import City, BusPark
+
+        for city_id, name, state, slug in City.objects.values_list('id', 'name', 'state', 'slug'):
+            key = ('city', city_id)
+            yield Place(key, 'city', popularity.get(key, 0), f"{name}, {state}", {
+                "type": "city", "id": city_id, "name": name, "state": state, "slug": slug,
+            }), normalize(name) + normalize(state)
+
+        parks = BusPark.objects.filter(status='active').values_list('id', 'name', 'code', 'city_id', 'city__name')
+        for park_id, name, code, city_id, city_name in parks:
+            key = ('park', park_id)
+            yield Place(key, 'park', popularity.get(key, 0), name, {
+                "type": "park", "id": park_id, "name": name, "code": code,
+                "city": {"id": city_id, "name": city_name},
+            }), normalize(name) + normalize(code)
+
+    def rebuild(self):
+        min_prefix = settings.PLACE_SUGGEST_MIN_FUZZY_PREFIX
+        places = {}
+        by_word = {}
+        prefixes = {}
+        for place, words in self._catalog(self._popularity()):
+            places[place.key] = place
+            for word in words:
+                by_word.setdefault(word, set()).add(place.key)
+
+        for word in by_word:
+            for length in range(min_prefix, min(len(word), settings.PLACE_SUGGEST_MAX_PREFIX) + 1):
+                prefix = word[:length]
+                prefixes.setdefault(prefix, set()).add(word)
+                for variant in _deletions(prefix):
+                    prefixes.setdefault(variant, set()).add(word)
+
+        short_keys = {}
+        for word, keys in by_word.items():
+            for length in range(1, min_prefix):
+                short_keys.setdefault(word[:length], set()).update(keys)
+        short = {}
+        for prefix, keys in short_keys.items():
+            ranked = sorted((places[key] for key in keys), key=_rank)
+            for kind in (None, 'city', 'park'):
+                short[prefix, kind] = [
+                    place for place in ranked if kind is None or place.kind == kind
+                ][:settings.PLACE_SUGGEST_MAX_LIMIT]
+
+        with self._lock:
+            self._words = sorted(by_word)
+            self._by_word = by_word
+            self._prefixes = prefixes
+            self._short = short
+            self._places = places
+            self.built_at = time.monotonic()
+        metrics.incr("place_suggest.rebuilds")
+        logger.info(f"Place suggest index rebuilt with {len(places)} places and {len(by_word)} words")
+
+    def invalidate(self):
+        with self._lock:
+            self.built_at = None
+
+    def ensure_fresh(self):
+        built_at = self.built_at
+        if built_at is None or time.monotonic() - built_at > settings.PLACE_SUGGEST_REFRESH_SECONDS:
+            self.rebuild()
+
+    # -- queries -----------------------------------------------------------
+
+    def _matching_words(self, term):
+        """{word: typo} for indexed words starting with `term`, or within one edit of it."""
+        if len(term) < settings.PLACE_SUGGEST_MIN_FUZZY_PREFIX:
+            words = self._words
+            start = bisect.bisect_left(words, term)
+            end = bisect.bisect_left(words, term + '\x7f')
+            return {word: False for word in words[start:end]}
+
+        max_prefix = settings.PLACE_SUGGEST_MAX_PREFIX
+        exact = term[:max_prefix]
+        matches = {word: False for word in self._prefixes.get(exact, ()) if word.startswith(term)}
+        if len(term) < settings.PLACE_SUGGEST_MIN_TYPO_LENGTH:
+            return matches
+
+        # Prefix minus a letter (insertion), query minus a letter (deletion), both (substitution)
+        candidates = set(self._prefixes.get(exact, ()))
+        for variant in _deletions(exact):
+            candidates.update(self._prefixes.get(variant, ()))
+        for word in candidates:
+            if word not in matches and _within_one_edit(term, word):
+                matches[word] = True
+        return matches
+
+    def suggest(self, query, limit=8, kind=None):
+        terms = normalize(query)
+        if not terms:
+            return []
+        if len(terms) == 1 and len(terms[0]) < settings.PLACE_SUGGEST_MIN_FUZZY_PREFIX:
+            return [_describe(place, False) for place in self._short.get((terms[0], kind), ())[:limit]]
+
+        # Every query word must match a word of the place; typos rank lower
+        scores = None
+        for term in terms:
+            term_scores = {}
+            for word, typo in self._matching_words(term).items():
+                for key in self._by_word.get(word, ()):
+                    term_scores[key] = min(term_scores.get(key, 1), int(typo))
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {key: max(score, term_scores[key]) for key, score in scores.items() if key in term_scores}
+            if not scores:
+                return []
+
+        places = self._places
+        found = heapq.nsmallest(
+            limit,
+            (places[key] for key in scores if kind is None or places[key].kind == kind),
+            key=lambda place: (scores[place.key], _rank(place)),
+        )
+        return [_describe(place, scores[place.key]) for place in found]
+
+
+def _rank(place):
+    return -place.popularity, place.label, place.key
+
+
+def _describe(place, typo):
+    return dict(place.payload, popularity=place.popularity, typo=bool(typo))
+
+
+def _within_one_edit(term, word):
+    """True when some prefix of `word` is within one edit of `term`."""
+    for prefix in {word[:len(term) - 1], word[:len(term)], word[:len(term) + 1]}:
+        if abs(len(prefix) - len(term)) > 1:
+            continue
+        if len(prefix) == len(term):
+            if sum(a != b for a, b in zip(prefix, term)) <= 1:
+                return True
+        else:
+            shorter, longer = sorted((prefix, term), key=len)
+            if any(longer[:index] + longer[index + 1:] == shorter for index in range(len(longer))):
+                return True
+    return False
+
+
+place_index = PlaceIndex()
@@ -0,0 +1,110 @@
+"""
+Maintenance of TripSearchEntry, the denormalized trip search table.
+
+Entries are recomputed from their source rows (never patched field by field)
+inside the caller's transaction, so a booking, cancellation or trip edit and
+its search entry commit or roll back together. Only upcoming trips have an
+entry; `rebuild_trip_search_index --prune` drops the ones that departed.
+"""
+import logging
+
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+ENTRY_FIELDS = [
+    'route_id', 'bus_id', 'origin_park_id', 'destination_park_id', 'origin_city_id', 'destination_city_id',
+    'origin_park_name', 'destination_park_name', 'bus_number_plate', 'distance_km', 'travel_date',
+    'departure_datetime', 'seat_price', 'available_seats', 'total_seats', 'bookings_count', 'seats_taken',
+    'bookable',
+]
+
+
+def _entries(trips):
+    from .models import TripSearchEntry
+
+    active = Q(bookings__status__in=["pending", "confirmed"])
+    rows = trips.filter(
+        departure_datetime__gte=timezone.now()
+    ).annotate(
+        active_bookings_count=Count('bookings', filter=active),
+        active_seats_taken=Sum('bookings__seat_count', filter=active),
+    ).values_list(
+        'id', 'route_id', 'bus_id', 'route__origin_park_id', 'route__destination_park_id',
+        'route__origin_park__city_id', 'route__destination_park__city_id',
+        'route__origin_park__name', 'route__destination_park__name', 'bus__number_plate',
+        'route__distance_km', 'departure_datetime', 'seat_price', 'available_seats', 'bus__total_seats',
+        'active_bookings_count', 'active_seats_taken',
+        'route__status', 'route__origin_park__status', 'route__destination_park__status',
+    )
+    for (trip_id, route_id, bus_id, origin_park_id, destination_park_id, origin_city_id, destination_city_id,
+         origin_park_name, destination_park_name, number_plate, distance_km, departure, seat_price,
+         available_seats, total_seats, bookings_count, seats_taken,
+         route_status, origin_status, destination_status) in rows:
+        yield TripSearchEntry(
+            trip_id=trip_id,
+            route_id=route_id,
+            bus_id=bus_id,
+            origin_park_id=origin_park_id,
+            destination_park_id=destination_park_id,
+            origin_city_id=origin_city_id,
+            destination_city_id=destination_city_id,
+            origin_park_name=origin_park_name,
+            destination_park_name=destination_park_name,
+            bus_number_plate=number_plate,
+            distance_km=distance_km,
+            travel_date=timezone.localtime(departure).date(),
+            departure_datetime=departure,
+            seat_price=seat_price,
+            available_seats=available_seats,
+            total_seats=total_seats,
+            bookings_count=bookings_count,
+            seats_taken=seats_taken or 0,
+            bookable=route_status == 'active' and origin_status == 'active' and destination_status == 'active',
+        )
+
+
+def sync(**filters):
+    """
+    Recompute the entries of the trips matching `filters` (e.g. id__in=...,
+    route_id=..., bus_id=...). Trips that departed or no longer match lose
+    their entry.
+    """
+    from .models import Trip, TripSearchEntry
+
+    trips = Trip.objects.filter(**filters)
+    entries = list(_entries(trips))
+    TripSearchEntry.objects.filter(trip__in=trips).exclude(trip__in=[entry.trip_id for entry in entries]).delete()
+    if entries:
+        TripSearchEntry.objects.bulk_create(
+            entries, update_conflicts=True, unique_fields=['trip'], update_fields=ENTRY_FIELDS,
+        )
+    return len(entries)
+
+
+def sync_trips(trip_ids):
+    trip_ids = [trip_id for trip_id in trip_ids if trip_id is not None]
+    if trip_ids:
+        sync(id__in=trip_ids)
+
+
+def rebuild(batch_size=2000):
+    """Rebuild every entry from scratch, batch by batch of trip ids."""
+    from .models import Trip, TripSearchEntry
+
+    TripSearchEntry.objects.all().delete()
+    upcoming = Trip.objects.filter(departure_datetime__gte=timezone.now()).order_by('id')
+    trip_ids = list(upcoming.values_list('id', flat=True))
+    total = 0
+    for start in range(0, len(trip_ids), batch_size):
+        total += sync(id__in=trip_ids[start:start + batch_size])
+    logger.info(f"Trip search index rebuilt with {total} entries")
+    return total
+
+
+def prune():
+    from .models import TripSearchEntry
+
+    deleted, _ = TripSearchEntry.objects.filter(departure_datetime__lt=timezone.now()).delete()
+    return deleted
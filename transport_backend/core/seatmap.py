@@ -0,0 +1,197 @@
+"""
+Seat maps as bitsets, with a per-trip change log for cheap refreshes.
+
+A seat map is two bitsets over the bus' seats, `occupied` and `held`
+(pending bookings), base64 encoded with seat n at bit (n - 1) % 8 of byte
+(n - 1) // 8. Its version is a per-trip sequence kept in the cache: each
+committed change increments it and stores the seats it touched under the new
+number, so "changes since V" is a get_many over V+1..current. The sequence
+starts from a microsecond timestamp, so it keeps increasing if the cache
+drops it, and any missing log entry makes the client fall back to the full
+map.
+"""
+import base64
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+metrics.register("seat_map.full", "seat_map.delta", "seat_map.delta_fallback")
+
+SEQUENCE_PREFIX = "seatmap:seq:"
+LOG_PREFIX = "seatmap:log:"
+
+FREE, HELD, OCCUPIED = "free", "held", "occupied"
+
+
+def encode_bits(seat_numbers, total_seats):
+    bits = bytearray((total_seats + 7) // 8)
+    for seat in seat_numbers:
+        if 1 <= seat <= total_seats:
+            bits[(seat - 1) // 8] |= 1 << ((seat - 1) % 8)
+    return base64.b64encode(bytes(bits)).decode()
+
+
+def decode_bits(encoded):
+    bits = base64.b64decode(encoded)
+    return [index + 1 for index in range(len(bits) * 8) if bits[index // 8] & (1 << (index % 8))]
+
+
+def _state(booking_status):
+    # Any other assignment still blocks the seat for new bookings
+    return HELD if booking_status == "pending" else OCCUPIED
+
+
+def seat_states(trip_id, seat_numbers=None):
+    """{seat_number: state} for assigned seats, optionally only the given ones."""
+    from .models import SeatAssignment
+
+    assignments = SeatAssignment.objects.filter(trip_id=trip_id)
+    if seat_numbers is not None:
+        assignments = assignments.filter(seat_number__in=seat_numbers)
+    return {seat: _state(status) for seat, status in assignments.values_list('seat_number', 'booking__status')}
+
+
+# -- automatic allocation -------------------------------------------------------
+#
+# Seats are numbered row by row from the front, `seats_per_row` to a row, and
+# seat n is bit n - 1 of a Python int, so run and row checks are a handful of
+# shifts and ands over the whole bus instead of loops over seats.
+
+def occupancy_mask(seat_numbers):
+    mask = 0
+    for seat in seat_numbers:
+        mask |= 1 << (seat - 1)
+    return mask
+
+
+def _seats(mask):
+    seats = []
+    while mask:
+        low = mask & -mask
+        seats.append(low.bit_length())
+        mask ^= low
+    return seats
+
+
+def _runs(free, count):
+    """Bit i set when seats i + 1 .. i + count are all free."""
+    runs = free
+    for shift in range(1, count):
+        runs &= free >> shift
+    return runs
+
+
+def choose_seats(taken, total_seats, count, seats_per_row):
+    """
+    Pick `count` free seats given the `taken` bitset, keeping a group
+    together: side by side in one row, else in one row, else consecutive
+    seats over neighbouring rows, else the frontmost free seats. Returns
+    seat numbers, or None when fewer than `count` seats are free.
+    """
+    free = ~taken & ((1 << total_seats) - 1)
+    if count < 1 or free.bit_count() < count:
+        return None
+    row_mask = (1 << seats_per_row) - 1
+
+    if count <= seats_per_row:
+        # Runs that start early enough in their row to end in it
+        starts = 0
+        for row_start in range(0, total_seats, seats_per_row):
+            starts |= ((1 << (seats_per_row - count + 1)) - 1) << row_start
+        runs = _runs(free, count) & starts
+        if runs:
+            first = (runs & -runs).bit_length() - 1
+            return list(range(first + 1, first + count + 1))
+
+        for row_start in range(0, total_seats, seats_per_row):
+            in_row = free & (row_mask << row_start)
+            if in_row.bit_count() >= count:
+                return _seats(in_row)[:count]
+
+    runs = _runs(free, count)
+    if runs:
+        first = (runs & -runs).bit_length() - 1
+        return list(range(first + 1, first + count + 1))
+    return _seats(free)[:count]
+
+
+# -- version sequence and change log ----------------------------------------
+
+def current_version(trip_id):
+    key = SEQUENCE_PREFIX + str(trip_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns() // 1000, None)
+        version = cache.get(key)
+    return version
+
+
+def log_seat_changes(changes):
+    """Record {trip_id: seat numbers} changed by a committed transaction."""
+    for trip_id, seats in changes.items():
+        if not seats:
+            continue
+        key = SEQUENCE_PREFIX + str(trip_id)
+        current_version(trip_id)
+        try:
+            version = cache.incr(key)
+        except ValueError:
+            logger.warning(f"Seat map sequence for trip {trip_id} vanished, clients will reload")
+            continue
+        cache.set(f"{LOG_PREFIX}{trip_id}:{version}", sorted(seats), settings.SEAT_MAP_LOG_TIMEOUT)
+
+
+def changed_seats_since(trip_id, since):
+    """(version, seats changed after `since`) or (version, None) when the log can't tell."""
+    version = current_version(trip_id)
+    if since > version:
+        return version, None
+    if version - since > settings.SEAT_MAP_LOG_LENGTH:
+        return version, None
+    keys = [f"{LOG_PREFIX}{trip_id}:{number}" for number in range(since + 1, version + 1)]
+    entries = cache.get_many(keys)
+    if len(entries) != len(keys):
+        return version, None  # Evicted, or a writer that has not logged yet
+    return version, {seat for seats in entries.values() for seat in seats}
+
+
+# -- payloads -----------------------------------------------------------------
+
+def full_map(trip_id, total_seats, available_seats, seats_per_row):
+    # Version first: a change landing after it shows up in the next delta
+    version = current_version(trip_id)
+    states = seat_states(trip_id)
+    metrics.incr("seat_map.full")
+    return {
+        "trip_id": trip_id,
+        "version": version,
+        "full": True,
+        "total_seats": total_seats,
+        "seats_per_row": seats_per_row,
+        "available_seats": available_seats,
+        "occupied": encode_bits([seat for seat, state in states.items() if state == OCCUPIED], total_seats),
+        "held": encode_bits([seat for seat, state in states.items() if state == HELD], total_seats),
+    }
+
+
+def delta(trip_id, since):
+    """Changes since `since`, or None when a full map must be sent instead."""
+    version, seats = changed_seats_since(trip_id, since)
+    if seats is None:
+        metrics.incr("seat_map.delta_fallback")
+        return None
+    states = seat_states(trip_id, seats) if seats else {}
+    metrics.incr("seat_map.delta")
+    return {
+        "trip_id": trip_id,
+        "version": version,
+        "full": False,
+        "since": since,
+        "changes": [{"seat": seat, "state": states.get(seat, FREE)} for seat in sorted(seats)],
+    }
@@ -1,11 +1,18 @@
 import uuid
-from .utils import generate_ref_code
+from .utils import generate_cart_ref_code, generate_ref_code
+from . import search_index, seatmap
+from .caching import invalidate_trip_search
+from .holds import hold_expiry
 from datetime import datetime
+from django.conf import settings
 from django.utils import timezone
 from django.db import models
+from django.db.models import Q, F, Prefetch
 from rest_framework import serializers
-from .models import City, BusPark, Route, IndirectRoute, Booking, Trip, Bus, SeatAssignment
-from django.db import transaction
+from .models import (
+    City, BusPark, Route, IndirectRoute, Booking, BookingCart, Trip, Bus, SeatAssignment, TripSearchEntry,
+)
+from django.db import IntegrityError, transaction
 from dateutil.parser import parse
 from dateutil.parser import parse
 import logging
@@ -13,6 +20,59 @@ import pytz
 
 logger = logging.getLogger(__name__)
 
+
+def _split_param(value):
+    return {name.strip() for name in (value or '').split(',') if name.strip()}
+
+
+class SparseFieldsMixin:
+    """
+    `?fields=a,b` limits the payload to those fields (plus `id`). Nested
+    objects listed in `expandable_fields` are left out as soon as either
+    `?fields=` or `?expand=` is used, unless they are requested by name.
+    Without both parameters the full representation is returned, except for
+    `deferred_fields`, which are only sent when asked for.
+
+    Views pass the result of `selected_fields()` in the serializer context
+    and use it to skip loading what will not be serialized.
+    """
+    expandable_fields = ()
+    deferred_fields = ()
+
+    @classmethod
+    def selected_fields(cls, query_params):
+        all_fields = set(cls.Meta.fields)
+        if 'fields' not in query_params and 'expand' not in query_params:
+            return all_fields - set(cls.deferred_fields)
+        if 'fields' in query_params:
+            selected = _split_param(query_params.get('fields')) | {'id'}
+        else:
+            selected = all_fields - set(cls.expandable_fields)
+        return (selected | _split_param(query_params.get('expand'))) & all_fields
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        selected = self.context.get('selected_fields')
+        if selected is not None:
+            for name in set(self.fields) - set(selected):
+                self.fields.pop(name)
+
+
+def side_load_parks_and_buses(rows):
+    """
+    Lookup tables for compact payloads: every park and bus referenced by
+    `rows` once, however many rows point at it.
+    """
+    park_ids = {row[key] for row in rows for key in ('origin_park_id', 'destination_park_id') if key in row}
+    bus_ids = {row['bus_id'] for row in rows if 'bus_id' in row}
+    parks = BusPark.objects.filter(id__in=park_ids).values('id', 'name', 'code', 'city_id', city_name=F('city__name')) if park_ids else []
+    buses = Bus.objects.filter(id__in=bus_ids).values('id', 'number_plate', 'total_seats') if bus_ids else []
+    return {
+        "parks": {park['id']: park for park in parks},
+        "buses": {bus['id']: bus for bus in buses},
+    }
+
+
 class CitySerializer(serializers.ModelSerializer):
     class Meta:
         model = City
@@ -73,7 +133,7 @@ class IndirectRouteSerializer(serializers.ModelSerializer):
         ]
 
 
-class TripListSerializer(serializers.ModelSerializer):
+class TripListSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     bus = serializers.SerializerMethodField()
     route = serializers.SerializerMethodField()
     bookings_count = serializers.SerializerMethodField()
@@ -96,6 +156,44 @@ class TripListSerializer(serializers.ModelSerializer):
             'booked_seats',
         ]
 
+    expandable_fields = ('bus', 'route', 'booked_seats')
+    # Seat pickers read /trips/{id}/seats/; search only sends seat lists on ?expand=booked_seats
+    deferred_fields = ('booked_seats',)
+
+    @staticmethod
+    def setup_eager_loading(queryset, fields=None):
+        # Load everything the serializer touches in a fixed number of queries:
+        # bus/route/parks are joined, booking totals are aggregated in the main
+        # query and booked seats are fetched in one batch for the whole page.
+        # Fields that are not going to be serialized are not loaded at all.
+        if fields is None:
+            fields = set(TripListSerializer.Meta.fields)
+        related = []
+        if 'bus' in fields:
+            related.append('bus')
+        if 'route' in fields:
+            related += ['route__origin_park', 'route__destination_park']
+        if related:
+            queryset = queryset.select_related(*related)
+
+        active = Q(bookings__status__in=["pending", "confirmed"])
+        aggregates = {}
+        if 'bookings_count' in fields:
+            aggregates['active_bookings_count'] = models.Count('bookings', filter=active)
+        if 'seats_taken' in fields:
+            aggregates['active_seats_taken'] = models.Sum('bookings__seat_count', filter=active)
+        if aggregates:
+            queryset = queryset.annotate(**aggregates)
+
+        if 'booked_seats' in fields:
+            queryset = queryset.prefetch_related(
+                Prefetch(
+                    'seat_assignments',
+                    queryset=SeatAssignment.objects.only('id', 'trip', 'seat_number'),
+                )
+            )
+        return queryset
+
     def get_bus(self, obj):
         return {
             "id": obj.bus.id,
@@ -118,27 +216,110 @@ class TripListSerializer(serializers.ModelSerializer):
         }
 
     def get_bookings_count(self, obj):
+        if hasattr(obj, 'active_bookings_count'):
+            return obj.active_bookings_count
         return obj.bookings.filter(status__in=["pending", "confirmed"]).count()
 
     def get_seats_taken(self, obj):
+        if hasattr(obj, 'active_seats_taken'):
+            return obj.active_seats_taken or 0
         return obj.bookings.filter(status__in=["pending", "confirmed"]).aggregate(
             total_seats=models.Sum('seat_count')
         )['total_seats'] or 0
 
     def get_booked_seats(self, obj):
-        return list(SeatAssignment.objects.filter(trip=obj).values_list('seat_number', flat=True))
+        # Served from the prefetch cache when setup_eager_loading() was used
+        return [seat.seat_number for seat in obj.seat_assignments.all()]
+
+
+class TripCompactSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    """
+    Flat trip rows (`?compact=1`): related objects are referenced by id and
+    side-loaded once per page with side_load_parks_and_buses().
+    """
+    bus_id = serializers.IntegerField(read_only=True)
+    route_id = serializers.IntegerField(read_only=True)
+    origin_park_id = serializers.IntegerField(read_only=True)
+    destination_park_id = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = Trip
+        fields = [
+            'id', 'departure_datetime', 'seat_price', 'available_seats',
+            'bus_id', 'route_id', 'origin_park_id', 'destination_park_id',
+        ]
+
+    @staticmethod
+    def setup_eager_loading(queryset, fields=None):
+        # Park ids come from the route join, nothing else is loaded
+        return queryset.annotate(
+            origin_park_id=F('route__origin_park'),
+            destination_park_id=F('route__destination_park'),
+        )
+
+
+class TripSearchEntrySerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    """TripListSerializer's representation, read from the denormalized search table."""
+    id = serializers.IntegerField(source='trip_id', read_only=True)
+    bus = serializers.SerializerMethodField()
+    route = serializers.SerializerMethodField()
+    booked_seats = serializers.SerializerMethodField()
+
+    class Meta:
+        model = TripSearchEntry
+        fields = TripListSerializer.Meta.fields
+
+    expandable_fields = TripListSerializer.expandable_fields
+    deferred_fields = TripListSerializer.deferred_fields
+
+    @staticmethod
+    def setup_eager_loading(queryset, fields=None):
+        return queryset  # Everything is on the row
+
+    def get_bus(self, obj):
+        return {"id": obj.bus_id, "number_plate": obj.bus_number_plate, "total_seats": obj.total_seats}
+
+    def get_route(self, obj):
+        return {
+            "id": obj.route_id,
+            "origin_park": {"id": obj.origin_park_id, "name": obj.origin_park_name},
+            "destination_park": {"id": obj.destination_park_id, "name": obj.destination_park_name},
+            "distance_km": obj.distance_km,
+        }
+
+    def get_booked_seats(self, obj):
+        # Attached per page by the view, see TripSearchAPIView.paginate_queryset()
+        return getattr(obj, 'booked_seat_numbers', [])
+
+
+class TripSearchEntryCompactSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    id = serializers.IntegerField(source='trip_id', read_only=True)
+
+    class Meta:
+        model = TripSearchEntry
+        fields = TripCompactSerializer.Meta.fields
+
+    @staticmethod
+    def setup_eager_loading(queryset, fields=None):
+        return queryset
 
 
 class BookingCreateSerializer(serializers.ModelSerializer):
+    # Retries when an auto-assigned seat was taken meanwhile
+    RESERVE_ATTEMPTS = 3
+
+    trip = serializers.PrimaryKeyRelatedField(queryset=Trip.objects.select_related('bus'))
     seat_numbers = serializers.ListField(
         child=serializers.IntegerField(min_value=1),
         write_only=True,
-        required=True
+        required=False
     )
+    # Let the server pick seat_count seats, kept together where possible
+    auto_assign = serializers.BooleanField(write_only=True, default=False)
 
     class Meta:
         model = Booking
-        fields = ["trip", "seat_count", "price", "status", "seat_numbers"]
+        fields = ["trip", "seat_count", "price", "status", "seat_numbers", "auto_assign"]
 
     def validate(self, attrs):
         if not self.partial:
@@ -148,46 +329,38 @@ class BookingCreateSerializer(serializers.ModelSerializer):
                 raise serializers.ValidationError("Seat count is required.")
             if "price" not in attrs:
                 raise serializers.ValidationError("Price is required.")
-            if "seat_numbers" not in attrs:
+            if attrs.get("auto_assign"):
+                if "seat_numbers" in attrs:
+                    raise serializers.ValidationError("Send either seat numbers or auto_assign, not both.")
+            elif "seat_numbers" not in attrs:
                 raise serializers.ValidationError("Seat numbers are required.")
 
             trip = attrs["trip"]
             seat_count = attrs["seat_count"]
-            seat_numbers = attrs["seat_numbers"]
-
-            # Validate seat_count matches the number of seat_numbers
-            if len(seat_numbers) != seat_count:
-                raise serializers.ValidationError(
-                    f"Number of seats selected ({len(seat_numbers)}) does not match seat_count ({seat_count})."
-                )
+            seat_numbers = attrs.get("seat_numbers")
 
-            # Validate seat_numbers are unique
-            if len(set(seat_numbers)) != len(seat_numbers):
-                raise serializers.ValidationError("Duplicate seat numbers are not allowed.")
+            if seat_numbers is not None:
+                # Validate seat_count matches the number of seat_numbers
+                if len(seat_numbers) != seat_count:
+                    raise serializers.ValidationError(
+                        f"Number of seats selected ({len(seat_numbers)}) does not match seat_count ({seat_count})."
+                    )
 
-            # Validate seat_numbers are within bus capacity
-            if max(seat_numbers, default=0) > trip.bus.total_seats:
-                raise serializers.ValidationError(
-                    f"Seat numbers must be between 1 and {trip.bus.total_seats}."
-                )
+                # Validate seat_numbers are unique
+                if len(set(seat_numbers)) != len(seat_numbers):
+                    raise serializers.ValidationError("Duplicate seat numbers are not allowed.")
 
-            # Check if any seats are already booked
-            existing_seats = SeatAssignment.objects.filter(
-                trip=trip, seat_number__in=seat_numbers
-            ).values_list('seat_number', flat=True)
-            if existing_seats:
-                raise serializers.ValidationError(
-                    f"Seats {list(existing_seats)} are already booked."
-                )
+                # Validate seat_numbers are within bus capacity
+                if max(seat_numbers, default=0) > trip.bus.total_seats:
+                    raise serializers.ValidationError(
+                        f"Seat numbers must be between 1 and {trip.bus.total_seats}."
+                    )
 
             # Validate seat_count
             if seat_count < 1:
                 raise serializers.ValidationError("Must book at least 1 seat.")
 
-            if seat_count > trip.available_seats:
-                raise serializers.ValidationError(
-                    f"Only {trip.available_seats} seats are available."
-                )
+            # Seat conflicts and the remaining seat count are checked once, in create()
 
             # Validate price
             expected_price = trip.seat_price * seat_count
@@ -207,31 +380,47 @@ class BookingCreateSerializer(serializers.ModelSerializer):
 
         return attrs
 
-    @transaction.atomic
     def create(self, validated_data):
+        seat_numbers = validated_data.pop("seat_numbers", None)
+        validated_data.pop("auto_assign", None)
+        # Allocated outside the transaction, see core.identifiers
+        payment_reference = generate_ref_code(validated_data["trip"])
+        for attempt in range(self.RESERVE_ATTEMPTS):
+            try:
+                return self._reserve(validated_data, seat_numbers, payment_reference)
+            except IntegrityError:
+                if seat_numbers is None:
+                    continue  # Auto-assigned seats were taken meanwhile, pick again
+                # The transaction is gone, so this read sees committed seats only
+                taken = sorted(SeatAssignment.objects.filter(
+                    trip=validated_data["trip"], seat_number__in=seat_numbers
+                ).values_list('seat_number', flat=True))
+                raise serializers.ValidationError(f"Seats {taken} are already booked.")
+        raise serializers.ValidationError("Could not reserve the seats, please try again.")
+
+    @transaction.atomic
+    def _reserve(self, validated_data, seat_numbers, payment_reference, cart=None):
+        """
+        Book without locking the trip up front: the (trip, seat_number) unique
+        constraint rejects taken seats, and the seat count is taken with one
+        conditional UPDATE issued last, so the trip row stays locked only
+        until commit. Without seat_numbers, seats are picked from the trip's
+        current occupancy.
+        """
         trip = validated_data["trip"]
         seat_count = validated_data["seat_count"]
-        seat_numbers = validated_data.pop("seat_numbers")
-        payment_reference = generate_ref_code(trip)
-
-        # Lock the trip to prevent concurrent modifications
-        trip = Trip.objects.select_for_update().get(id=trip.id)
-        if seat_count > trip.available_seats:
-            raise serializers.ValidationError(
-                f"Only {trip.available_seats} seats are available."
-            )
 
-        # Re-validate seat availability
-        existing_seats = SeatAssignment.objects.filter(
-            trip=trip, seat_number__in=seat_numbers
-        ).values_list('seat_number', flat=True)
-        if existing_seats:
-            raise serializers.ValidationError(
-                f"Seats {list(existing_seats)} are already booked."
+        if seat_numbers is None:
+            taken = seatmap.occupancy_mask(
+                SeatAssignment.objects.filter(trip=trip).values_list('seat_number', flat=True)
             )
+            seat_numbers = seatmap.choose_seats(taken, trip.bus.total_seats, seat_count, trip.bus.seats_per_row)
+            if seat_numbers is None:
+                raise serializers.ValidationError(
+                    f"Only {trip.bus.total_seats - taken.bit_count()} seats are available."
+                )
 
-        # Create the booking
-        booking = Booking.objects.create(
+        booking = Booking(
             user=self.context["request"].user,
             trip=trip,
             seat_count=seat_count,
@@ -239,21 +428,73 @@ class BookingCreateSerializer(serializers.ModelSerializer):
             payment_reference=payment_reference,
             status="pending",
             payment_status="pending",
+            hold_expires_at=hold_expiry(),
+            cart=cart,
         )
+        booking._search_sync_deferred = True  # Synced once below
+        booking.save(force_insert=True)
 
-        # Create seat assignments
-        for seat_number in seat_numbers:
-            SeatAssignment.objects.create(
-                booking=booking,
-                trip=trip,
-                seat_number=seat_number
-            )
+        SeatAssignment.objects.bulk_create([
+            SeatAssignment(booking=booking, trip=trip, seat_number=seat_number) for seat_number in seat_numbers
+        ])
 
-        # Decrease available seats
+        taken = Trip.objects.filter(id=trip.id, available_seats__gte=seat_count).update(
+            available_seats=F('available_seats') - seat_count
+        )
+        if not taken:
+            available = Trip.objects.filter(id=trip.id).values_list('available_seats', flat=True).first()
+            raise serializers.ValidationError(f"Only {available} seats are available.")
         trip.available_seats -= seat_count
-        trip.save()
 
+        # bulk_create() and update() send no signals
+        search_index.sync_trips([trip.id])
+        invalidate_trip_search(trip_ids=[trip.id], seats={trip.id: seat_numbers})
         return booking
+
+
+class BookingCartSerializer(serializers.Serializer):
+    """Bookings on several trips, reserved together in one transaction."""
+    legs = BookingCreateSerializer(many=True)
+
+    def validate_legs(self, legs):
+        if not 1 <= len(legs) <= settings.BOOKING_CART_MAX_LEGS:
+            raise serializers.ValidationError(f"A cart holds between 1 and {settings.BOOKING_CART_MAX_LEGS} trips.")
+        trip_ids = [leg["trip"].id for leg in legs]
+        if len(set(trip_ids)) != len(trip_ids):
+            raise serializers.ValidationError("Each trip can only be booked once per cart.")
+        return legs
+
+    def create(self, validated_data):
+        # Legs are reserved in trip id order, so carts sharing trips lock their rows in the same order
+        legs = sorted(validated_data["legs"], key=lambda leg: leg["trip"].id)
+        seat_numbers = [leg.pop("seat_numbers", None) for leg in legs]
+        for leg in legs:
+            leg.pop("auto_assign", None)
+        # Allocated outside the transaction, see core.identifiers
+        references = [generate_ref_code(leg["trip"]) for leg in legs]
+        first_leg = min(legs, key=lambda leg: leg["trip"].departure_datetime)
+        cart_reference = generate_cart_ref_code(first_leg["trip"])
+
+        leg_serializer = BookingCreateSerializer(context=self.context)
+        for attempt in range(BookingCreateSerializer.RESERVE_ATTEMPTS):
+            try:
+                with transaction.atomic():
+                    cart = BookingCart.objects.create(user=self.context["request"].user, payment_reference=cart_reference)
+                    for leg, seats, reference in zip(legs, seat_numbers, references):
+                        leg_serializer._reserve(leg, seats, reference, cart=cart)
+                return cart
+            except IntegrityError:
+                if all(seats is None for seats in seat_numbers):
+                    continue  # Auto-assigned seats were taken meanwhile, pick again
+                for leg, seats in zip(legs, seat_numbers):
+                    taken = sorted(SeatAssignment.objects.filter(
+                        trip=leg["trip"], seat_number__in=seats or ()
+                    ).values_list('seat_number', flat=True))
+                    if taken:
+                        raise serializers.ValidationError(f"Seats {taken} are already booked on trip {leg['trip'].id}.")
+        raise serializers.ValidationError("Could not reserve the seats, please try again.")
+
+
 class BusSerializer(serializers.ModelSerializer):
     park = BusParkSerializer(read_only=True)
     park_id = serializers.PrimaryKeyRelatedField(
@@ -262,7 +503,7 @@ class BusSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Bus
-        fields = ['id', 'number_plate', 'total_seats', 'park', 'park_id', 'driver_name', 'status']
+        fields = ['id', 'number_plate', 'total_seats', 'seats_per_row', 'park', 'park_id', 'driver_name', 'status']
 
 
 class TripSerializer(serializers.ModelSerializer):
@@ -359,48 +600,10 @@ class BookingSerializer(serializers.ModelSerializer):
                             "Cannot cancel bookings within 12 hours of departure."
                         )
 
-            # Validate payment_status
-            if "payment_status" in attrs:
-                payment_status = attrs["payment_status"]
-                if payment_status == "completed" and instance.payment_status != "completed":
-                    if instance.trip.available_seats < instance.seat_count:
-                        raise serializers.ValidationError(
-                            f"Only {instance.trip.available_seats} seats are available."
-                        )
-
         return attrs
 
-    def update(self, instance, validated_data):
-        # Handle payment completion and seat allocation
-        if validated_data.get("payment_status") == "completed" and instance.payment_status != "completed":
-            with transaction.atomic():
-                trip = Trip.objects.select_for_update().get(id=instance.trip.id)
-                if trip.available_seats < instance.seat_count:
-                    raise serializers.ValidationError(
-                        f"Only {trip.available_seats} seats are available."
-                    )
-                trip.available_seats -= instance.seat_count
-                trip.save()
-                instance.payment_status = "completed"
-                instance.status = "confirmed"  # Update status to confirmed
-                instance.save()
-
-        # Handle cancellation
-        elif validated_data.get("status") == "cancelled" and instance.status != "cancelled":
-            with transaction.atomic():
-                trip = Trip.objects.select_for_update().get(id=instance.trip.id)
-                if instance.payment_status == "completed":  # Only increment if seats were reserved
-                    trip.available_seats += instance.seat_count
-                    trip.save()
-                instance.status = "cancelled"
-                instance.save()
-
-        else:
-            # Handle other updates
-            instance = super().update(instance, validated_data)
-
-        return instance
-
+    # No update() override: seats are taken when a booking is created and
+    # given back by BookingViewSet.perform_update, never adjusted here
 
 
 class TripTicketSerializer(serializers.ModelSerializer):
@@ -437,14 +640,15 @@ class TripTicketSerializer(serializers.ModelSerializer):
             "name": obj.bus.number_plate
         }
 
-class BookingDetailSerializer(serializers.ModelSerializer):
+class BookingDetailSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     id = serializers.IntegerField(read_only=True)
     trip = TripTicketSerializer()
     user = serializers.SerializerMethodField()
     ref_number = serializers.CharField(source="payment_reference")
+    cart = serializers.PrimaryKeyRelatedField(read_only=True)
     seat_numbers = serializers.SerializerMethodField()
     seats = serializers.IntegerField(source="seat_count")
-    status = serializers.CharField()
+    status = serializers.SerializerMethodField()
     payment_status = serializers.CharField()
     created_at = serializers.DateTimeField(read_only=True)  
 
@@ -452,23 +656,92 @@ class BookingDetailSerializer(serializers.ModelSerializer):
         model = Booking
         fields = [
             "id", "ref_number", "price", "trip", "user",
-            "seats", "status", "payment_status", "created_at", "seat_numbers"
+            "seats", "status", "payment_status", "created_at", "hold_expires_at", "seat_numbers", "cart"
         ]
 
+    expandable_fields = ('trip', 'user', 'seat_numbers')
+
+    @staticmethod
+    def setup_eager_loading(queryset, fields=None):
+        if fields is None:
+            fields = set(BookingDetailSerializer.Meta.fields)
+        related = []
+        if 'trip' in fields:
+            related += [
+                'trip__bus', 'trip__route__origin_park__city', 'trip__route__destination_park__city',
+            ]
+        if 'user' in fields:
+            related.append('user')
+        if related:
+            queryset = queryset.select_related(*related)
+        if 'seat_numbers' in fields:
+            queryset = queryset.prefetch_related(
+                Prefetch('seat_assignments', queryset=SeatAssignment.objects.only('id', 'booking', 'seat_number'))
+            )
+        return queryset
+
     def get_user(self, obj):
         return {
             "first_name": obj.user.first_name,
             "last_name": obj.user.last_name
         }
 
+    def get_status(self, obj):
+        # Annotated by holds.with_current_status() on reads
+        return getattr(obj, 'current_status', obj.status)
+
     def get_seat_numbers(self, obj):
-        # Retrieve seat numbers from SeatAssignment for this booking
-        seat_assignments = SeatAssignment.objects.filter(booking=obj).values_list('seat_number', flat=True)
-        return list(seat_assignments)
-    
+        # Served from the prefetch cache when setup_eager_loading() was used
+        return [seat.seat_number for seat in obj.seat_assignments.all()]
+
+
+class BookingCompactSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    """Flat booking rows (`?compact=1`), trip parks and bus are side-loaded."""
+    ref_number = serializers.CharField(source="payment_reference", read_only=True)
+    seats = serializers.IntegerField(source="seat_count", read_only=True)
+    departure_datetime = serializers.DateTimeField(read_only=True)
+    bus_id = serializers.IntegerField(read_only=True)
+    origin_park_id = serializers.IntegerField(read_only=True)
+    destination_park_id = serializers.IntegerField(read_only=True)
+    status = serializers.CharField(source="current_status", read_only=True)
+    seat_numbers = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Booking
+        fields = [
+            "id", "ref_number", "price", "seats", "status", "payment_status", "created_at",
+            "trip_id", "departure_datetime", "bus_id", "origin_park_id", "destination_park_id",
+            "seat_numbers",
+        ]
+
+    @staticmethod
+    def setup_eager_loading(queryset, fields=None):
+        queryset = queryset.annotate(
+            departure_datetime=F('trip__departure_datetime'),
+            bus_id=F('trip__bus'),
+            origin_park_id=F('trip__route__origin_park'),
+            destination_park_id=F('trip__route__destination_park'),
+        )
+        if fields is None or 'seat_numbers' in fields:
+            queryset = queryset.prefetch_related(
+                Prefetch('seat_assignments', queryset=SeatAssignment.objects.only('id', 'booking', 'seat_number'))
+            )
+        return queryset
+
+    def get_seat_numbers(self, obj):
+        return [seat.seat_number for seat in obj.seat_assignments.all()]
+
+
 class PaymentInitializationSerializer(serializers.Serializer):
-    booking_id = serializers.IntegerField()
+    booking_id = serializers.IntegerField(required=False)
+    # Pays for every leg of a cart with its one reference
+    cart_id = serializers.IntegerField(required=False)
     authorization_url = serializers.URLField(read_only=True)
 
+    def validate(self, attrs):
+        if ("booking_id" in attrs) == ("cart_id" in attrs):
+            raise serializers.ValidationError("Send either booking_id or cart_id.")
+        return attrs
+
 
 
@@ -0,0 +1,148 @@
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from .caching import (
+    CATALOG_SCOPE, booking_scope, invalidate_trip_search, touch_versions, trip_search_scope,
+)
+from .geo import park_index
+from . import search_index
+from .journeys import timetable
+from .places import place_index
+from .models import Trip, Booking, SeatAssignment, Route, BusPark, City, Bus
+
+
+@receiver(pre_save, sender=Trip)
+def remember_previous_trip_scope(sender, instance, **kwargs):
+    # A trip moved to another route/date must also leave its old search results
+    instance._previous_search_scope = None
+    if instance.pk is None:
+        return
+    previous = Trip.objects.filter(pk=instance.pk).values_list(
+        "route__origin_park_id", "route__destination_park_id", "departure_datetime"
+    ).first()
+    if previous and previous[2] is not None:
+        instance._previous_search_scope = trip_search_scope(*previous)
+
+
+@receiver(post_save, sender=Trip)
+def trip_saved(sender, instance, **kwargs):
+    previous = getattr(instance, "_previous_search_scope", None)
+    invalidate_trip_search(trip_ids=[instance.pk], scopes=[previous] if previous else [])
+
+
+@receiver(post_delete, sender=Trip)
+def trip_deleted(sender, instance, **kwargs):
+    if instance.departure_datetime is None:
+        return
+    route = instance.route
+    invalidate_trip_search(scopes=[
+        trip_search_scope(route.origin_park_id, route.destination_park_id, instance.departure_datetime)
+    ])
+
+
+# The search table is written in the same transaction as its source rows
+
+@receiver(post_save, sender=Trip)
+def sync_trip_search_entry(sender, instance, **kwargs):
+    search_index.sync_trips([instance.pk])
+
+
+@receiver(post_save, sender=Booking)
+@receiver(post_delete, sender=Booking)
+def sync_booked_trip_search_entry(sender, instance, **kwargs):
+    if not getattr(instance, "_search_sync_deferred", False):
+        search_index.sync_trips([instance.trip_id])
+
+
+@receiver(post_save, sender=Route)
+def sync_route_search_entries(sender, instance, created, **kwargs):
+    if not created:
+        search_index.sync(route_id=instance.pk)
+
+
+@receiver(post_save, sender=BusPark)
+def sync_park_search_entries(sender, instance, created, **kwargs):
+    if not created:
+        search_index.sync(route__origin_park_id=instance.pk)
+        search_index.sync(route__destination_park_id=instance.pk)
+
+
+@receiver(post_save, sender=Bus)
+def sync_bus_search_entries(sender, instance, created, **kwargs):
+    if not created:
+        search_index.sync(bus_id=instance.pk)
+
+
+@receiver(post_save, sender=Trip)
+def refresh_timetable_trip(sender, instance, **kwargs):
+    transaction.on_commit(lambda: timetable.refresh_trips(trip_ids=[instance.pk]))
+
+
+@receiver(post_delete, sender=Trip)
+def remove_timetable_trip(sender, instance, **kwargs):
+    trip_id = instance.pk
+    transaction.on_commit(lambda: timetable.remove_trip(trip_id))
+
+
+@receiver(post_save, sender=Route)
+def refresh_timetable_route(sender, instance, **kwargs):
+    transaction.on_commit(lambda: timetable.refresh_trips(route_ids=[instance.pk]))
+
+
+@receiver(post_save, sender=BusPark)
+@receiver(post_delete, sender=BusPark)
+@receiver(post_delete, sender=Route)
+def reset_timetable(sender, instance, **kwargs):
+    # Park moves/renames and route removals are rare, rebuild on next query
+    transaction.on_commit(timetable.invalidate)
+
+
+@receiver(post_save, sender=Booking)
+@receiver(post_delete, sender=Booking)
+@receiver(post_save, sender=SeatAssignment)
+@receiver(post_delete, sender=SeatAssignment)
+def seats_changed(sender, instance, **kwargs):
+    if instance.trip_id:
+        if sender is SeatAssignment:
+            seats = [instance.seat_number]
+        elif kwargs.get('created') or kwargs['signal'] is post_delete:
+            seats = []  # Its seats come and go through their own SeatAssignment signals
+        else:
+            # A status change moves every seat of the booking between held and occupied
+            seats = list(instance.seat_assignments.values_list('seat_number', flat=True))
+        invalidate_trip_search(trip_ids=[instance.trip_id], seats={instance.trip_id: seats})
+    touch_versions([booking_scope(instance.pk if sender is Booking else instance.booking_id)])
+
+
+@receiver(post_save, sender=BusPark)
+@receiver(post_delete, sender=BusPark)
+def refresh_park_index(sender, instance, **kwargs):
+    park_id = instance.pk
+    transaction.on_commit(lambda: park_index.refresh_parks([park_id]))
+
+
+@receiver(post_save, sender=City)
+def reset_park_index(sender, instance, **kwargs):
+    # City names are copied into every indexed park
+    transaction.on_commit(park_index.invalidate)
+
+
+@receiver(post_save, sender=City)
+@receiver(post_delete, sender=City)
+@receiver(post_save, sender=BusPark)
+@receiver(post_delete, sender=BusPark)
+def reset_place_index(sender, instance, **kwargs):
+    transaction.on_commit(place_index.invalidate)
+
+
+@receiver(post_save, sender=City)
+@receiver(post_delete, sender=City)
+@receiver(post_save, sender=BusPark)
+@receiver(post_delete, sender=BusPark)
+@receiver(post_save, sender=Route)
+@receiver(post_delete, sender=Route)
+@receiver(post_save, sender=Bus)
+@receiver(post_delete, sender=Bus)
+def catalog_changed(sender, instance, **kwargs):
+    touch_versions([CATALOG_SCOPE])
@@ -1,3 +1,1463 @@
+import string
+from datetime import datetime, timedelta
+from io import StringIO
+from unittest import mock, skipUnless
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Count, QuerySet, Sum
+from django.db.models.sql.constants import LOUTER
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from . import holds, idempotency, identifiers, inventory, metrics, search_index, seatmap
+from .geo import ParkIndex, haversine_km, park_index
+from .journeys import timetable
+from .places import place_index
+from .models import (
+    City, BusPark, Route, Bus, Trip, Booking, SeatAssignment, TripSearchEntry, IdempotencyKey, WaitlistEntry,
+)
+from .pagination import KeysetPagination
+
+User = get_user_model()
+
+
+class CoreTestDataMixin:
+    """Builds a small Lagos -> Abuja network shared by the core tests."""
+
+    @classmethod
+    def create_network(cls):
+        cls.passenger = User.objects.create_user(
+            email="passenger@example.com", password="pass12345", nin="90000000001"
+        )
+        cls.park_admin = User.objects.create_user(
+            email="admin@parks.com", password="pass12345", nin="90000000002", role="park_admin"
+        )
+        cls.lagos = City.objects.create(name="Lagos", state="Lagos", slug="lagos-lagos", latitude=6.52, longitude=3.37)
+        cls.abuja = City.objects.create(name="Abuja", state="FCT", slug="abuja-fct", latitude=9.07, longitude=7.45)
+        cls.origin = BusPark.objects.create(
+            name="Jibowu Terminal", code="JIB", city=cls.lagos, latitude=6.5175, longitude=3.3721,
+            admin=cls.park_admin,
+        )
+        cls.destination = BusPark.objects.create(
+            name="Utako Motor Park", code="UTK", city=cls.abuja, latitude=9.0723, longitude=7.4496
+        )
+        cls.route = Route.objects.create(
+            origin_park=cls.origin, destination_park=cls.destination, distance_km=760, estimated_duration_min=600
+        )
+        cls.bus = Bus.objects.create(number_plate="LAG-123-XY", total_seats=14, park=cls.origin)
+
+    @classmethod
+    def create_trips(cls, count, travel_date):
+        start = timezone.make_aware(datetime.combine(travel_date, datetime.min.time()))
+        trips = Trip.objects.bulk_create([
+            Trip(
+                route=cls.route,
+                bus=cls.bus,
+                departure_datetime=start + timedelta(minutes=index),
+                seat_price=15000,
+                available_seats=cls.bus.total_seats,
+            )
+            for index in range(count)
+        ])
+        # bulk_create skips signals, index the trips like the app code would
+        search_index.sync_trips([trip.id for trip in trips])
+        return trips
+
+    @classmethod
+    def book(cls, trip, seat_numbers, status="confirmed"):
+        booking = Booking.objects.create(
+            user=cls.passenger,
+            trip=trip,
+            seat_count=len(seat_numbers),
+            price=trip.seat_price * len(seat_numbers),
+            payment_reference=f"REF-TEST-{trip.id}-{seat_numbers[0]}",
+            status=status,
+        )
+        SeatAssignment.objects.bulk_create([
+            SeatAssignment(booking=booking, trip=trip, seat_number=seat) for seat in seat_numbers
+        ])
+        trip.available_seats -= len(seat_numbers)
+        trip.save(update_fields=['available_seats'])
+        return booking
+
+    def search(self, travel_date, headers=None, **params):
+        return self.client.get(reverse('trip-search'), {
+            'origin_id': self.origin.id,
+            'destination_id': self.destination.id,
+            'date': travel_date.isoformat(),
+            **params,
+        }, headers=headers)
+
+
+class TripSearchQueryCountTests(CoreTestDataMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.create_network()
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def assert_constant_queries(self, trip_count):
+        travel_date = timezone.localdate() + timedelta(days=3)
+        trips = self.create_trips(trip_count, travel_date)
+        for trip in trips[:5]:
+            self.book(trip, [1, 2])
+            self.book(trip, [5], status="pending")
+
+        # One query for trips with their booking totals
+        with self.assertNumQueries(1):
+            response = self.search(travel_date, page_size=200)
+
+        self.assertEqual(response.status_code, 200)
+        results = response.data['results']
+        self.assertEqual(len(results), min(trip_count, 200))
+        first = results[0]
+        self.assertEqual(first['bookings_count'], 2)
+        self.assertEqual(first['seats_taken'], 3)
+        self.assertNotIn('booked_seats', first)
+        self.assertEqual(first['route']['origin_park']['name'], "Jibowu Terminal")
+
+        # Seat lists on request: one more batched seat lookup
+        with self.assertNumQueries(2):
+            response = self.search(travel_date, page_size=200, expand='bus,route,booked_seats')
+        results = response.data['results']
+        self.assertEqual(sorted(results[0]['booked_seats']), [1, 2, 5])
+        self.assertEqual(results[-1]['booked_seats'], [])
+
+    def test_search_10_trips(self):
+        self.assert_constant_queries(10)
+
+    def test_search_500_trips(self):
+        self.assert_constant_queries(500)
+
+
+class TripSearchCacheTests(CoreTestDataMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.create_network()
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.first_day = timezone.localdate() + timedelta(days=3)
+        self.second_day = self.first_day + timedelta(days=1)
+        self.first_trips = self.create_trips(3, self.first_day)
+        self.create_trips(3, self.second_day)
+
+    def test_repeated_search_is_served_from_cache(self):
+        self.search(self.first_day)
+        with self.assertNumQueries(0):
+            response = self.search(self.first_day)
+        self.assertEqual(len(response.data['results']), 3)
+        stats = metrics.snapshot()
+        self.assertEqual(stats["trip_search_cache.hit"], 1)
+        self.assertEqual(stats["trip_search_cache.rebuild"], 1)
+
+    def test_booking_invalidates_only_its_route_and_date(self):
+        self.search(self.first_day)
+        self.search(self.second_day)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book(self.first_trips[0], [3, 4])
+
+        with self.assertNumQueries(1):
+            response = self.search(self.first_day)
+        self.assertEqual(response.data['results'][0]['seats_taken'], 2)
+        with self.assertNumQueries(0):
+            self.search(self.second_day)
+
+
+class FareCalendarTests(CoreTestDataMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.create_network()
+
+    def setUp(self):
+        self.client = APIClient()
+        self.start = timezone.localdate() + timedelta(days=2)
+
+    def calendar(self, **params):
+        return self.client.get(reverse('fare-calendar'), {
+            'origin_id': self.origin.id,
+            'destination_id': self.destination.id,
+            'start': self.start.isoformat(),
+            **params,
+        })
+
+    def test_groups_fares_and_seats_per_day_in_one_query(self):
+        trips = self.create_trips(3, self.start)
+        Trip.objects.filter(id=trips[0].id).update(seat_price=9000)
+        self.create_trips(2, self.start + timedelta(days=2))
+
+        with self.assertNumQueries(1):
+            response = self.calendar(days=4)
+
+        self.assertEqual(response.status_code, 200)
+        first, second, third, _ = response.data['calendar']
+        self.assertEqual((first['min_price'], first['departures'], first['available_seats']), (9000, 3, 42))
+        self.assertEqual((second['departures'], second['available_seats']), (0, 0))
+        self.assertEqual(third['departures'], 2)
+        self.assertIsNone(response.data['next_available_date'])
+
+    def test_points_to_next_available_date_outside_window(self):
+        sold_out = self.create_trips(1, self.start)
+        Trip.objects.filter(id=sold_out[0].id).update(available_seats=0)
+        self.create_trips(1, self.start + timedelta(days=10))
+
+        response = self.calendar(days=3)
+
+        self.assertEqual(response.data['calendar'][0]['departures'], 1)
+        self.assertIsNone(response.data['calendar'][0]['min_price'])
+        self.assertEqual(response.data['next_available_date'], self.start + timedelta(days=10))
+
+    def test_non_numeric_ids_are_rejected(self):
+        response = self.calendar(origin_id='abc')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("error", response.data)
+
+
+class CitySearchTests(CoreTestDataMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.create_network()
+        cls.second_origin = BusPark.objects.create(
+            name="Ojota New Garage", code="OJO", city=cls.lagos, latitude=6.5892, longitude=3.3703
+        )
+        cls.second_route = Route.objects.create(
+            origin_park=cls.second_origin, destination_park=cls.destination, distance_km=755
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def test_city_search_groups_trips_by_park_pair(self):
+        travel_date = timezone.localdate() + timedelta(days=3)
+        self.create_trips(2, travel_date)
+        start = timezone.make_aware(datetime.combine(travel_date, datetime.min.time()))
+        Trip.objects.create(
+            route=self.second_route, bus=self.bus, departure_datetime=start + timedelta(hours=5), seat_price=14000
+        )
+
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('trip-search'), {
+                'origin_city': self.lagos.slug,
+                'destination_city_id': self.abuja.id,
+                'date': travel_date.isoformat(),
+            })
+
+        groups = response.data['results']
+        self.assertEqual(
+            [(group['origin_park']['id'], len(group['trips'])) for group in groups],
+            [(self.origin.id, 2), (self.second_origin.id, 1)],
+        )
+
+
+class JourneyPlannerTests(CoreTestDataMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.create_network()
+        cls.ibadan = City.objects.create(name="Ibadan", state="Oyo", slug="ibadan-oyo", latitude=7.38, longitude=3.9)
+        cls.transit = BusPark.objects.create(
+            name="Iwo Road Park", code="IWO", city=cls.ibadan, latitude=7.3916, longitude=3.9377
+        )
+        cls.first_leg = Route.objects.create(
+            origin_park=cls.origin, destination_park=cls.transit, distance_km=130, estimated_duration_min=120
+        )
+        cls.second_leg = Route.objects.create(
+            origin_park=cls.transit, destination_park=cls.destination, distance_km=640, estimated_duration_min=480
+        )
+        cls.day_start = timezone.make_aware(
+            datetime.combine(timezone.localdate() + timedelta(days=2), datetime.min.time())
+        )
+        cls.direct = cls.add_trip(cls.route, hours=8, price=20000)
+        cls.to_ibadan = cls.add_trip(cls.first_leg, hours=6, price=5000)
+        cls.tight_connection = cls.add_trip(cls.second_leg, hours=8.33, price=9000)
+        cls.connection = cls.add_trip(cls.second_leg, hours=9, price=9000)
+
+    @classmethod
+    def add_trip(cls, route, hours, price):
+        return Trip.objects.create(
+            route=route, bus=cls.bus, departure_datetime=cls.day_start + timedelta(hours=hours), seat_price=price
+        )
+
+    def setUp(self):
+        timetable.invalidate()
+        self.client = APIClient()
+
+    def plan(self, **params):
+        response = self.client.get(reverse('journey-planner'), {
+            'origin_city_id': self.lagos.id,
+            'destination_id': self.destination.id,
+            'date': self.day_start.date().isoformat(),
+            **params,
+        })
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def trip_ids(self, journey):
+        return [leg['trip_id'] for leg in journey['legs']]
+
+    def test_respects_minimum_transfer_time(self):
+        data = self.plan()
+        self.assertEqual(self.trip_ids(data['earliest']), [self.to_ibadan.id, self.connection.id])
+        self.assertEqual(data['earliest']['transfers'], 1)
+        self.assertEqual(data['cheapest']['total_price'], 14000)
+
+        data = self.plan(min_transfer_minutes=10)
+        self.assertEqual(self.trip_ids(data['earliest']), [self.to_ibadan.id, self.tight_connection.id])
+
+    def test_max_transfers_and_sold_out_trips(self):
+        data = self.plan(max_transfers=0)
+        self.assertEqual(self.trip_ids(data['cheapest']), [self.direct.id])
+
+        Trip.objects.filter(id=self.to_ibadan.id).update(available_seats=0)
+        data = self.plan()
+        self.assertEqual(self.trip_ids(data['earliest']), [self.direct.id])
+
+    def test_timetable_updates_incrementally(self):
+        self.plan()
+        rebuilds = metrics.snapshot()["journey_planner.rebuilds"]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            faster = self.add_trip(self.route, hours=7, price=25000)
+
+        data = self.plan()
+        self.assertEqual(self.trip_ids(data['earliest']), [faster.id])
+        self.assertEqual(metrics.snapshot()["journey_planner.rebuilds"], rebuilds)
+
+
+class KeysetPaginationTests(CoreTestDataMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.create_network()
+        cls.travel_date = timezone.localdate() + timedelta(days=3)
+        cls.trips = cls.create_trips(120, cls.travel_date)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def test_walks_every_page_forward_and_back(self):
+        response = self.search(self.travel_date, page_size=50)
+        self.assertIsNone(response.data['previous'])
+        pages = [response.data]
+        while pages[-1]['next']:
+            with self.assertNumQueries(1):
+                pages.append(self.client.get(pages[-1]['next']).data)
+
+        seen = [trip['id'] for page in pages for trip in page['results']]
+        self.assertEqual([len(page['results']) for page in pages], [50, 50, 20])
+        self.assertEqual(seen, [trip.id for trip in self.trips])
+
+        back = self.client.get(pages[-1]['previous']).data
+        self.assertEqual(back['results'], pages[1]['results'])
+        self.assertEqual(self.client.get(back['previous']).data['results'], pages[0]['results'])
+
+    def test_page_size_is_bounded(self):
+        self.client.force_authenticate(self.passenger)
+        with mock.patch.object(KeysetPagination, 'max_page_size', 30):
+            response = self.client.get(reverse('trip-list'), {'page_size': 100000})
+        self.assertEqual(len(response.data['results']), 30)
+        self.assertIsNotNone(response.data['next'])
+
+    def test_rejects_tampered_cursor(self):
+        response = self.search(self.travel_date, cursor='not-a-cursor')
+        self.assertEqual(response.status_code, 404)
+
+    def test_trips_without_departure_do_not_break_paging(self):
+        Trip.objects.create(route=self.route, bus=self.bus, seat_price=15000, available_seats=14)
+        self.client.force_authenticate(self.passenger)
+        response = self.client.get(reverse('trip-list'), {'page_size': 50})
+        seen = [trip['id'] for trip in response.data['results']]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            seen += [trip['id'] for trip in response.data['results']]
+        self.assertEqual(seen, [trip.id for trip in self.trips])
+
+
+class HotQueryPlanTests(CoreTestDataMixin, TestCase):
+    """Each hot query shape must be answered through its dedicated index."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.create_network()
+        parks = [cls.origin, cls.destination]
+        for index in range(8):
+            parks.append(BusPark.objects.create(
+                name=f"Park {index}", code=f"P{index}", city=cls.lagos if index % 2 else cls.abuja,
+                latitude=6.5, longitude=3.4,
+            ))
+        routes = [
+            Route.objects.create(origin_park=origin, destination_park=destination, distance_km=500)
+            for origin in parks for destination in parks if origin != destination
+        ]
+        buses = [
+            Bus.objects.create(number_plate=f"BUS-{index}", total_seats=14, park=cls.origin)
+            for index in range(10)
+        ]
+        start = timezone.now() + timedelta(days=1)
+        trips = Trip.objects.bulk_create([
+            Trip(
+                route=routes[index % len(routes)], bus=buses[index % len(buses)],
+                departure_datetime=start + timedelta(minutes=17 * index), seat_price=12000, available_seats=14,
+            )
+            for index in range(2000)
+        ])
+        Booking.objects.bulk_create([
+            Booking(
+                user=cls.passenger, trip=trips[index], price=12000, seat_count=1,
+                payment_reference=f"REF-PLAN-{index}",
+                status=["confirmed", "cancelled", "completed", "pending"][index % 4],
+            )
+            for index in range(1000)
+        ])
+        cls.sample_trip = trips[10]
+        search_index.sync_trips([trip.id for trip in trips])
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+    def setUp(self):
+        if connection.vendor == 'postgresql':
+            # Tiny test tables would otherwise always be read sequentially
+            with connection.cursor() as cursor:
+                cursor.execute("SET enable_seqscan = off")
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(index_name, plan, plan)
+
+    def test_trip_search_by_park_pair_and_departure_range(self):
+        start = timezone.now() + timedelta(days=2)
+        self.assertUsesIndex(
+            Trip.objects.filter(
+                route__origin_park=self.origin, route__destination_park=self.destination,
+                departure_datetime__gte=start, departure_datetime__lt=start + timedelta(days=1),
+            ),
+            'trip_route_departure_idx',
+        )
+
+    def test_search_entries_by_park_pair_and_departure_range(self):
+        start = timezone.now() + timedelta(days=2)
+        self.assertUsesIndex(
+            TripSearchEntry.objects.filter(
+                origin_park_id=self.origin.id, destination_park_id=self.destination.id,
+                departure_datetime__gte=start, departure_datetime__lt=start + timedelta(days=1),
+            ).order_by('departure_datetime', 'trip_id'),
+            'tripsearch_park_pair_idx',
+        )
+
+    def test_bus_schedule_clash(self):
+        start = timezone.now() + timedelta(days=2)
+        self.assertUsesIndex(
+            Trip.objects.filter(bus=self.bus, departure_datetime__range=[start, start + timedelta(hours=4)]),
+            'trip_bus_departure_idx',
+        )
+
+    def test_passenger_bookings_newest_first(self):
+        self.assertUsesIndex(
+            Booking.objects.filter(user=self.passenger).order_by('-created_at'),
+            'booking_user_created_idx',
+        )
+
+    @skipUnless(connection.vendor == 'postgresql', "SQLite only uses partial indexes for verbatim WHERE terms")
+    def test_active_bookings_for_trip(self):
+        self.assertUsesIndex(
+            Booking.objects.filter(trip=self.sample_trip, status__in=['pending', 'confirmed']).values('trip').annotate(
+                seats=Sum('seat_count'), bookings=Count('id')
+            ),
+            'booking_active_seats_idx',
+        )
+
+    def test_seat_lookup_uses_single_unique_index(self):
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, SeatAssignment._meta.db_table)
+        seat_indexes = [
+            name for name, details in constraints.items()
+            if details['columns'] == ['trip_id', 'seat_number'] and (details['index'] or details['unique'])
+        ]
+        self.assertEqual(len(seat_indexes), 1, seat_indexes)
+        self.assertUsesIndex(SeatAssignment.objects.filter(trip=self.sample_trip, seat_number=3), seat_indexes[0])
+
+
+class LocalDateSearchTests(CoreTestDataMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.create_network()
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def test_search_uses_lagos_days_and_a_departure_range(self):
+        travel_date = timezone.localdate() + timedelta(days=3)
+        late = timezone.make_aware(datetime.combine(travel_date, datetime.min.time())) + timedelta(hours=23, minutes=30)
+        self.assertEqual(str(timezone.get_current_timezone()), 'Africa/Lagos')
+        same_day = Trip.objects.create(route=self.route, bus=self.bus, departure_datetime=late, seat_price=15000)
+        # 00:30 the next Lagos day is still the same UTC day
+        Trip.objects.create(
+            route=self.route, bus=self.bus, departure_datetime=late + timedelta(hours=1), seat_price=15000
+        )
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.search(travel_date)
+
+        self.assertEqual([trip['id'] for trip in response.data['results']], [same_day.id])
+        trip_query = queries.captured_queries[0]['sql']
+        self.assertIn('"core_tripsearchentry"."departure_datetime" >=', trip_query)
+        self.assertNotIn('cast_date', trip_query)
+
+
+class SparseFieldsTests(CoreTestDataMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.create_network()
+        cls.travel_date = timezone.localdate() + timedelta(days=3)
+        cls.trips = cls.create_trips(3, cls.travel_date)
+        cls.booking = cls.book(cls.trips[0], [1, 2])
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def test_fields_skip_unrequested_joins_and_prefetches(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.search(self.travel_date, fields='departure_datetime,seat_price')
+
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('core_bus', queries.captured_queries[0]['sql'])
+        self.assertEqual(set(response.data['results'][0]), {'id', 'departure_datetime', 'seat_price'})
+
+    def test_expand_adds_nested_objects_to_the_default_fields(self):
+        response = self.search(self.travel_date, expand='bus')
+
+        first = response.data['results'][0]
+        self.assertEqual(first['bus']['number_plate'], "LAG-123-XY")
+        self.assertNotIn('route', first)
+        self.assertNotIn('booked_seats', first)
+        self.assertEqual(first['seats_taken'], 2)
+
+    def test_compact_search_side_loads_parks_and_buses_once(self):
+        with self.assertNumQueries(3):
+            response = self.search(self.travel_date, compact=1)
+
+        results = response.data['results']
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results[0]['origin_park_id'], self.origin.id)
+        self.assertEqual(results[0]['bus_id'], self.bus.id)
+        included = response.data['included']
+        self.assertEqual(set(included['parks']), {self.origin.id, self.destination.id})
+        self.assertEqual(included['parks'][self.origin.id]['city_name'], "Lagos")
+        self.assertEqual(list(included['buses']), [self.bus.id])
+
+    def test_booking_list_fields_and_compact(self):
+        self.client.force_authenticate(self.passenger)
+
+        response = self.client.get(reverse('bookings-list'), {'fields': 'ref_number,seat_numbers'})
+        self.assertEqual(response.data['results'], [
+            {'id': self.booking.id, 'ref_number': self.booking.payment_reference, 'seat_numbers': [1, 2]}
+        ])
+
+        response = self.client.get(reverse('bookings-list'), {'compact': 'true'})
+        row = response.data['results'][0]
+        self.assertEqual(row['trip_id'], self.trips[0].id)
+        self.assertEqual(row['destination_park_id'], self.destination.id)
+        self.assertEqual(sorted(row['seat_numbers']), [1, 2])
+        self.assertIn(self.destination.id, response.data['included']['parks'])
+
+
+class ConditionalGetTests(CoreTestDataMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.create_network()
+        cls.travel_date = timezone.localdate() + timedelta(days=3)
+        cls.trip = cls.create_trips(1, cls.travel_date)[0]
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def test_catalog_304_until_a_park_changes(self):
+        url = reverse('buspark-list')
+        first = self.client.get(url)
+        etag = first.headers['ETag']
+        self.assertTrue(etag.startswith('"'))
+
+        with self.assertNumQueries(0):
+            cached = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(cached.status_code, 304)
+        since = self.client.get(url, HTTP_IF_MODIFIED_SINCE=first.headers['Last-Modified'])
+        self.assertEqual(since.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.destination.name = "Utako Park"
+            self.destination.save()
+        changed = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed.headers['ETag'], etag)
+
+    def test_search_etag_changes_when_seats_are_booked(self):
+        etag = self.search(self.travel_date).headers['ETag']
+        headers = {'If-None-Match': etag}
+        self.assertEqual(self.search(self.travel_date, headers=headers).status_code, 304)
+        self.assertEqual(self.search(self.travel_date, headers=headers, page_size=5).status_code, 200)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book(self.trip, [4])
+        response = self.search(self.travel_date, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0]['seats_taken'], 1)
+
+    def test_booking_detail_is_private_and_versioned(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            booking = self.book(self.trip, [2])
+        url = reverse('bookings-detail', args=[booking.id])
+        self.client.force_authenticate(self.passenger)
+        etag = self.client.get(url).headers['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.client.force_authenticate(self.park_admin)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 404)
+
+        self.client.force_authenticate(self.passenger)
+        with self.captureOnCommitCallbacks(execute=True):
+            booking.payment_status = "successful"
+            booking.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_booking_etag_changes_when_the_trip_departs(self):
+        booking = self.book(self.trip, [3])
+        self.client.force_authenticate(self.passenger)
+        url = reverse('bookings-get-by-reference', args=[booking.payment_reference])
+        etag = self.client.get(url).headers['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        Trip.objects.filter(id=self.trip.id).update(departure_datetime=timezone.now() - timedelta(minutes=5))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], "completed")
+        etag = response.headers['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+
+class NearbyParksTests(CoreTestDataMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.create_network()
+        # Ojota is ~5 km from Jibowu, Ikeja ~10 km
+        cls.ojota = BusPark.objects.create(
+            name="Ojota Park", code="OJT", city=cls.lagos, latitude=6.5795, longitude=3.3792, admin=cls.park_admin
+        )
+        cls.ikeja = BusPark.objects.create(
+            name="Ikeja Park", code="IKJ", city=cls.lagos, latitude=6.6018, longitude=3.3515
+        )
+        cls.travel_date = timezone.localdate() + timedelta(days=3)
+
+    def setUp(self):
+        cache.clear()
+        park_index.invalidate()
+        self.client = APIClient()
+
+    def nearby(self, **params):
+        return self.client.get(reverse('buspark-nearby'), params)
+
+    def test_nearest_and_radius(self):
+        response = self.nearby(lat=6.5175, lng=3.3721, limit=2)
+        self.assertEqual([park['code'] for park in response.data['results']], ["JIB", "OJT"])
+        self.assertEqual(response.data['results'][0]['city']['name'], "Lagos")
+
+        response = self.nearby(lat=6.5175, lng=3.3721, radius_km=8)
+        self.assertEqual([park['code'] for park in response.data['results']], ["JIB", "OJT"])
+        self.assertEqual(self.nearby(lat=6.5).status_code, 400)
+
+    def test_nearest_matches_brute_force(self):
+        index = ParkIndex()
+        index.rebuild()
+        for latitude, longitude in [(6.5, 3.4), (9.0, 7.5), (12.0, 8.5), (4.0, 2.0)]:
+            expected = sorted(
+                BusPark.objects.filter(status='active'),
+                key=lambda park: (haversine_km(latitude, longitude, park.latitude, park.longitude), park.id),
+            )
+            found = index.nearest(latitude, longitude, 3)
+            self.assertEqual([park.id for _, park in found], [park.id for park in expected[:3]])
+
+    def test_index_follows_park_changes(self):
+        self.nearby(lat=6.5175, lng=3.3721)  # build the index
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ojota.status = 'inactive'
+            self.ojota.save()
+            BusPark.objects.create(name="Oshodi Park", code="OSH", city=self.lagos, latitude=6.5533, longitude=3.3358)
+
+        with self.assertNumQueries(0):
+            response = self.nearby(lat=6.5175, lng=3.3721, limit=3)
+        self.assertEqual([park['code'] for park in response.data['results']], ["JIB", "OSH", "IKJ"])
+        self.assertEqual(metrics.snapshot()["park_index.rebuilds"], 1)
+
+    def test_search_falls_back_to_nearby_origin_parks(self):
+        route = Route.objects.create(origin_park=self.ojota, destination_park=self.destination, distance_km=760)
+        trip = Trip.objects.create(
+            route=route, bus=self.bus, seat_price=15000,
+            departure_datetime=timezone.make_aware(datetime.combine(self.travel_date, datetime.min.time())),
+        )
+
+        self.assertEqual(self.search(self.travel_date).data['results'], [])
+        response = self.search(self.travel_date, nearby_km=8)
+        self.assertEqual([result['id'] for result in response.data['results']], [trip.id])
+        self.assertEqual([park['code'] for park in response.data['nearby_origin_parks']], ["OJT"])
+
+
+class PlaceSuggestTests(CoreTestDataMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.create_network()
+        cls.ibadan = City.objects.create(name="Ibadan", state="Oyo", slug="ibadan-oyo", latitude=7.38, longitude=3.9)
+        cls.iwo_road = BusPark.objects.create(
+            name="Iwo Road Park", code="IWO", city=cls.ibadan, latitude=7.3916, longitude=3.9377
+        )
+
+    def setUp(self):
+        cache.clear()
+        place_index.invalidate()
+        self.client = APIClient()
+
+    def suggest(self, q, **params):
+        return self.client.get(reverse('place-suggest'), {'q': q, **params}).data['results']
+
+    def test_prefix_and_typo_matches(self):
+        self.assertEqual([(place['type'], place['name']) for place in self.suggest("ib")], [("city", "Ibadan")])
+        self.assertEqual([place['name'] for place in self.suggest("iwo r")], ["Iwo Road Park"])
+        self.assertEqual([place['code'] for place in self.suggest("utk")], ["UTK"])
+
+        typo = self.suggest("Ibaden")
+        self.assertEqual([place['name'] for place in typo], ["Ibadan"])
+        self.assertTrue(typo[0]['typo'])
+        self.assertEqual(self.suggest("xyzzy"), [])
+
+    def test_ranked_by_exact_match_then_popularity(self):
+        self.book(self.create_trips(1, timezone.localdate() + timedelta(days=2))[0], [1])
+        # "park" is exact for both parks; Utako has the booking
+        self.assertEqual(
+            [place['name'] for place in self.suggest("park", type="park")], ["Utako Motor Park", "Iwo Road Park"]
+        )
+        # "parc" is one edit away from "park"
+        self.assertTrue(all(place['typo'] for place in self.suggest("parc")))
+
+    def test_index_refreshes_when_catalog_changes(self):
+        self.assertEqual(self.suggest("kano"), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            City.objects.create(name="Kano", state="Kano", slug="kano-kano", latitude=12.0, longitude=8.5)
+        self.assertEqual([place['state'] for place in self.suggest("kano")], ["Kano"])
+
+
+class TripSearchIndexTests(CoreTestDataMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.create_network()
+        cls.travel_date = timezone.localdate() + timedelta(days=3)
+        cls.trips = cls.create_trips(3, cls.travel_date)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def entry(self, trip):
+        return TripSearchEntry.objects.get(trip=trip)
+
+    def test_entries_follow_bookings_and_trip_edits(self):
+        trip = self.trips[0]
+        booking = self.book(trip, [1, 2])
+        entry = self.entry(trip)
+        self.assertEqual((entry.available_seats, entry.bookings_count, entry.seats_taken), (12, 1, 2))
+
+        booking.status = "cancelled"
+        booking.save()
+        self.assertEqual((self.entry(trip).bookings_count, self.entry(trip).seats_taken), (0, 0))
+
+        trip.seat_price = 18000
+        trip.save()
+        self.bus.number_plate = "LAG-999-ZZ"
+        self.bus.save()
+        entry = self.entry(trip)
+        self.assertEqual((entry.seat_price, entry.bus_number_plate), (18000, "LAG-999-ZZ"))
+
+        self.route.status = "disabled"
+        self.route.save()
+        self.assertFalse(self.entry(trip).bookable)
+
+    def test_search_reads_entries_without_joins(self):
+        self.book(self.trips[1], [7])
+        with CaptureQueriesContext(connection) as queries:
+            indexed = self.search(self.travel_date).data
+        self.assertNotIn('JOIN', queries.captured_queries[0]['sql'])
+
+        cache.clear()
+        with self.settings(TRIP_SEARCH_FROM_INDEX=False):
+            from_trips = self.search(self.travel_date).data
+        self.assertEqual(indexed, from_trips)
+
+    def test_rebuild_command(self):
+        TripSearchEntry.objects.all().delete()
+        call_command('rebuild_trip_search_index', stdout=StringIO())
+        self.assertEqual(TripSearchEntry.objects.count(), 3)
+
+        TripSearchEntry.objects.filter(trip=self.trips[0]).update(
+            departure_datetime=timezone.now() - timedelta(hours=1)
+        )
+        call_command('rebuild_trip_search_index', '--prune', stdout=StringIO())
+        self.assertEqual(TripSearchEntry.objects.count(), 2)
+
+
+class SeatMapTests(CoreTestDataMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.create_network()
+        cls.trip = cls.create_trips(1, timezone.localdate() + timedelta(days=2))[0]
+        cls.book(cls.trip, [1, 2])
+        cls.book(cls.trip, [9], status="pending")
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def seats(self, **params):
+        return self.client.get(reverse('trip-seats', args=[self.trip.id]), params)
+
+    def test_full_map_bitsets(self):
+        data = self.seats().data
+        self.assertTrue(data['full'])
+        self.assertEqual(seatmap.decode_bits(data['occupied']), [1, 2])
+        self.assertEqual(seatmap.decode_bits(data['held']), [9])
+        self.assertEqual(len(data['occupied']), len(seatmap.encode_bits([], 14)))
+        self.assertEqual(self.client.get(reverse('trip-seats', args=[0])).status_code, 404)
+
+    def test_delta_lists_changed_seats_only(self):
+        version = self.seats().data['version']
+        with self.captureOnCommitCallbacks(execute=True):
+            booking = Booking.objects.create(
+                user=self.passenger, trip=self.trip, seat_count=1, price=15000,
+                payment_reference="REF-SEATMAP", status="pending",
+            )
+            SeatAssignment.objects.create(booking=booking, trip=self.trip, seat_number=4)
+        with self.captureOnCommitCallbacks(execute=True):
+            Booking.objects.filter(seat_assignments__seat_number=1).get().delete()
+
+        with self.assertNumQueries(1):
+            data = self.seats(since=version).data
+        self.assertFalse(data['full'])
+        self.assertEqual(data['changes'], [
+            {"seat": 1, "state": "free"}, {"seat": 2, "state": "free"}, {"seat": 4, "state": "held"},
+        ])
+
+        # Up to date clients get an empty delta without touching the database
+        with self.assertNumQueries(0):
+            self.assertEqual(self.seats(since=data['version']).data['changes'], [])
+
+    def test_unknown_version_falls_back_to_full_map(self):
+        version = self.seats().data['version']
+        self.assertTrue(self.seats(since=version + 1).data['full'])
+        with self.settings(SEAT_MAP_LOG_LENGTH=1):
+            for seat in (10, 11):
+                with self.captureOnCommitCallbacks(execute=True):
+                    SeatAssignment.objects.create(booking=Booking.objects.first(), trip=self.trip, seat_number=seat)
+            self.assertTrue(self.seats(since=version).data['full'])
+        self.assertEqual(self.seats(since='abc').status_code, 400)
+
+
+class BookingCreateTests(CoreTestDataMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.create_network()
+        cls.trip = cls.create_trips(1, timezone.localdate() + timedelta(days=2))[0]
+        cls.book(cls.trip, [1, 2])
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.passenger)
+
+    def create(self, seat_numbers):
+        return self.client.post(reverse('booking-create'), {
+            'trip': self.trip.id,
+            'seat_count': len(seat_numbers),
+            'price': self.trip.seat_price * len(seat_numbers),
+            'seat_numbers': seat_numbers,
+        }, format='json')
+
+    def test_booking_takes_seats_in_one_pass(self):
+        # Trip + bus, booking insert, seat insert, seat count update, search entry sync
+        with CaptureQueriesContext(connection) as queries:
+            response = self.create([3, 4])
+        self.assertEqual(response.status_code, 201)
+        writes = [q['sql'] for q in queries.captured_queries if q['sql'].startswith(('INSERT', 'UPDATE'))]
+        self.assertEqual(len([sql for sql in writes if 'core_seatassignment' in sql]), 1)
+        self.assertEqual(len([sql for sql in writes if sql.startswith('UPDATE "core_trip"')]), 1)
+        self.assertFalse(any('FOR UPDATE' in q['sql'] for q in queries.captured_queries))
+
+        self.trip.refresh_from_db()
+        self.assertEqual(self.trip.available_seats, 10)
+        entry = TripSearchEntry.objects.get(trip=self.trip)
+        self.assertEqual((entry.available_seats, entry.bookings_count, entry.seats_taken), (10, 2, 4))
+        self.assertEqual(sorted(Booking.objects.get(id=response.data['booking']['id'])
+                                .seat_assignments.values_list('seat_number', flat=True)), [3, 4])
+
+    def test_taken_seats_are_rejected_by_the_constraint(self):
+        response = self.create([2, 3])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Seats [2] are already booked.", str(response.data))
+        self.assertEqual(Booking.objects.filter(trip=self.trip).count(), 1)
+        self.trip.refresh_from_db()
+        self.assertEqual(self.trip.available_seats, 12)
+
+    def test_auto_assign_keeps_groups_together(self):
+        def auto(count):
+            response = self.client.post(reverse('booking-create'), {
+                'trip': self.trip.id, 'seat_count': count, 'price': self.trip.seat_price * count, 'auto_assign': True,
+            }, format='json')
+            if response.status_code != 201:
+                return response.status_code, response.data
+            return response.status_code, sorted(response.data['booking']['seat_numbers'])
+
+        self.assertEqual(auto(2), (201, [3, 4]))
+        self.assertEqual(auto(3), (201, [5, 6, 7]))
+        self.assertEqual(auto(1), (201, [8]))
+        self.assertEqual(auto(6)[0], 201)
+        self.assertEqual(auto(1), (400, ["Only 0 seats are available."]))
+
+    def test_choose_seats(self):
+        taken = seatmap.occupancy_mask
+        # Side by side in a row, then same row, then consecutive across rows, then frontmost
+        self.assertEqual(seatmap.choose_seats(taken([1, 2, 3, 6]), 14, 2, 4), [7, 8])
+        self.assertEqual(seatmap.choose_seats(taken([1, 3, 5, 7, 10, 12, 14]), 14, 2, 4), [2, 4])
+        self.assertEqual(seatmap.choose_seats(taken([2, 3]), 14, 6, 4), [4, 5, 6, 7, 8, 9])
+        self.assertEqual(seatmap.choose_seats(taken([2, 5, 10]), 14, 6, 4), [1, 3, 4, 6, 7, 8])
+        self.assertIsNone(seatmap.choose_seats(taken(range(1, 13)), 14, 3, 4))
+
+    def test_seat_count_is_taken_conditionally(self):
+        Trip.objects.filter(id=self.trip.id).update(available_seats=1)
+        response = self.create([5, 6])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Only 1 seats are available.", str(response.data))
+        self.assertFalse(SeatAssignment.objects.filter(seat_number__in=[5, 6]).exists())
+
+
+class SeatHoldTests(CoreTestDataMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.create_network()
+        cls.trip = cls.create_trips(1, timezone.localdate() + timedelta(days=2))[0]
+        expired = timezone.now() - timedelta(minutes=1)
+        cls.abandoned = [cls.book(cls.trip, seats, status="pending") for seats in ([1, 2], [3], [4])]
+        Booking.objects.filter(id__in=[booking.id for booking in cls.abandoned]).update(hold_expires_at=expired)
+        cls.paying = cls.book(cls.trip, [5], status="pending")
+        Booking.objects.filter(id=cls.paying.id).update(hold_expires_at=timezone.now() + timedelta(minutes=5))
+        cls.paid = cls.book(cls.trip, [6])
+
+    def setUp(self):
+        cache.clear()
+
+    def test_new_bookings_hold_their_seats(self):
+        client = APIClient()
+        client.force_authenticate(self.passenger)
+        response = client.post(reverse('booking-create'), {
+            'trip': self.trip.id, 'seat_count': 1, 'price': self.trip.seat_price, 'seat_numbers': [7],
+        }, format='json')
+        expires = Booking.objects.get(id=response.data['booking']['id']).hold_expires_at
+        self.assertAlmostEqual(
+            (expires - timezone.now()).total_seconds(), settings.BOOKING_HOLD_MINUTES * 60, delta=5
+        )
+
+    def test_reaper_releases_expired_holds_in_batches(self):
+        call_command('release_expired_holds', '--batch-size', '2', stdout=StringIO())
+
+        statuses = dict(Booking.objects.values_list('id', 'status'))
+        self.assertEqual([statuses[booking.id] for booking in self.abandoned], ["cancelled"] * 3)
+        self.assertEqual((statuses[self.paying.id], statuses[self.paid.id]), ("pending", "confirmed"))
+        self.assertEqual(sorted(SeatAssignment.objects.values_list('seat_number', flat=True)), [5, 6])
+        self.trip.refresh_from_db()
+        self.assertEqual(self.trip.available_seats, 12)
+        entry = TripSearchEntry.objects.get(trip=self.trip)
+        self.assertEqual((entry.available_seats, entry.seats_taken), (12, 2))
+
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot['booking_holds.released'], 3)
+        self.assertEqual(snapshot['booking_holds.last_run_released'], 3)
+        self.assertEqual(snapshot['booking_holds.hold_minutes'], settings.BOOKING_HOLD_MINUTES)
+
+    def test_batch_cost_does_not_grow_with_its_size(self):
+        later = timezone.now() + timedelta(minutes=2)
+        Booking.objects.filter(id__in=[booking.id for booking in self.abandoned[1:]]).update(hold_expires_at=later)
+        with CaptureQueriesContext(connection) as one_booking:
+            self.assertEqual(holds.release_expired_holds(), 1)
+        with CaptureQueriesContext(connection) as two_bookings:
+            self.assertEqual(holds.release_expired_holds(now=later + timedelta(seconds=1)), 2)
+        self.assertEqual(len(one_booking), len(two_bookings))
+
+    def test_payment_after_release_does_not_confirm(self):
+        holds.release_expired_holds()
+        booking = holds.confirm_payment(self.abandoned[0])
+        self.assertEqual((booking.status, booking.payment_status), ("cancelled", "successful"))
+        self.assertEqual(holds.confirm_payment(self.paying).status, "confirmed")
+        self.assertIsNone(Booking.objects.get(id=self.paying.id).hold_expires_at)
+
+
+class DepartedBookingTests(CoreTestDataMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.create_network()
+        departed, = cls.create_trips(1, timezone.localdate() - timedelta(days=2))
+        cls.upcoming, = cls.create_trips(1, timezone.localdate() + timedelta(days=2))
+        cls.departed = [cls.book(departed, [seat]) for seat in (1, 2, 3)]
+        cls.cancelled = cls.book(departed, [4], status="cancelled")
+        cls.confirmed = cls.book(cls.upcoming, [1])
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.passenger)
+
+    def test_reads_show_completed_without_writing(self):
+        with CaptureQueriesContext(connection) as queries:
+            listed = self.client.get(reverse('bookings-list'))
+            compact = self.client.get(reverse('bookings-list'), {'compact': 1})
+            by_reference = self.client.get(
+                reverse('bookings-get-by-reference', args=[self.departed[0].payment_reference])
+            )
+        self.assertFalse([q['sql'] for q in queries.captured_queries if q['sql'].startswith(('UPDATE', 'INSERT'))])
+        statuses = {row['id']: row['status'] for row in listed.data['results']}
+        self.assertEqual({row['id']: row['status'] for row in compact.data['results']}, statuses)
+        self.assertEqual([statuses[booking.id] for booking in self.departed], ["completed"] * 3)
+        self.assertEqual((statuses[self.cancelled.id], statuses[self.confirmed.id]), ("cancelled", "confirmed"))
+        self.assertEqual(by_reference.data['status'], "completed")
+        self.assertEqual(Booking.objects.get(id=self.departed[0].id).status, "confirmed")
+
+    def test_job_completes_departed_bookings_in_bulk(self):
+        out = StringIO()
+        with CaptureQueriesContext(connection) as queries:
+            call_command('complete_departed_bookings', '--batch-size', '2', stdout=out)
+        self.assertIn("Completed 3 bookings", out.getvalue())
+        self.assertEqual(len([q for q in queries.captured_queries if q['sql'].startswith('UPDATE')]), 2)
+        statuses = dict(Booking.objects.values_list('id', 'status'))
+        self.assertEqual([statuses[booking.id] for booking in self.departed], ["completed"] * 3)
+        self.assertEqual((statuses[self.cancelled.id], statuses[self.confirmed.id]), ("cancelled", "confirmed"))
+
+
+class TravelHistoryTests(CoreTestDataMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.create_network()
+        today = timezone.localdate()
+        past = [cls.create_trips(1, today - timedelta(days=days))[0] for days in (9, 6, 3)]
+        upcoming = [cls.create_trips(1, today + timedelta(days=days))[0] for days in (3, 6, 9)]
+        cls.past = [cls.book(trip, [1]) for trip in past]
+        cls.upcoming = [cls.book(trip, [1]) for trip in upcoming]
+        cls.cancelled = [cls.book(trip, [2], status="cancelled") for trip in upcoming[:2]]
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.passenger)
+
+    def history(self, **params):
+        return self.client.get(reverse('bookings-history'), params)
+
+    def ids(self, response):
+        return [row['id'] for row in response.data['results']]
+
+    def test_filters_and_their_order(self):
+        ids = lambda bookings: [booking.id for booking in bookings]
+        self.assertEqual(self.ids(self.history(filter='upcoming')), ids(self.upcoming))
+        self.assertEqual(self.ids(self.history(filter='past')), ids(reversed(self.past)))
+        self.assertEqual(self.ids(self.history(filter='cancelled')), ids(reversed(self.cancelled)))
+        self.assertEqual(len(self.ids(self.history())), 8)
+        self.assertEqual({row['status'] for row in self.history(filter='past').data['results']}, {"completed"})
+        self.assertEqual(self.history(filter='someday').status_code, 400)
+
+    def test_cursor_walks_every_page(self):
+        seen, response = [], self.history(filter='upcoming', page_size=2)
+        seen += self.ids(response)
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            seen += self.ids(response)
+        self.assertEqual(seen, [booking.id for booking in self.upcoming])
+
+    def test_query_count_does_not_grow_with_the_page(self):
+        with CaptureQueriesContext(connection) as small:
+            self.history(page_size=2)
+        with CaptureQueriesContext(connection) as large:
+            self.history(page_size=8)
+        self.assertEqual(len(small), len(large))
+        with CaptureQueriesContext(connection) as compact:
+            self.assertEqual(len(self.ids(self.history(filter='upcoming', compact=1))), 3)
+        self.assertEqual(len(compact), len(large) + 2)  # Side-loaded parks and buses
+
+
+class BookingCartTests(CoreTestDataMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.create_network()
+        cls.outbound = cls.create_trips(1, timezone.localdate() + timedelta(days=2))[0]
+        cls.inbound = cls.create_trips(1, timezone.localdate() + timedelta(days=5))[0]
+        cls.book(cls.inbound, [1])
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.passenger)
+
+    def book_cart(self, inbound_seats, outbound_seats=(1, 2)):
+        legs = [(self.inbound, inbound_seats), (self.outbound, list(outbound_seats))]
+        return self.client.post(reverse('booking-cart'), {'legs': [
+            {'trip': trip.id, 'seat_count': len(seats), 'price': trip.seat_price * len(seats), 'seat_numbers': seats}
+            for trip, seats in legs
+        ]}, format='json')
+
+    def paystack(self, status):
+        response = mock.Mock()
+        response.json.return_value = {'status': True, 'data': {'status': status, 'authorization_url': 'https://pay'}}
+        return response
+
+    def test_cart_reserves_every_leg_under_one_reference(self):
+        response = self.book_cart([2, 3])
+        self.assertEqual(response.status_code, 201)
+        cart = response.data['cart']
+        self.assertEqual([booking['seat_numbers'] for booking in cart['bookings']], [[1, 2], [2, 3]])  # By departure
+        self.assertEqual(cart['price'], self.outbound.seat_price * 4)
+        self.assertTrue(cart['payment_reference'].startswith("CART-"))
+
+        with mock.patch('core.views.requests.post', return_value=self.paystack('')) as post:
+            response = self.client.post(reverse('initialize-payment'), {'cart_id': cart['id']}, format='json')
+        self.assertEqual(response.data['reference'], cart['payment_reference'])
+        self.assertEqual(post.call_args.kwargs['json']['amount'], int(self.outbound.seat_price * 4 * 100))
+
+        with mock.patch('core.views.requests.get', return_value=self.paystack('success')):
+            self.client.get(reverse('payment-callback'), {'reference': cart['payment_reference']})
+        self.assertEqual(set(Booking.objects.filter(cart_id=cart['id']).values_list('status', flat=True)), {"confirmed"})
+
+    def test_taken_seat_on_one_leg_books_no_leg(self):
+        response = self.book_cart([1, 2])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(f"Seats [1] are already booked on trip {self.inbound.id}.", str(response.data))
+        self.assertFalse(Booking.objects.filter(trip=self.outbound).exists())
+        self.outbound.refresh_from_db()
+        self.assertEqual(self.outbound.available_seats, 14)
+
+    def test_legs_are_released_together(self):
+        cart = self.book_cart([2, 3]).data['cart']
+        first, second = cart['bookings']
+        Booking.objects.filter(id=first['id']).update(hold_expires_at=timezone.now() - timedelta(minutes=1))
+        self.assertEqual(holds.release_expired_holds(), 2)
+        self.assertEqual(Booking.objects.get(id=second['id']).status, "cancelled")
+        seats = dict(Trip.objects.values_list('id', 'available_seats'))
+        self.assertEqual((seats[self.outbound.id], seats[self.inbound.id]), (14, 13))
+
+    def test_failed_payment_releases_every_leg(self):
+        cart = self.book_cart([2, 3]).data['cart']
+        with mock.patch('core.views.requests.get', return_value=self.paystack('failed')):
+            response = self.client.get(reverse('payment-callback'), {'reference': cart['payment_reference']})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([booking['status'] for booking in response.data['bookings']], ["cancelled"] * 2)
+
+
+    def test_payment_paths_lock_without_outer_joins(self):
+        # SQLite drops FOR UPDATE, so check the joins of every queryset that gets locked
+        locked = []
+        select_for_update = QuerySet.select_for_update
+
+        def spy(queryset, *args, **kwargs):
+            locked.append(queryset)
+            return select_for_update(queryset, *args, **kwargs)
+
+        paid, failed = self.book_cart([2, 3]).data['cart'], self.book_cart([4, 5], (3, 4)).data['cart']
+        single = self.book(self.outbound, [9], status="pending")
+        with mock.patch.object(QuerySet, 'select_for_update', spy):
+            with mock.patch('core.views.requests.get', return_value=self.paystack('success')):
+                self.client.get(reverse('payment-callback'), {'reference': paid['payment_reference']})
+                self.client.get(reverse('payment-callback'), {'reference': single.payment_reference})
+            with mock.patch('core.views.requests.get', return_value=self.paystack('failed')):
+                self.client.get(reverse('payment-callback'), {'reference': failed['payment_reference']})
+            self.client.post(reverse('paystack-webhook'), {
+                'event': 'charge.success', 'data': {'reference': paid['payment_reference']},
+            }, format='json')
+        self.assertTrue(locked)
+        for queryset in locked:
+            str(queryset.query)  # Sets up its joins
+            self.assertNotIn(LOUTER, [getattr(join, 'join_type', None) for join in queryset.query.alias_map.values()])
+        self.assertEqual(Booking.objects.get(id=single.id).status, "confirmed")
+
+
+class WaitlistTests(CoreTestDataMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.create_network()
+        cls.trip = cls.create_trips(1, timezone.localdate() + timedelta(days=3))[0]
+        cls.abandoned = cls.book(cls.trip, [1, 2, 3], status="pending")
+        Booking.objects.filter(id=cls.abandoned.id).update(hold_expires_at=timezone.now() - timedelta(minutes=1))
+        cls.cancellable = cls.book(cls.trip, [4, 5])
+        cls.book(cls.trip, list(range(6, 15)))
+        cls.waiting = [
+            WaitlistEntry.objects.create(
+                trip=cls.trip, seat_count=seats,
+                user=User.objects.create_user(email=f"waiting{index}@example.com", password="pass12345",
+                                              nin=f"9100000000{index}"),
+            )
+            for index, seats in enumerate([2, 2, 1])
+        ]
+
+    def setUp(self):
+        cache.clear()
+
+    def client_for(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def test_joining_reports_the_position(self):
+        response = self.client_for(self.passenger).post(
+            reverse('trip-waitlist', args=[self.trip.id]), {'seat_count': 3}, format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.data['position'], response.data['seats_ahead']), (4, 5))
+
+        response = self.client_for(self.waiting[1].user).get(reverse('trip-waitlist', args=[self.trip.id]))
+        self.assertEqual((response.data['status'], response.data['position']), ("waiting", 2))
+
+    def test_cannot_join_while_seats_are_free(self):
+        holds.release_expired_holds()
+        response = self.client_for(self.passenger).post(
+            reverse('trip-waitlist', args=[self.trip.id]), {'seat_count': 1}, format='json'
+        )
+        self.assertEqual(response.status_code, 409)
+
+    def test_released_seats_go_to_the_queue_in_order(self):
+        self.assertEqual(holds.release_expired_holds(), 1)
+
+        # Three seats: the first entry takes two, the second needs two and holds up the queue
+        statuses = dict(WaitlistEntry.objects.values_list('id', 'status'))
+        self.assertEqual([statuses[entry.id] for entry in self.waiting], ["promoted", "waiting", "waiting"])
+        booking = WaitlistEntry.objects.get(id=self.waiting[0].id).booking
+        self.assertEqual((booking.user, booking.status, booking.seat_count), (self.waiting[0].user, "pending", 2))
+        self.assertAlmostEqual(
+            (booking.hold_expires_at - timezone.now()).total_seconds(), settings.WAITLIST_HOLD_MINUTES * 60, delta=5
+        )
+        self.assertEqual(sorted(booking.seat_assignments.values_list('seat_number', flat=True)), [1, 2])
+        self.trip.refresh_from_db()
+        self.assertEqual(self.trip.available_seats, 1)
+        self.assertEqual(TripSearchEntry.objects.get(trip=self.trip).available_seats, 1)
+
+        response = self.client_for(self.waiting[0].user).get(reverse('trip-waitlist', args=[self.trip.id]))
+        self.assertEqual(response.data['booking']['id'], booking.id)
+
+    def test_cancellation_promotes_in_the_same_transaction(self):
+        response = self.client_for(self.passenger).patch(
+            reverse('bookings-detail', args=[self.cancellable.id]), {'status': 'cancelled'}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Booking.objects.get(id=self.cancellable.id).status, "cancelled")
+        self.assertEqual(WaitlistEntry.objects.get(id=self.waiting[0].id).status, "promoted")
+        self.assertEqual(sorted(SeatAssignment.objects.filter(trip=self.trip).values_list('seat_number', flat=True)),
+                         list(range(1, 15)))
+        self.trip.refresh_from_db()
+        self.assertEqual(self.trip.available_seats, 0)
+
+    def test_only_the_trip_row_is_locked(self):
+        # SQLite drops FOR UPDATE, so check what every locked queryset would lock
+        locked = []
+        select_for_update = QuerySet.select_for_update
+
+        def spy(queryset, *args, **kwargs):
+            locked.append(select_for_update(queryset, *args, **kwargs))
+            return locked[-1]
+
+        with mock.patch.object(QuerySet, 'select_for_update', spy):
+            self.client_for(self.passenger).post(
+                reverse('trip-waitlist', args=[self.trip.id]), {'seat_count': 1}, format='json'
+            )
+            holds.release_expired_holds()
+        trips = [queryset for queryset in locked if queryset.model is Trip]
+        self.assertEqual(len(trips), 2)
+        for queryset in trips:
+            self.assertEqual(queryset.query.select_for_update_of, ('self',))
+
+
+class SeatInventoryTests(CoreTestDataMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.create_network()
+        cls.consistent, cls.drifted, cls.stale = cls.create_trips(3, timezone.localdate() + timedelta(days=2))
+        for trip in (cls.consistent, cls.drifted, cls.stale):
+            cls.book(trip, [1, 2])
+        Trip.objects.filter(id=cls.drifted.id).update(available_seats=9)  # A seat count adjusted twice
+        cancelled = cls.book(cls.stale, [3])
+        Booking.objects.filter(id=cancelled.id).update(status="cancelled")  # Its seat row left behind
+
+    def setUp(self):
+        cache.clear()
+
+    def test_check_finds_drift_in_one_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            drift, stale = inventory.check()
+        self.assertEqual(drift, [(self.drifted.id, 9, 12)])
+        self.assertEqual(stale, 1)
+        self.assertEqual(len(queries), 2)  # Drift, then seats of cancelled bookings
+
+    def test_dry_run_reports_without_repairing(self):
+        out = StringIO()
+        call_command('check_seat_inventory', '--dry-run', stdout=out)
+        self.assertIn(f"Trip {self.drifted.id}: 9 available, expected 12", out.getvalue())
+        self.assertEqual(Trip.objects.get(id=self.drifted.id).available_seats, 9)
+        self.assertEqual(metrics.snapshot()['seat_inventory.drifted_seats'], 3)
+
+    def test_repair_recounts_and_frees_stale_seats(self):
+        call_command('check_seat_inventory', stdout=StringIO())
+        seats = dict(Trip.objects.values_list('id', 'available_seats'))
+        self.assertEqual([seats[trip.id] for trip in (self.consistent, self.drifted, self.stale)], [12, 12, 12])
+        self.assertEqual(SeatAssignment.objects.filter(trip=self.stale).count(), 2)
+        self.assertEqual(TripSearchEntry.objects.get(trip=self.drifted).available_seats, 12)
+        self.assertEqual(inventory.check(), ([], 0))
+
+    def test_freed_seats_go_to_the_waitlist(self):
+        self.book(self.stale, list(range(4, 15)))  # Sold out, seat 3 held by the cancelled booking
+        entry = WaitlistEntry.objects.create(trip=self.stale, seat_count=1, user=User.objects.create_user(
+            email="waiting@example.com", password="pass12345", nin="91000000009",
+        ))
+        call_command('check_seat_inventory', stdout=StringIO())
+        entry.refresh_from_db()
+        self.assertEqual(entry.status, "promoted")
+        self.assertEqual(list(entry.booking.seat_assignments.values_list('seat_number', flat=True)), [3])
+        self.assertEqual(Trip.objects.get(id=self.stale.id).available_seats, 0)
+
+    def test_cancelling_through_the_api_leaves_no_drift(self):
+        client = APIClient()
+        client.force_authenticate(self.passenger)
+        booking = Booking.objects.get(trip=self.consistent)
+        response = client.patch(reverse('bookings-detail', args=[booking.id]), {'status': 'cancelled'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        drift, _ = inventory.check()
+        self.assertNotIn(self.consistent.id, [trip_id for trip_id, _, _ in drift])
+        self.assertEqual(Trip.objects.get(id=self.consistent.id).available_seats, 14)
+
+
+class IdempotencyKeyTests(CoreTestDataMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.create_network()
+        cls.trip = cls.create_trips(1, timezone.localdate() + timedelta(days=2))[0]
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.passenger)
+
+    def create(self, key, seat_numbers=(1, 2)):
+        return self.client.post(reverse('booking-create'), {
+            'trip': self.trip.id, 'seat_count': len(seat_numbers),
+            'price': self.trip.seat_price * len(seat_numbers), 'seat_numbers': list(seat_numbers),
+        }, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retries_replay_the_first_booking(self):
+        first = self.create("checkout-1")
+        retry = self.create("checkout-1")
+        self.assertEqual((first.status_code, retry.status_code), (201, 201))
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Booking.objects.filter(trip=self.trip).count(), 1)
+        self.trip.refresh_from_db()
+        self.assertEqual(self.trip.available_seats, 12)
+
+        # Another key is another booking
+        self.assertEqual(self.create("checkout-2", (3,)).status_code, 201)
+        self.assertEqual(Booking.objects.filter(trip=self.trip).count(), 2)
+
+    def test_key_reused_for_another_request_is_rejected(self):
+        self.create("checkout-1")
+        response = self.create("checkout-1", (3, 4))
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Booking.objects.filter(trip=self.trip).count(), 1)
+
+    def test_failed_requests_are_not_stored(self):
+        self.book(self.trip, [1])
+        self.assertEqual(self.create("checkout-1").status_code, 400)
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.assertEqual(self.create("checkout-1", (2, 3)).status_code, 201)
+
+    def test_request_in_progress_conflicts_after_waiting(self):
+        self.create("checkout-1")
+        # As if the first request were still running
+        IdempotencyKey.objects.update(status_code=None, response_body=None)
+        with self.settings(IDEMPOTENCY_WAIT_SECONDS=0):
+            self.assertEqual(self.create("checkout-1").status_code, 409)
+        # Until it is presumed dead
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_LOCK_SECONDS + 1))
+        self.assertEqual(self.create("checkout-1", (3,)).status_code, 201)
+
+    def test_purge_deletes_expired_keys_in_batches(self):
+        self.create("checkout-1")
+        self.create("checkout-2", (3,))
+        self.create("checkout-3", (4,))
+        IdempotencyKey.objects.exclude(key="checkout-3").update(expires_at=timezone.now() - timedelta(minutes=1))
+        out = StringIO()
+        call_command('purge_idempotency_keys', '--batch-size', '1', stdout=out)
+        self.assertIn("Purged 2", out.getvalue())
+        self.assertEqual(list(IdempotencyKey.objects.values_list('key', flat=True)), ["checkout-3"])
+
+
+class BookingBenchmarkTests(TestCase):
+    def test_benchmark_checks_inventory_and_cleans_up(self):
+        out = StringIO()
+        call_command(
+            'benchmark_bookings', '--requests', '40', '--concurrency', '1', '--trips', '2', '--bus-seats', '8',
+            '--users', '3', stdout=out,
+        )
+        output = out.getvalue()
+        self.assertIn("40 requests", output)
+        self.assertIn("Invariants: OK", output)
+        self.assertFalse(Trip.objects.exists())
+        self.assertFalse(User.objects.exists())
+
+    def test_kept_runs_do_not_clash(self):
+        for _ in range(2):
+            call_command(
+                'benchmark_bookings', '--requests', '5', '--concurrency', '1', '--users', '1', '--keep',
+                stdout=StringIO(),
+            )
+        self.assertEqual(BusPark.objects.count(), 4)
+
+    def test_failed_setup_is_cleaned_up(self):
+        with mock.patch.object(User.objects, 'create_user', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                call_command('benchmark_bookings', '--requests', '5', '--concurrency', '1', stdout=StringIO())
+        self.assertFalse(Trip.objects.exists())
+        self.assertFalse(BusPark.objects.exists())
+        self.assertFalse(City.objects.exists())
+
+
+class IdentifierTests(TestCase):
+    def setUp(self):
+        # Each test database starts its sequences over
+        identifiers.booking_references._end = identifiers.temp_nins._end = 0
+
+    def test_check_characters(self):
+        self.assertEqual(identifiers.check_character("7992739871", string.digits), "3")
+        self.assertTrue(identifiers.is_valid("79927398713", string.digits))
+        code = identifiers.booking_reference_code()
+        self.assertTrue(identifiers.is_valid(code))
+        self.assertFalse(identifiers.is_valid(code[:2] + ("A" if code[2] != "A" else "B") + code[3:]))
 
-# Create your tests here.
+    def test_allocations_are_unique_and_mostly_lookup_free(self):
+        with self.settings(IDENTIFIER_BLOCK_SIZE=50), CaptureQueriesContext(connection) as queries:
+            codes = [identifiers.booking_reference_code() for _ in range(200)]
+            nins = [identifiers.temp_nin() for _ in range(200)]
+        self.assertEqual(len(queries), 8)  # One per block of 50
+        self.assertEqual(len(set(codes)), 200)
+        self.assertTrue(all(len(code) == 5 and code.isalnum() for code in codes))
+        self.assertEqual(len(set(nins)), 200)
+        self.assertTrue(all(len(nin) == 11 and nin.startswith("90") and identifiers.is_valid(nin, string.digits)
+                            for nin in nins))
@@ -5,7 +5,9 @@ from .views import (
     CityViewSet, BusParkViewSet, RouteViewSet, BookingViewSet,
     TripSearchAPIView, TripViewSet, BookingCreateAPIView, BusViewSet,
     ParkBusesView, ParkRoutesView, ParkTripsView, TripCreateView,
-    InitializePaymentView, PaymentCallbackView, PaystackWebhookView, TripDeleteView, TripUpdateView
+    InitializePaymentView, PaymentCallbackView, PaystackWebhookView, TripDeleteView, TripUpdateView,
+    MetricsView, FareCalendarView, JourneyPlannerView, PlaceSuggestView, TripSeatMapView,
+    TripWaitlistView, BookingCartCreateAPIView
 )
 
 router = DefaultRouter()
@@ -18,7 +20,13 @@ router.register('buses', BusViewSet)
 
 urlpatterns = [
     path('trips/search/', TripSearchAPIView.as_view(), name='trip-search'),
+    path('trips/calendar/', FareCalendarView.as_view(), name='fare-calendar'),
+    path('journeys/', JourneyPlannerView.as_view(), name='journey-planner'),
+    path('places/suggest/', PlaceSuggestView.as_view(), name='place-suggest'),
     path("bookings/create/", BookingCreateAPIView.as_view(), name="booking-create"),
+    path("bookings/cart/", BookingCartCreateAPIView.as_view(), name="booking-cart"),
+    path('trips/<int:trip_id>/seats/', TripSeatMapView.as_view(), name='trip-seats'),
+    path('trips/<int:trip_id>/waitlist/', TripWaitlistView.as_view(), name='trip-waitlist'),
     path('trips/<int:trip_id>/delete/', TripDeleteView.as_view(), name='trip-delete'),
     path('trips/<int:trip_id>/update/', TripUpdateView.as_view(), name='trip-update'),
     path('parks/<int:park_id>/buses/', ParkBusesView.as_view(), name='park_buses'),
@@ -28,6 +36,7 @@ urlpatterns = [
     path('payment/initialize/', InitializePaymentView.as_view(), name='initialize-payment'),
     path('payment/callback/', PaymentCallbackView.as_view(), name='payment-callback'),
     path('webhook/paystack/', PaystackWebhookView.as_view(), name='paystack-webhook'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
     path('', include(router.urls)),
 ]
 
@@ -1,28 +1,37 @@
-import random
-import string
-from datetime import datetime
-from .models import Booking 
+from datetime import datetime, time, timedelta
+from django.utils import timezone
+from .identifiers import booking_reference_code
 
-def generate_ref_code(trip, length=5):
+
+def local_day_range(day, days=1):
+    """
+    Return the half-open [start, end) datetime range covering `days` local
+    days starting at `day`, for index-friendly filters on departure_datetime.
+    """
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    end = timezone.make_aware(datetime.combine(day + timedelta(days=days), time.min))
+    return start, end
+
+def generate_ref_code(trip):
     """
-    Generate a unique reference code for a booking.
-    Format: REF-<DATE>-<PLATE>-<RANDOM>
+    Reference code for a new booking on `trip`, unique without a lookup.
+    Format: REF-<DATE>-<PLATE>-<CODE>, CODE being four sequence-derived
+    characters and a check character (see core.identifiers).
     Example: REF-20250411-DUGBE65-2A9FJ
     """
     # 1. Get trip date in YYYYMMDD format
     date_str = trip.departure_datetime.strftime("%Y%m%d")
-    
+
     # 2. Get bus number plate and strip special characters
     raw_plate = trip.bus.number_plate.upper().replace(" ", "").replace("-", "")
     plate_part = ''.join(filter(str.isalnum, raw_plate))[:7]  # Max 7 chars
 
-    while True:
-        # 3. Generate random code
-        rand_str = ''.join(random.choices(string.ascii_uppercase + string.digits, k=length))
+    return f"REF-{date_str}-{plate_part}-{booking_reference_code()}"
 
-        # 4. Construct the reference
-        ref = f"REF-{date_str}-{plate_part}-{rand_str}"
 
-        # 5. Check if it already exists
-        if not Booking.objects.filter(payment_reference=ref).exists():
-            return ref
\ No newline at end of file
+def generate_cart_ref_code(trip):
+    """
+    Payment reference of a cart whose first leg is `trip`.
+    Format: CART-<DATE>-<CODE>, CODE as in generate_ref_code.
+    """
+    return f"CART-{trip.departure_datetime.strftime('%Y%m%d')}-{booking_reference_code()}"
@@ -1,5 +1,6 @@
 
-from datetime import datetime
+import time
+from datetime import datetime, timedelta
 from rest_framework.views import APIView
 from rest_framework import viewsets, permissions
 from rest_framework.decorators import action
@@ -14,32 +15,152 @@ from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
 import requests
 import json
-from django.db.models import Q
-from django.http import HttpResponseRedirect
+from django.db.models import F, Q, Min, Count, Sum
+from django.db.models.functions import TruncDate
+from django.http import Http404, HttpResponseRedirect
 from django.db import transaction
 import logging
 
 
 logger = logging.getLogger(__name__)
 
+from . import metrics
+from .caching import (
+    trip_search_cache_key, trip_search_cache_timeout, get_or_build, conditional_get,
+    trip_search_request_scope, CATALOG_SCOPE, trip_scope, booking_scope,
+)
+from .geo import park_index, describe as describe_park
+from .holds import LIVE_STATUSES, confirm_payments, release_bookings, with_current_status
+from .idempotency import idempotent
+from .journeys import timetable
+from . import waitlist
+from .places import place_index
+from . import seatmap
+from .pagination import KeysetPagination
 from .models import *
+from .utils import local_day_range
 from .serializers import (
     CitySerializer, BusParkSerializer, RouteSerializer, BookingCreateSerializer,
     TripSerializer, TripListSerializer, IndirectRouteSerializer, BookingDetailSerializer,
-    BusSerializer, PaymentInitializationSerializer, BookingSerializer
+    BusSerializer, PaymentInitializationSerializer, BookingSerializer, TripCompactSerializer,
+    BookingCompactSerializer, side_load_parks_and_buses, TripSearchEntrySerializer,
+    TripSearchEntryCompactSerializer, BookingCartSerializer
 )
 
 
+def compact_requested(request):
+    return request.query_params.get('compact', '').lower() in ('1', 'true', 'yes')
+
+
+# Version scopes behind each conditional GET (see caching.conditional_get)
+
+def catalog_scopes(view, request, *args, **kwargs):
+    return [CATALOG_SCOPE]
+
+
+def trip_scopes(view, request, pk=None, **kwargs):
+    return [trip_scope(pk), CATALOG_SCOPE]
+
+
+def own_booking(view, request, pk=None, ref=None):
+    """(id, trip_id, departure_datetime) of the user's booking the request names, or None. Looked up once per request."""
+    if not hasattr(view, '_own_booking'):
+        lookup = {'pk': pk} if pk is not None else {'payment_reference': ref}
+        view._own_booking = Booking.objects.filter(user=request.user, **lookup).values_list(
+            'id', 'trip_id', 'trip__departure_datetime'
+        ).first()
+    return view._own_booking
+
+
+def booking_scopes(view, request, pk=None, ref=None, **kwargs):
+    booking = own_booking(view, request, pk, ref)
+    if booking is None:
+        return None  # Let the view answer 404
+    booking_id, trip_id, _ = booking
+    return [booking_scope(booking_id), trip_scope(trip_id), CATALOG_SCOPE]
+
+
+def booking_clock(view, request, pk=None, ref=None, **kwargs):
+    # A live booking reads as completed once its trip departs, without any write
+    departure = own_booking(view, request, pk, ref)[2]
+    if departure is None or departure > timezone.now():
+        return 0
+    return int(departure.timestamp())
+
+
+def search_scopes(view, request, *args, **kwargs):
+    if view.is_city_search() or view.nearby_radius() is not None:
+        return None
+    found = trip_search_request_scope(request.query_params)
+    if found is None:
+        return None
+    return [found[0], CATALOG_SCOPE]
+
+
+def search_clock(view, request, *args, **kwargs):
+    # Today's results lose trips as they depart without any write
+    found = trip_search_request_scope(request.query_params)
+    if found is None or found[1] != timezone.localdate():
+        return 0
+    step = settings.TRIP_SEARCH_CACHE_TODAY_TIMEOUT
+    return int(time.time()) // step * step
+
+
 class CityViewSet(viewsets.ModelViewSet):
     queryset = City.objects.all()
     serializer_class = CitySerializer
     permission_classes = [permissions.AllowAny]
+    keyset_ordering = ('state', 'name', 'id')
+
+    @conditional_get(catalog_scopes)
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @conditional_get(catalog_scopes)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
 
 
 class BusParkViewSet(viewsets.ModelViewSet):
-    queryset = BusPark.objects.all()
+    queryset = BusPark.objects.select_related('city')
     serializer_class = BusParkSerializer
     permission_classes = [permissions.AllowAny]
+    keyset_ordering = ('name', 'id')
+
+    @conditional_get(catalog_scopes)
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @conditional_get(catalog_scopes)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    @action(detail=False, methods=["get"], url_path="nearby")
+    def nearby(self, request):
+        """Active parks nearest to lat/lng, optionally only those within radius_km."""
+        params = request.query_params
+        try:
+            latitude = float(params['lat'])
+            longitude = float(params['lng'])
+            limit = int(params.get('limit', 10))
+            radius_km = float(params['radius_km']) if params.get('radius_km') else None
+        except (KeyError, ValueError):
+            return Response(
+                {"error": "lat and lng are required numbers; limit and radius_km must be numbers."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not -90 <= latitude <= 90 or not -180 <= longitude <= 180:
+            return Response({"error": "lat/lng out of range."}, status=status.HTTP_400_BAD_REQUEST)
+        limit = max(1, min(limit, settings.NEARBY_PARKS_MAX_LIMIT))
+        if radius_km is not None:
+            radius_km = max(0, min(radius_km, settings.NEARBY_PARKS_MAX_RADIUS_KM))
+
+        park_index.ensure_fresh()
+        if radius_km is not None:
+            found = park_index.within(latitude, longitude, radius_km)[:limit]
+        else:
+            found = park_index.nearest(latitude, longitude, limit)
+        return Response({"results": [describe_park(distance, park) for distance, park in found]})
 
 
 class RouteViewSet(viewsets.ModelViewSet):
@@ -48,9 +169,10 @@ class RouteViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
+        routes = Route.objects.select_related('origin_park__city', 'destination_park__city')
         if self.request.user.role == 'park_admin':
-            return Route.objects.filter(origin_park__admin=self.request.user, status="active")
-        return Route.objects.all()
+            return routes.filter(origin_park__admin=self.request.user, status="active")
+        return routes
 
 
 
@@ -59,18 +181,38 @@ class RouteViewSet(viewsets.ModelViewSet):
 class BookingViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated]
 
+    # Travel history filters (?filter=) and the order each is paged in; departs_at is the trip's departure
+    HISTORY_ORDERINGS = {
+        None: ('-departs_at', '-id'),
+        'upcoming': ('departs_at', 'id'),
+        'past': ('-departs_at', '-id'),
+        'cancelled': ('-created_at', '-id'),
+    }
+
+    @property
+    def keyset_ordering(self):
+        if self.action == "history":
+            return self.HISTORY_ORDERINGS[self.history_filter()]
+        return ('-created_at', '-id')
+
+    def history_filter(self):
+        return self.request.query_params.get('filter') or None
+
     def get_serializer_class(self):
-        if self.action in ["list", "retrieve", "get_by_reference"]:
+        if self.action in ["list", "history"] and compact_requested(self.request):
+            return BookingCompactSerializer
+        if self.action in ["list", "history", "retrieve", "get_by_reference"]:
             return BookingDetailSerializer
         elif self.action in ["create"]:
             return BookingCreateSerializer
         return BookingSerializer
 
     @action(detail=False, methods=["get"], url_path=r"ref/(?P<ref>[A-Za-z0-9\-]+)")
+    @conditional_get(booking_scopes, clock_for=booking_clock)
     def get_by_reference(self, request, ref=None):
         try:
-            booking = Booking.objects.get(payment_reference=ref, user=request.user)
-            serializer = BookingDetailSerializer(booking)
+            booking = self.get_queryset().get(payment_reference=ref)
+            serializer = BookingDetailSerializer(booking, context=self.get_serializer_context())
             return Response(serializer.data)
         except Booking.DoesNotExist:
             return Response(
@@ -79,79 +221,543 @@ class BookingViewSet(viewsets.ModelViewSet):
             )
 
     def get_queryset(self):
-        bookings = Booking.objects.filter(user=self.request.user)
+        # Bookings of departed trips read as completed; complete_departed_bookings stores it in bulk
+        bookings = with_current_status(Booking.objects.filter(user=self.request.user))
+        if self.action == "history":
+            bookings = self.history_queryset(bookings)
+        if self.action in ["list", "history", "retrieve", "get_by_reference"]:
+            serializer_class = self.get_serializer_class()
+            return serializer_class.setup_eager_loading(bookings, self.selected_fields())
+        return bookings
 
-        # Auto-update expired bookings to "completed"
+    def history_queryset(self, bookings):
         now = timezone.now()
-        for booking in bookings:
-            if (
-                booking.status in ["confirmed", "pending"]
-                and booking.trip
-                and booking.trip.departure_datetime < now
-            ):
-                booking.status = "completed"
-                booking.save(update_fields=["status"])
-        return bookings
+        bookings = bookings.exclude(trip=None).annotate(departs_at=F('trip__departure_datetime'))
+        departed = Q(trip__departure_datetime__lt=now)
+        return {
+            None: bookings,
+            'upcoming': bookings.filter(~departed, status__in=LIVE_STATUSES),
+            'past': bookings.filter(departed & Q(status__in=LIVE_STATUSES) | Q(status="completed")),
+            'cancelled': bookings.filter(status="cancelled"),
+        }[self.history_filter()]
+
+    @action(detail=False, methods=["get"])
+    def history(self, request, *args, **kwargs):
+        """
+        A passenger's trips, ?filter=upcoming (soonest first), past or
+        cancelled (latest first), cursor paged. Takes ?fields=, ?expand= and
+        ?compact=1 like the booking list, with the same fixed query count.
+        """
+        if self.history_filter() not in self.HISTORY_ORDERINGS:
+            return Response(
+                {"error": "filter must be one of upcoming, past or cancelled."}, status=status.HTTP_400_BAD_REQUEST
+            )
+        return self.list(request, *args, **kwargs)
+
+    def selected_fields(self):
+        return self.get_serializer_class().selected_fields(self.request.query_params)
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.action in ["list", "history", "retrieve", "get_by_reference"]:
+            context['selected_fields'] = self.selected_fields()
+        return context
+
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        if compact_requested(request):
+            response.data['included'] = side_load_parks_and_buses(response.data['results'])
+        return response
+
+    @conditional_get(booking_scopes, clock_for=booking_clock)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
     def perform_update(self, serializer):
-        instance = self.get_object()
+        instance = serializer.instance
         with transaction.atomic():
-            trip = Trip.objects.select_for_update().get(id=instance.trip.id)
-            if serializer.validated_data.get("status") == "cancelled" and instance.status != "cancelled":
-                # Release seats and update available_seats
-                if instance.payment_status in ["successful", "pending"]:
-                    trip.available_seats += instance.seat_count
-                    instance.seat_assignments.all().delete()  # Delete seat assignments
-                    trip.save()
+            if serializer.validated_data.get("status") == "cancelled" and instance.status in LIVE_STATUSES:
+                # Gives the seats back, to the trip's waitlist first
+                release_bookings(Booking.objects.select_for_update().filter(id=instance.id), payment_status=None)
+                instance.refresh_from_db()
             serializer.save()
 
 class TripSearchAPIView(ListAPIView):
     serializer_class = TripListSerializer
     permission_classes = [permissions.AllowAny]
 
-    def get_queryset(self):
-        origin_id = self.request.query_params.get('origin_id')
-        destination_id = self.request.query_params.get('destination_id')
+    CITY_PARAMS = ('origin_city_id', 'destination_city_id', 'origin_city', 'destination_city')
+
+    @property
+    def keyset_ordering(self):
+        return ('departure_datetime', 'trip_id') if self.reads_index() else ('departure_datetime', 'id')
+
+    def is_city_search(self):
+        return any(self.request.query_params.get(param) for param in self.CITY_PARAMS)
+
+    def reads_index(self):
+        # Dated searches by park or city id are served from TripSearchEntry
+        params = self.request.query_params
+        if not settings.TRIP_SEARCH_FROM_INDEX or params.get('origin_city') or params.get('destination_city'):
+            return False
+        try:
+            datetime.strptime(params.get('date', ''), '%Y-%m-%d')
+        except ValueError:
+            return False
+        return True
+
+    def index_queryset(self, origin_parks=None):
+        params = self.request.query_params
+        day_start, day_end = local_day_range(datetime.strptime(params['date'], '%Y-%m-%d').date())
+        entries = TripSearchEntry.objects.filter(
+            departure_datetime__gte=max(day_start, timezone.now()),
+            departure_datetime__lt=day_end,
+        )
+        if self.is_city_search():
+            entries = entries.filter(bookable=True)
+        filters = {}
+        for side in ('origin', 'destination'):
+            if side == 'origin' and origin_parks is not None:
+                filters['origin_park_id__in'] = origin_parks
+            elif params.get(f'{side}_id'):
+                filters[f'{side}_park_id'] = params[f'{side}_id']
+            elif params.get(f'{side}_city_id'):
+                filters[f'{side}_city_id'] = params[f'{side}_city_id']
+        try:
+            return entries.filter(**filters)
+        except ValueError:
+            return entries.none()
+
+    def filter_endpoint(self, queryset, side):
+        # A park id wins; otherwise a city id or slug expands to every active park in that city
+        params = self.request.query_params
+        park_id = params.get(f'{side}_id')
+        city_id = params.get(f'{side}_city_id')
+        city_slug = params.get(f'{side}_city')
+        park_field = f'route__{side}_park'
+
+        if park_id:
+            return queryset.filter(**{f'{park_field}_id': park_id})
+        if city_id:
+            return queryset.filter(**{f'{park_field}__city_id': city_id, f'{park_field}__status': 'active'})
+        if city_slug:
+            return queryset.filter(**{f'{park_field}__city__slug': city_slug, f'{park_field}__status': 'active'})
+        return queryset
+
+    def get_queryset(self, origin_parks=None):
+        if self.reads_index():
+            return self.index_queryset(origin_parks)
+
         travel_date = self.request.query_params.get('date')
 
         queryset = Trip.objects.all()
-        print("Initial queryset:", queryset)  # Debugging line
-        print("Origin ID:", origin_id)  # Debugging line
-        print("Destination ID:", destination_id)  # Debugging line
-        print("Travel Date:", travel_date)  # Debugging line
+        logger.debug(f"Trip search: {self.request.query_params.dict()}")
 
         # Apply origin and destination filters
-        if origin_id:
-            queryset = queryset.filter(route__origin_park_id=origin_id)
-        if destination_id:
-            queryset = queryset.filter(route__destination_park_id=destination_id)
+        if origin_parks is not None:
+            queryset = queryset.filter(route__origin_park_id__in=origin_parks)
+        else:
+            queryset = self.filter_endpoint(queryset, 'origin')
+        queryset = self.filter_endpoint(queryset, 'destination')
+        if self.is_city_search():
+            queryset = queryset.filter(route__status='active')
 
         # Apply date and time filters
         if travel_date:
             try:
                 # Parse the travel_date (assuming format like '2025-04-30')
                 travel_date_obj = datetime.strptime(travel_date, '%Y-%m-%d').date()
-                today = timezone.now().date()
-
-                if travel_date_obj == today:
-                    # For today, only include trips with departure time >= now
-                    queryset = queryset.filter(
-                        Q(departure_datetime__date=travel_date_obj) &
-                        Q(departure_datetime__gte=timezone.now())
-                    )
-                else:
-                    # For future dates, include all trips on that date
-                    queryset = queryset.filter(departure_datetime__date=travel_date_obj)
+                # Half-open range over the local (Lagos) day so the departure index is used
+                day_start, day_end = local_day_range(travel_date_obj)
+
+                # For today, only include trips with departure time >= now
+                queryset = queryset.filter(
+                    departure_datetime__gte=max(day_start, timezone.now()),
+                    departure_datetime__lt=day_end,
+                )
             except ValueError:
                 # Handle invalid date format
-                print(f"Invalid date format for travel_date: {travel_date}")
+                logger.debug(f"Invalid date format for travel_date: {travel_date}")
                 queryset = queryset.none()  # Return empty queryset for invalid date
 
-        print("Queryset after filtering:", queryset)  # Debugging line
-        return queryset.order_by('departure_datetime')
+        return self.get_serializer_class().setup_eager_loading(queryset, self.selected_fields())
+
+    def get_serializer_class(self):
+        if self.reads_index():
+            return TripSearchEntryCompactSerializer if compact_requested(self.request) else TripSearchEntrySerializer
+        return TripCompactSerializer if compact_requested(self.request) else TripListSerializer
+
+    def paginate_queryset(self, queryset):
+        page = super().paginate_queryset(queryset)
+        if page and queryset.model is TripSearchEntry and 'booked_seats' in self.selected_fields():
+            # One batched lookup for the page, the entries carry everything else
+            seats = {}
+            rows = SeatAssignment.objects.filter(trip_id__in=[entry.trip_id for entry in page])
+            for trip_id, seat_number in rows.values_list('trip_id', 'seat_number'):
+                seats.setdefault(trip_id, []).append(seat_number)
+            for entry in page:
+                entry.booked_seat_numbers = seats.get(entry.trip_id, [])
+        return page
+
+    def selected_fields(self):
+        fields = self.get_serializer_class().selected_fields(self.request.query_params)
+        if self.is_city_search():
+            # Needed to group the page by park pair
+            fields |= {'origin_park_id', 'destination_park_id'} if compact_requested(self.request) else {'route'}
+        return fields
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['selected_fields'] = self.selected_fields()
+        return context
+
+    @conditional_get(search_scopes, clock_for=search_clock)
+    def list(self, request, *args, **kwargs):
+        if self.is_city_search():
+            return self.list_by_park_pair()
+
+        # Fallback results span other parks' searches, their invalidation doesn't reach this key
+        cached = None if self.nearby_radius() is not None else trip_search_cache_key(request.query_params)
+        if cached is None:
+            return Response(self.build_page())
+
+        cache_key, travel_date = cached
+        data = get_or_build(cache_key, self.build_page, trip_search_cache_timeout(travel_date))
+        return Response(data)
+
+    def nearby_radius(self):
+        # ?nearby_km= falls back to trips from parks around an origin park with none
+        params = self.request.query_params
+        if not params.get('origin_id') or not params.get('nearby_km'):
+            return None
+        try:
+            radius = float(params['nearby_km'])
+        except ValueError:
+            return None
+        return min(radius, settings.NEARBY_PARKS_MAX_RADIUS_KM) if radius > 0 else None
+
+    def nearby_origin_parks(self, radius_km):
+        park_index.ensure_fresh()
+        try:
+            origin_id = int(self.request.query_params['origin_id'])
+        except ValueError:
+            return []
+        origin = park_index.get(origin_id)
+        if origin is not None:
+            position = (origin.latitude, origin.longitude)
+        else:
+            position = BusPark.objects.filter(id=origin_id).values_list('latitude', 'longitude').first()
+            if position is None:
+                return []
+        return [
+            (distance, park) for distance, park in park_index.within(*position, radius_km)
+            if park.id != origin_id
+        ]
+
+    def build_page(self):
+        page = self.paginate_queryset(self.get_queryset())
+        nearby = []
+        radius = self.nearby_radius()
+        if not page and radius is not None:
+            nearby = self.nearby_origin_parks(radius)
+            if nearby:
+                page = self.paginate_queryset(self.get_queryset(origin_parks=[park.id for _, park in nearby]))
+        data = self.get_serializer(page, many=True).data
+        response = self.get_paginated_response(data)
+        if nearby:
+            response.data['nearby_origin_parks'] = [describe_park(distance, park) for distance, park in nearby]
+        if compact_requested(self.request):
+            response.data['included'] = side_load_parks_and_buses(data)
+        return response.data
+
+    def list_by_park_pair(self):
+        # City-to-city search: one query for every park pair, the page is grouped here
+        page = self.paginate_queryset(self.get_queryset())
+        serializer = self.get_serializer(page, many=True)
+        compact = compact_requested(self.request)
+        groups = {}
+        for trip in serializer.data:
+            if compact:
+                pair = (trip['origin_park_id'], trip['destination_park_id'])
+                group = {"origin_park_id": pair[0], "destination_park_id": pair[1]}
+            else:
+                route = trip['route']
+                pair = (route['origin_park']['id'], route['destination_park']['id'])
+                group = {"origin_park": route['origin_park'], "destination_park": route['destination_park']}
+            groups.setdefault(pair, dict(group, trips=[]))["trips"].append(trip)
+        response = self.get_paginated_response(list(groups.values()))
+        if compact:
+            response.data['included'] = side_load_parks_and_buses(serializer.data)
+        return response
+
+
+class FareCalendarView(APIView):
+    """
+    Cheapest fare, departures and seats left per local travel day for an
+    origin/destination pair, computed with one grouped query over Trip.
+    """
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request):
+        origin_id = request.query_params.get('origin_id')
+        destination_id = request.query_params.get('destination_id')
+        if not origin_id or not destination_id:
+            return Response({"error": "origin_id and destination_id are required."}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            origin_id, destination_id = int(origin_id), int(destination_id)
+            start_date = datetime.strptime(
+                request.query_params.get('start', timezone.localdate().isoformat()), '%Y-%m-%d'
+            ).date()
+            days = int(request.query_params.get('days', 7))
+        except ValueError:
+            return Response(
+                {"error": "Use integer park ids, start=YYYY-MM-DD and an integer number of days."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not 1 <= days <= settings.FARE_CALENDAR_MAX_DAYS:
+            return Response(
+                {"error": f"days must be between 1 and {settings.FARE_CALENDAR_MAX_DAYS}."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        window_start, window_end = local_day_range(start_date, days)
+        trips = Trip.objects.filter(
+            route__origin_park_id=origin_id,
+            route__destination_park_id=destination_id,
+            departure_datetime__gte=max(window_start, timezone.now()),
+            departure_datetime__lt=window_end,
+        )
+        rows = trips.annotate(
+            day=TruncDate('departure_datetime', tzinfo=timezone.get_current_timezone())
+        ).values('day').annotate(
+            min_price=Min('seat_price', filter=Q(available_seats__gt=0)),
+            departures=Count('id'),
+            available_seats=Sum('available_seats'),
+        ).order_by('day')
+        by_day = {row['day']: row for row in rows}
+
+        calendar = []
+        for offset in range(days):
+            day = start_date + timedelta(days=offset)
+            row = by_day.get(day, {})
+            calendar.append({
+                "date": day,
+                "min_price": row.get('min_price'),
+                "departures": row.get('departures', 0),
+                "available_seats": row.get('available_seats') or 0,
+            })
+
+        # Point clients at the next bookable day instead of letting them walk forward
+        next_available_date = None
+        if calendar[0]["available_seats"] == 0:
+            next_available_date = next((entry["date"] for entry in calendar if entry["available_seats"]), None)
+            if next_available_date is None:
+                next_departure = Trip.objects.filter(
+                    route__origin_park_id=origin_id,
+                    route__destination_park_id=destination_id,
+                    departure_datetime__gte=window_end,
+                    available_seats__gt=0,
+                ).order_by('departure_datetime').values_list('departure_datetime', flat=True).first()
+                if next_departure:
+                    next_available_date = timezone.localtime(next_departure).date()
+
+        return Response({
+            "origin_id": int(origin_id),
+            "destination_id": int(destination_id),
+            "start": start_date,
+            "days": days,
+            "calendar": calendar,
+            "next_available_date": next_available_date,
+        }, status=status.HTTP_200_OK)
+
+
+class TripSeatMapView(APIView):
+    """
+    Seat occupancy of a trip as bitsets (see core.seatmap). With
+    ?since=<version> only the seats changed after that version are returned,
+    unless the change log no longer covers it.
+    """
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request, trip_id):
+        since = request.query_params.get('since')
+        if since:
+            try:
+                since = int(since)
+            except ValueError:
+                return Response({"error": "since must be a seat map version."}, status=status.HTTP_400_BAD_REQUEST)
+            changes = seatmap.delta(trip_id, since)
+            if changes is not None:
+                return Response(changes)
+
+        trip = Trip.objects.filter(id=trip_id).values_list(
+            'bus__total_seats', 'available_seats', 'bus__seats_per_row'
+        ).first()
+        if trip is None:
+            return Response({"error": "Trip not found."}, status=status.HTTP_404_NOT_FOUND)
+        return Response(seatmap.full_map(trip_id, *trip))
+
+
+class TripWaitlistView(APIView):
+    """
+    The requesting passenger's place on a sold-out trip's waitlist (GET),
+    joining it (POST with seat_count) and leaving it (DELETE). Freed seats
+    are handed out in queue order as pending bookings, see core.waitlist.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def describe(self, entry):
+        data = {"trip": entry.trip_id, "status": entry.status, "seat_count": entry.seat_count,
+                "joined_at": entry.created_at}
+        if entry.status == "waiting":
+            data["position"], data["seats_ahead"] = waitlist.position(entry)
+        elif entry.status == "promoted" and entry.booking:
+            data["booking"] = {
+                "id": entry.booking.id, "payment_reference": entry.booking.payment_reference,
+                "status": entry.booking.status, "hold_expires_at": entry.booking.hold_expires_at,
+            }
+        return data
+
+    def get(self, request, trip_id):
+        entry = WaitlistEntry.objects.select_related('booking').filter(
+            trip_id=trip_id, user=request.user, status__in=["waiting", "promoted"]
+        ).order_by('-created_at').first()
+        if entry is None:
+            return Response({"error": "You are not on this trip's waitlist."}, status=status.HTTP_404_NOT_FOUND)
+        return Response(self.describe(entry))
+
+    def post(self, request, trip_id):
+        try:
+            seat_count = int(request.data.get('seat_count', 1))
+        except (TypeError, ValueError):
+            return Response({"error": "seat_count must be an integer."}, status=status.HTTP_400_BAD_REQUEST)
+        with transaction.atomic():
+            # Seat releases update the trip row, so this check and the join cannot straddle one
+            trip = Trip.objects.select_for_update(of=('self',)).select_related('bus').filter(id=trip_id).first()
+            if trip is None:
+                return Response({"error": "Trip not found."}, status=status.HTTP_404_NOT_FOUND)
+            if not 1 <= seat_count <= trip.bus.total_seats:
+                return Response(
+                    {"error": f"seat_count must be between 1 and {trip.bus.total_seats}."},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            if trip.departure_datetime <= timezone.now():
+                return Response({"error": "This trip has departed."}, status=status.HTTP_400_BAD_REQUEST)
+            if trip.available_seats >= seat_count:
+                return Response(
+                    {"error": f"{trip.available_seats} seats are available, book them instead."},
+                    status=status.HTTP_409_CONFLICT,
+                )
+            entry, created = WaitlistEntry.objects.get_or_create(
+                trip=trip, user=request.user, status="waiting", defaults={"seat_count": seat_count}
+            )
+        if created:
+            metrics.incr("waitlist.joined")
+        return Response(self.describe(entry), status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
+
+    def delete(self, request, trip_id):
+        left = WaitlistEntry.objects.filter(trip_id=trip_id, user=request.user, status="waiting").update(status="left")
+        if not left:
+            return Response({"error": "You are not on this trip's waitlist."}, status=status.HTTP_404_NOT_FOUND)
+        metrics.incr("waitlist.left")
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class PlaceSuggestView(APIView):
+    """
+    Typeahead over cities and parks from the in-process prefix index, ranked
+    by exact matches first, then booking popularity.
+    """
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request):
+        query = request.query_params.get('q', '')
+        kind = request.query_params.get('type')
+        try:
+            limit = int(request.query_params.get('limit', 8))
+        except ValueError:
+            return Response({"error": "limit must be an integer."}, status=status.HTTP_400_BAD_REQUEST)
+        if kind not in (None, 'city', 'park'):
+            return Response({"error": "type must be city or park."}, status=status.HTTP_400_BAD_REQUEST)
+
+        place_index.ensure_fresh()
+        limit = max(1, min(limit, settings.PLACE_SUGGEST_MAX_LIMIT))
+        return Response({"results": place_index.suggest(query, limit=limit, kind=kind)})
+
+
+class JourneyPlannerView(APIView):
+    """
+    Earliest-arrival and cheapest journeys between two parks or cities with
+    up to JOURNEY_PLANNER_MAX_TRANSFERS changes, planned over the in-memory
+    timetable of upcoming trips.
+    """
+    permission_classes = [permissions.AllowAny]
+
+    def resolve_parks(self, side):
+        params = self.request.query_params
+        if params.get(f'{side}_id'):
+            return {int(params[f'{side}_id'])}
+        if params.get(f'{side}_city_id'):
+            return set(BusPark.objects.filter(
+                city_id=params[f'{side}_city_id'], status='active'
+            ).values_list('id', flat=True))
+        return set()
+
+    def get(self, request):
+        params = request.query_params
+        try:
+            origin_parks = self.resolve_parks('origin')
+            destination_parks = self.resolve_parks('destination')
+            min_transfer = int(params.get('min_transfer_minutes', settings.JOURNEY_PLANNER_DEFAULT_TRANSFER_MINUTES))
+            max_transfers = int(params.get('max_transfers', settings.JOURNEY_PLANNER_MAX_TRANSFERS))
+            seats = int(params.get('seats', 1))
+            travel_date = datetime.strptime(params['date'], '%Y-%m-%d').date() if params.get('date') else None
+        except ValueError:
+            return Response(
+                {"error": "Invalid parameters. Use integer ids/minutes/seats and date=YYYY-MM-DD."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not origin_parks or not destination_parks:
+            return Response(
+                {"error": "Provide origin_id or origin_city_id and destination_id or destination_city_id."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not 0 <= max_transfers <= settings.JOURNEY_PLANNER_MAX_TRANSFERS or min_transfer < 0 or seats < 1:
+            return Response(
+                {"error": f"max_transfers must be between 0 and {settings.JOURNEY_PLANNER_MAX_TRANSFERS}."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        depart_after = timezone.now()
+        if travel_date:
+            depart_after = max(depart_after, local_day_range(travel_date)[0])
+        window = timedelta(hours=settings.JOURNEY_PLANNER_WINDOW_HOURS)
+
+        # Seat counts change with every booking, so read them fresh
+        excluded_trips = frozenset(Trip.objects.filter(
+            departure_datetime__gte=depart_after,
+            departure_datetime__lt=depart_after + window,
+            available_seats__lt=seats,
+        ).values_list('id', flat=True))
+
+        timetable.ensure_fresh()
+        query = dict(
+            origin_parks=origin_parks,
+            destination_parks=destination_parks,
+            depart_after=depart_after.timestamp(),
+            window_seconds=window.total_seconds(),
+            min_transfer=min_transfer * 60,
+            max_legs=max_transfers + 1,
+            excluded_trips=excluded_trips,
+        )
+        return Response({
+            "earliest": timetable.describe(timetable.earliest_arrival(**query)),
+            "cheapest": timetable.describe(timetable.cheapest(**query)),
+        }, status=status.HTTP_200_OK)
 
 
 class BookingCreateAPIView(CreateAPIView):
@@ -159,6 +765,7 @@ class BookingCreateAPIView(CreateAPIView):
     serializer_class = BookingCreateSerializer
     permission_classes = [IsAuthenticated]
 
+    @idempotent("booking_create")
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data, context={'request': request})
         serializer.is_valid(raise_exception=True)
@@ -171,21 +778,57 @@ class BookingCreateAPIView(CreateAPIView):
         }, status=status.HTTP_201_CREATED)
 
 
+class BookingCartCreateAPIView(CreateAPIView):
+    """
+    Books several trips at once (e.g. both legs of a return journey): all
+    legs are reserved or none is, and they share one payment reference.
+    """
+    queryset = BookingCart.objects.all()
+    serializer_class = BookingCartSerializer
+    permission_classes = [IsAuthenticated]
+
+    @idempotent("booking_cart")
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        cart = serializer.save()
+        bookings = cart.bookings.select_related(
+            'trip__bus', 'trip__route__origin_park__city', 'trip__route__destination_park__city', 'user',
+        ).prefetch_related('seat_assignments').order_by('trip__departure_datetime')
+        return Response({
+            'message': 'Cart booked successfully',
+            'cart': {
+                'id': cart.id,
+                'payment_reference': cart.payment_reference,
+                'price': sum(booking.price for booking in bookings),
+                'bookings': BookingDetailSerializer(bookings, many=True).data,
+            },
+            'payment_url': '/api/payment/initialize/'
+        }, status=status.HTTP_201_CREATED)
+
+
 class IsParkAdmin(permissions.BasePermission):
     def has_permission(self, request, view):
         return request.user.is_authenticated and request.user.role == 'park_admin'
 
 
 class TripViewSet(viewsets.ModelViewSet):
-    queryset = Trip.objects.all()
+    queryset = Trip.objects.select_related(
+        'route__origin_park__city', 'route__destination_park__city', 'bus__park__city'
+    )
     serializer_class = TripSerializer
     permission_classes = [permissions.IsAuthenticated]
+    keyset_ordering = ('departure_datetime', 'id')
 
     def get_queryset(self):
         if self.request.user.role == 'park_admin':
-            return Trip.objects.filter(route__origin_park__admin=self.request.user)
+            return self.queryset.filter(route__origin_park__admin=self.request.user)
         return self.queryset
 
+    @conditional_get(trip_scopes)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
     def perform_create(self, serializer):
         if self.request.user.role == 'park_admin':
             route = serializer.validated_data['route']
@@ -202,16 +845,16 @@ class TripViewSet(viewsets.ModelViewSet):
 
 
 class BusViewSet(viewsets.ModelViewSet):
-    queryset = Bus.objects.all()
+    queryset = Bus.objects.select_related('park__city')
     serializer_class = BusSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
         if self.request.user.role == 'park_admin':
-            return Bus.objects.filter(park__admin=self.request.user)
+            return self.queryset.filter(park__admin=self.request.user)
         park_id = self.request.query_params.get('park', None)
         if park_id:
-            return Bus.objects.filter(park_id=park_id)
+            return self.queryset.filter(park_id=park_id)
         return self.queryset
 
 
@@ -249,6 +892,7 @@ class ParkRoutesView(APIView):
 
 class ParkTripsView(APIView):
     permission_classes = [IsAuthenticated]
+    keyset_ordering = ('departure_datetime', 'id')
 
     def get(self, request, park_id):
         try:
@@ -257,9 +901,19 @@ class ParkTripsView(APIView):
             trips = Trip.objects.filter(
                 route__origin_park=park,
                 departure_datetime__gte=now  # Only show trips that are today or in future
-            ).order_by('departure_datetime')
-            serializer = TripListSerializer(trips, many=True)
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            )
+            compact = compact_requested(request)
+            serializer_class = TripCompactSerializer if compact else TripListSerializer
+            fields = serializer_class.selected_fields(request.query_params)
+            paginator = KeysetPagination()
+            page = paginator.paginate_queryset(
+                serializer_class.setup_eager_loading(trips, fields), request, view=self
+            )
+            serializer = serializer_class(page, many=True, context={'selected_fields': fields})
+            response = paginator.get_paginated_response(serializer.data)
+            if compact:
+                response.data['included'] = side_load_parks_and_buses(serializer.data)
+            return response
         except BusPark.DoesNotExist:
             return Response(
                 {"error": "Park not found or you do not have access."},
@@ -303,11 +957,9 @@ class TripCreateView(APIView):
                         errors.append({"trip_index": index, "error": f"Bus {bus.number_plate} does not belong to the specified park."})
                         continue
 
-                    # Check for ±2 hour bus conflict
+                    # Check for ±2 hour bus conflict (also across midnight)
                     bus_conflict = Trip.objects.filter(
                         bus=bus,
-                        departure_datetime__date=departure_datetime.date()
-                    ).filter(
                         departure_datetime__range=[
                             departure_datetime - timezone.timedelta(hours=2),
                             departure_datetime + timezone.timedelta(hours=2)
@@ -381,32 +1033,26 @@ class TripUpdateView(APIView):
 class InitializePaymentView(APIView):
     permission_classes = [IsAuthenticated]
 
+    @idempotent("payment_initialize")
     def post(self, request):
         serializer = PaymentInitializationSerializer(data=request.data)
         if serializer.is_valid():
-            booking = get_object_or_404(Booking, id=serializer.validated_data['booking_id'], user=request.user)
+            if 'cart_id' in serializer.validated_data:
+                cart = get_object_or_404(BookingCart, id=serializer.validated_data['cart_id'], user=request.user)
+                bookings = list(cart.bookings.all())
+                reference, metadata = cart.payment_reference, {'cart_id': cart.id}
+            else:
+                booking = get_object_or_404(Booking, id=serializer.validated_data['booking_id'], user=request.user)
+                bookings = [booking]
+                reference, metadata = booking.payment_reference, {'booking_id': booking.id}
             
-            if booking.payment_status != 'pending':
+            if not bookings or any(booking.payment_status != 'pending' or booking.status != 'pending' for booking in bookings):
                 return Response({'error': 'Payment already processed or invalid.'}, status=status.HTTP_400_BAD_REQUEST)
-            
-            # Verify seat assignments
-            with transaction.atomic():
-                trip = Trip.objects.select_for_update().get(id=booking.trip.id)
-                seat_assignments = booking.seat_assignments.values_list('seat_number', flat=True)
-                conflicting_seats = SeatAssignment.objects.filter(
-                    trip=trip,
-                    seat_number__in=seat_assignments
-                ).exclude(booking=booking).values_list('seat_number', flat=True)
-                if conflicting_seats:
-                    booking.payment_status = 'failed'
-                    booking.status = 'cancelled'
-                    booking.seat_assignments.delete()
-                    trip.available_seats += booking.seat_count
-                    trip.save()
-                    return Response(
-                        {'error': f'Seats {list(conflicting_seats)} are no longer available.'},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
+            # Seats are unique per trip, so a pending booking still holds its seats until the hold expires
+            now = timezone.now()
+            if any(booking.hold_expires_at and booking.hold_expires_at <= now for booking in bookings):
+                return Response({'error': 'Your seat hold has expired, please book again.'}, status=status.HTTP_400_BAD_REQUEST)
+            held = Booking.objects.select_for_update().filter(id__in=[booking.id for booking in bookings])
 
             url = 'https://api.paystack.co/transaction/initialize'
             headers = {
@@ -414,13 +1060,13 @@ class InitializePaymentView(APIView):
                 'Content-Type': 'application/json',
             }
             data = {
-                'email': booking.user.email,
-                'amount': int(booking.price * 100),
-                'reference': booking.payment_reference,
+                'email': request.user.email,
+                'amount': int(round(sum(booking.price for booking in bookings) * 100)),
+                'reference': reference,
                 'callback_url': request.build_absolute_uri('/api/payment/callback/'),
                 'metadata': {
-                    'booking_id': booking.id,
-                    'user_id': booking.user.id,
+                    **metadata,
+                    'user_id': request.user.id,
                 }
             }
             
@@ -431,30 +1077,30 @@ class InitializePaymentView(APIView):
                 if response_data['status'] and response_data['data']['authorization_url']:
                     return Response({
                         'authorization_url': response_data['data']['authorization_url'],
-                        'reference': booking.payment_reference
+                        'reference': reference
                     }, status=status.HTTP_200_OK)
                 else:
-                    with transaction.atomic():
-                        booking.payment_status = 'failed'
-                        booking.status = 'cancelled'
-                        booking.seat_assignments.delete()
-                        trip = Trip.objects.select_for_update().get(id=booking.trip.id)
-                        trip.available_seats += booking.seat_count
-                        trip.save()
+                    release_bookings(held)
                     return Response({'error': 'Failed to initialize payment.'}, status=status.HTTP_400_BAD_REQUEST)
             except requests.RequestException as e:
-                with transaction.atomic():
-                    booking.payment_status = 'failed'
-                    booking.status = 'cancelled'
-                    booking.seat_assignments.delete()
-                    trip = Trip.objects.select_for_update().get(id=booking.trip.id)
-                    trip.available_seats += booking.seat_count
-                    trip.save()
+                release_bookings(held)
                 return Response({'error': f'Error: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 # bus_booking/views.py
 
+def payment_bookings(reference):
+    """The bookings a Paystack reference pays for: one booking, or every leg of a cart."""
+    # Matching through the cart is an outer join, which PostgreSQL will not lock rows
+    # through, so callers get (and lock) a plain filter on the ids
+    ids = list(Booking.objects.filter(
+        Q(payment_reference=reference) | Q(cart__payment_reference=reference)
+    ).values_list('id', flat=True))
+    if not ids:
+        raise Http404("No booking matches the given reference.")
+    return Booking.objects.filter(id__in=ids)
+
+
 class PaymentCallbackView(APIView):
     def get(self, request):
         reference = request.query_params.get('reference')
@@ -471,35 +1117,22 @@ class PaymentCallbackView(APIView):
             response = requests.get(url, headers=headers)
             response_data = response.json()
             
-            booking = get_object_or_404(Booking, payment_reference=reference)
+            bookings = payment_bookings(reference)
             
-            with transaction.atomic():
-                trip = Trip.objects.select_for_update().get(id=booking.trip.id)
-                if response_data['status'] and response_data['data']['status'] == 'success':
-                    booking.payment_status = 'successful'
-                    booking.status = 'confirmed'
-                    booking.save()
-                    frontend_url = f'https://flexiryde.vercel.app/travel-history'
-                    return HttpResponseRedirect(frontend_url)
-                else:
-                    booking.payment_status = 'failed'
-                    booking.status = 'cancelled'
-                    booking.seat_assignments.delete()
-                    trip.available_seats += booking.seat_count
-                    trip.save()
-                    return Response({
-                        'error': 'Payment failed',
-                        'booking': BookingDetailSerializer(booking).data
-                    }, status=status.HTTP_400_BAD_REQUEST)
+            if response_data['status'] and response_data['data']['status'] == 'success':
+                confirm_payments(bookings)
+                frontend_url = f'https://flexiryde.vercel.app/travel-history'
+                return HttpResponseRedirect(frontend_url)
+            else:
+                release_bookings(bookings.select_for_update())
+                details = BookingDetailSerializer(bookings.order_by('id'), many=True).data
+                return Response({
+                    'error': 'Payment failed',
+                    **({'booking': details[0]} if len(details) == 1 else {'bookings': details}),
+                }, status=status.HTTP_400_BAD_REQUEST)
         except requests.RequestException as e:
-            with transaction.atomic():
-                booking = get_object_or_404(Booking, payment_reference=reference)
-                booking.payment_status = 'failed'
-                booking.status = 'cancelled'
-                booking.seat_assignments.delete()
-                trip = Trip.objects.select_for_update().get(id=booking.trip.id)
-                trip.available_seats += booking.seat_count
-                trip.save()
+            bookings = payment_bookings(reference)
+            release_bookings(bookings.select_for_update())
             return Response({'error': f'Verification error: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 @method_decorator(csrf_exempt, name='dispatch')
@@ -511,11 +1144,9 @@ class PaystackWebhookView(APIView):
         # TODO: Implement HMAC signature verification (see Paystack docs)
         if payload['event'] == 'charge.success':
             reference = payload['data']['reference']
-            booking = get_object_or_404(Booking, payment_reference=reference)
-            if booking.payment_status != 'successful':  # Idempotency check
-                booking.payment_status = 'successful'
-                booking.status = 'confirmed'
-                booking.save()
+            bookings = payment_bookings(reference)
+            if bookings.exclude(payment_status='successful').exists():  # Idempotency check
+                confirm_payments(bookings)
             return Response({'status': 'success'}, status=status.HTTP_200_OK)
         return Response({'status': 'ignored'}, status=status.HTTP_200_OK)
     
@@ -524,3 +1155,10 @@ class PaystackWebhookView(APIView):
     
     
     
+
+
+class MetricsView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response(metrics.snapshot(), status=status.HTTP_200_OK)
@@ -0,0 +1,109 @@
+"""
+Waitlists of sold-out trips.
+
+Passengers queue for a number of seats on a trip, first come first served.
+Whenever core.holds.release_bookings or the seat inventory repair
+(core.inventory) gives seats back, promote() hands them to the front of the
+queue inside the same transaction: each promoted entry gets a pending
+booking with auto-assigned seats, held for WAITLIST_HOLD_MINUTES and paid
+like any other booking. A hold that lapses is released by the hold reaper,
+which promotes the next in line.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Count, F, Q, Sum
+from django.utils import timezone
+
+from . import metrics, seatmap
+from .utils import generate_ref_code
+
+logger = logging.getLogger(__name__)
+
+metrics.register("waitlist.joined", "waitlist.left", "waitlist.promoted", "waitlist.promoted_seats")
+
+QUEUE_ORDER = ('created_at', 'id')
+
+
+def position(entry):
+    """1-based place of a waiting entry in its trip's queue, and the seats asked for ahead of it."""
+    from .models import WaitlistEntry
+
+    ahead = WaitlistEntry.objects.filter(trip_id=entry.trip_id, status="waiting").filter(
+        Q(created_at__lt=entry.created_at) | Q(created_at=entry.created_at, id__lt=entry.id)
+    ).aggregate(entries=Count('id'), seats=Sum('seat_count'))
+    return ahead["entries"] + 1, ahead["seats"] or 0
+
+
+def promote(trip_ids, now=None):
+    """
+    Give the free seats of `trip_ids` to their waitlists, strictly in queue
+    order: an entry asking for more seats than are free stops the queue
+    rather than being overtaken. Must run in the transaction that freed the
+    seats; search and seat map updates are left to the caller. Returns
+    {trip_id: seat numbers taken}.
+    """
+    from .models import Booking, SeatAssignment, Trip, WaitlistEntry
+
+    now = now or timezone.now()
+    # One lookup when, as usual, nobody is waiting
+    waited_on = list(
+        WaitlistEntry.objects.filter(trip_id__in=trip_ids, status="waiting")
+        .values_list('trip_id', flat=True).distinct().order_by()
+    )
+    if not waited_on:
+        return {}
+
+    hold_expires_at = now + timedelta(minutes=settings.WAITLIST_HOLD_MINUTES)
+    taken_seats = {}
+    promotions = []
+    for trip in Trip.objects.select_for_update(of=('self',)).select_related('bus').filter(
+        id__in=waited_on, departure_datetime__gt=now
+    ).order_by('id'):
+        free = trip.available_seats
+        taken = seatmap.occupancy_mask(
+            SeatAssignment.objects.filter(trip=trip).values_list('seat_number', flat=True)
+        )
+        queue = WaitlistEntry.objects.select_for_update().filter(trip=trip, status="waiting").order_by(*QUEUE_ORDER)
+        for entry in queue:
+            if entry.seat_count > free:
+                break
+            seats = seatmap.choose_seats(taken, trip.bus.total_seats, entry.seat_count, trip.bus.seats_per_row)
+            if seats is None:
+                break
+            taken |= seatmap.occupancy_mask(seats)
+            free -= entry.seat_count
+            promotions.append((entry, trip, seats))
+            taken_seats.setdefault(trip.id, []).extend(seats)
+            if not free:
+                break
+    if not promotions:
+        return {}
+
+    bookings = Booking.objects.bulk_create([
+        Booking(
+            user_id=entry.user_id, trip=trip, seat_count=entry.seat_count,
+            price=trip.seat_price * entry.seat_count, payment_reference=generate_ref_code(trip),
+            status="pending", payment_status="pending", hold_expires_at=hold_expires_at,
+        )
+        for entry, trip, seats in promotions
+    ])
+    SeatAssignment.objects.bulk_create([
+        SeatAssignment(booking=booking, trip=trip, seat_number=seat_number)
+        for booking, (entry, trip, seats) in zip(bookings, promotions)
+        for seat_number in seats
+    ])
+    for trip_id, seats in taken_seats.items():
+        Trip.objects.filter(id=trip_id).update(available_seats=F('available_seats') - len(seats))
+    for booking, (entry, trip, seats) in zip(bookings, promotions):
+        entry.status = "promoted"
+        entry.booking = booking
+        entry.promoted_at = now
+    WaitlistEntry.objects.bulk_update([entry for entry, _, _ in promotions], ['status', 'booking', 'promoted_at'])
+
+    promoted_seats = sum(len(seats) for seats in taken_seats.values())
+    metrics.incr("waitlist.promoted", len(promotions))
+    metrics.incr("waitlist.promoted_seats", promoted_seats)
+    logger.info(f"Promoted {len(promotions)} waitlisted passengers to {promoted_seats} seats")
+    return taken_seats
@@ -7,6 +7,7 @@ from datetime import timedelta
 import os
 from dotenv import load_dotenv
 import dj_database_url
+from corsheaders.defaults import default_headers
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 load_dotenv(os.path.join(BASE_DIR, '.env'))
@@ -23,7 +24,7 @@ ALLOWED_HOSTS = os.getenv('ALLOWED_HOSTS', 'localhost,127.0.0.1').split(',')
 AUTH_USER_MODEL = 'accounts.User'
 
 
-TIME_ZONE = 'Africa/Lagos'  # Adjust to match frontend’s timezone
+TIME_ZONE = 'Africa/Lagos'  # Operator's local time: travel dates and "today" are Lagos days
 USE_TZ = True
 
 INSTALLED_APPS = [
@@ -61,6 +62,8 @@ CORS_ALLOWED_ORIGINS = [
     # "http://127.0.1.5500/",
     "http://127.0.1.5500",
 ]
+CORS_ALLOW_HEADERS = (*default_headers, "idempotency-key")
+CORS_EXPOSE_HEADERS = ["Idempotent-Replayed"]
 
 
 REST_FRAMEWORK = {
@@ -74,6 +77,8 @@ REST_FRAMEWORK = {
         'anon': '20/minute',
     },
     'EXCEPTION_HANDLER': 'rest_framework.views.exception_handler',
+    # Keyset pagination; each list view sets its own `keyset_ordering`
+    'DEFAULT_PAGINATION_CLASS': 'core.pagination.KeysetPagination',
 }
 
 SIMPLE_JWT = {
@@ -125,6 +130,72 @@ SITE_PROTOCOL = 'https'
 PAYSTACK_SECRET_KEY = os.getenv('PAYSTACK_SECRET_KEY')
 PAYSTACK_PUBLIC_KEY = os.getenv('PAYSTACK_PUBLIC_KEY')
 
+# Caching. Local memory works for a single process; set REDIS_URL in
+# production so every worker shares the search cache, locks and metrics.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'flexiryde',
+    }
+}
+if os.getenv('REDIS_URL'):
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',  # needs the `redis` package
+        'LOCATION': os.getenv('REDIS_URL'),
+    }
+
+TRIP_SEARCH_CACHE_TIMEOUT = int(os.getenv('TRIP_SEARCH_CACHE_TIMEOUT', 300))  # seconds
+TRIP_SEARCH_CACHE_TODAY_TIMEOUT = int(os.getenv('TRIP_SEARCH_CACHE_TODAY_TIMEOUT', 60))
+TRIP_SEARCH_CACHE_LOCK_TIMEOUT = int(os.getenv('TRIP_SEARCH_CACHE_LOCK_TIMEOUT', 5))
+# Serve dated searches from the denormalized TripSearchEntry table
+TRIP_SEARCH_FROM_INDEX = os.getenv('TRIP_SEARCH_FROM_INDEX', 'true').lower() == 'true'
+FARE_CALENDAR_MAX_DAYS = 31
+
+# Journey planner (in-memory timetable of upcoming trips)
+JOURNEY_PLANNER_HORIZON_DAYS = int(os.getenv('JOURNEY_PLANNER_HORIZON_DAYS', 14))
+JOURNEY_PLANNER_REFRESH_SECONDS = int(os.getenv('JOURNEY_PLANNER_REFRESH_SECONDS', 300))  # full rebuild, picks up other workers' edits
+JOURNEY_PLANNER_WINDOW_HOURS = 36
+JOURNEY_PLANNER_MAX_TRANSFERS = 2
+JOURNEY_PLANNER_DEFAULT_TRANSFER_MINUTES = 30
+JOURNEY_PLANNER_AVERAGE_SPEED_KMH = 60  # when a route has no estimated duration
+
+# Seat holds of unpaid bookings, released by `manage.py release_expired_holds`
+BOOKING_HOLD_MINUTES = int(os.getenv('BOOKING_HOLD_MINUTES', 15))
+BOOKING_HOLD_REAPER_INTERVAL_SECONDS = int(os.getenv('BOOKING_HOLD_REAPER_INTERVAL_SECONDS', 60))  # with --loop
+BOOKING_HOLD_REAPER_BATCH_SIZE = 500
+BOOKING_COMPLETION_BATCH_SIZE = 1000  # `manage.py complete_departed_bookings`
+BOOKING_CART_MAX_LEGS = 4  # trips booked and paid for together in one cart
+WAITLIST_HOLD_MINUTES = int(os.getenv('WAITLIST_HOLD_MINUTES', 30))  # seats handed to a waitlisted passenger
+
+# Seat inventory checks of `manage.py check_seat_inventory --loop`
+SEAT_INVENTORY_CHECK_INTERVAL_SECONDS = int(os.getenv('SEAT_INVENTORY_CHECK_INTERVAL_SECONDS', 900))
+
+# Payment references and temporary NINs: numbers each process reserves at a time
+IDENTIFIER_BLOCK_SIZE = int(os.getenv('IDENTIFIER_BLOCK_SIZE', 50))
+
+# Idempotency-Key replays, expired keys deleted by `manage.py purge_idempotency_keys`
+IDEMPOTENCY_KEY_TTL_HOURS = int(os.getenv('IDEMPOTENCY_KEY_TTL_HOURS', 24))
+IDEMPOTENCY_WAIT_SECONDS = 10  # how long a repeat waits for the first request to finish
+IDEMPOTENCY_LOCK_SECONDS = 60  # after which an unfinished request is taken as dead
+IDEMPOTENCY_PURGE_BATCH_SIZE = 1000
+
+# Seat maps: how many changes a client can catch up on with a delta
+SEAT_MAP_LOG_LENGTH = 200
+SEAT_MAP_LOG_TIMEOUT = 3600  # seconds each change stays in the log
+
+# "Parks near me" (in-memory grid index of active parks)
+PARK_INDEX_CELL_DEGREES = 0.25  # ~28 km cells
+PARK_INDEX_REFRESH_SECONDS = int(os.getenv('PARK_INDEX_REFRESH_SECONDS', 600))
+NEARBY_PARKS_MAX_LIMIT = 50
+NEARBY_PARKS_MAX_RADIUS_KM = 200
+
+# City/park typeahead (in-memory prefix index)
+PLACE_SUGGEST_REFRESH_SECONDS = int(os.getenv('PLACE_SUGGEST_REFRESH_SECONDS', 900))  # also refreshes popularity
+PLACE_SUGGEST_MIN_FUZZY_PREFIX = 3
+PLACE_SUGGEST_MIN_TYPO_LENGTH = 4  # shorter queries only match exactly
+PLACE_SUGGEST_MAX_PREFIX = 12
+PLACE_SUGGEST_MAX_LIMIT = 20
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -169,6 +240,13 @@ SWAGGER_SETTINGS = {
 DATABASES = {
     'default': dj_database_url.config(default=os.getenv('DATABASE_URL'))
 }
+# Identifier blocks (core.identifiers) are reserved on their own persistent
+# autocommit connection to the same database
+DATABASES['identifiers'] = {
+    **DATABASES['default'],
+    'ATOMIC_REQUESTS': False, 'AUTOCOMMIT': True, 'CONN_MAX_AGE': None, 'CONN_HEALTH_CHECKS': True,
+    'TEST': {'MIRROR': 'default'},
+}
 
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
@@ -192,9 +270,7 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 LANGUAGE_CODE = 'en-us'
-TIME_ZONE = 'UTC'
 USE_I18N = True
-USE_TZ = True
 
 STATIC_URL = 'static/'
 
@@ -1,5 +1,6 @@
 import { useEffect, useState, useRef } from "react";
 import authFetch from "../utils/authFetch";
+import fetchAllPages from "../utils/fetchAllPages";
 import { useNavigate } from "react-router-dom";
 import { toast } from "react-toastify";
 
@@ -96,7 +97,7 @@ export default function ChangeBooking() {
       const destination = booking.trip.route.destination_park.id;
 
       try {
-        const response = await authFetch(
+        const { res: response, results } = await fetchAllPages(
           `/trips/search/?origin_id=${origin}&destination_id=${destination}&date=${newDate}`
         );
 
@@ -111,10 +112,10 @@ export default function ChangeBooking() {
           return;
         }
 
-        const data = await response.json();
+        if (!response.ok) throw new Error("Failed to load trips");
 
         // Filter trips with enough seats
-        const validTrips = data.filter(
+        const validTrips = results.filter(
           (trip) => trip.available_seats >= booking.seats
         );
         setAvailableTrips(validTrips);
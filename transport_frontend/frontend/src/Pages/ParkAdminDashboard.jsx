@@ -5,6 +5,7 @@ import "react-toastify/dist/ReactToastify.css";
 import DatePicker from "react-datepicker";
 import "react-datepicker/dist/react-datepicker.css";
 import authFetch from "../utils/authFetch";
+import fetchAllPages from "../utils/fetchAllPages";
 import { PencilSquareIcon, TrashIcon } from "@heroicons/react/24/outline";
 
 const ParkAdminDashboard = () => {
@@ -123,9 +124,8 @@ const ParkAdminDashboard = () => {
 
   const loadTrips = async () => {
     try {
-      const res = await authFetch(`/parks/${parkId}/trips/`);
+      const { res, results: tripsData } = await fetchAllPages(`/parks/${parkId}/trips/?page_size=200`);
       if (res.ok) {
-        const tripsData = await res.json();
         const mappedTrips = tripsData.map((trip) => ({
           id: trip.id,
           route: {
@@ -9,6 +9,18 @@ import RouteVisualization from "../components/RouteVisualization";
 import { FaClock, FaExclamationTriangle } from "react-icons/fa";
 import authFetch from "../utils/authFetch";
 
+const SEAT_MAP_POLL_MS = 15000;
+
+// Seat n is bit (n - 1) % 8 of byte (n - 1) / 8 of the base64 bitset
+const decodeSeats = (encoded) => {
+  const bytes = atob(encoded);
+  const seats = [];
+  for (let index = 0; index < bytes.length * 8; index++) {
+    if (bytes.charCodeAt(index >> 3) & (1 << (index % 8))) seats.push(index + 1);
+  }
+  return seats;
+};
+
 export default function SeatAvailability() {
   const location = useLocation();
   const navigate = useNavigate();
@@ -45,26 +57,64 @@ export default function SeatAvailability() {
 
     const totalSeats = trip.bus?.total_seats ?? 24;
     const takenSeats = trip.seats_taken ?? 0; // Use seats_taken from TripListSerializer
-    const bookedSeats = trip.booked_seats ?? []; // From TripListSerializer
-    console.log("Trip object =>", JSON.stringify(trip, null, 2));
-    console.log(
-      "Total Seats:",
-      totalSeats,
-      "Taken Seats:",
-      takenSeats,
-      "Booked Seats:",
-      bookedSeats
-    );
-
-    setCurrentSeats({ totalSeats, takenSeats, bookedSeats });
+
+    setCurrentSeats({ totalSeats, takenSeats, bookedSeats: [] });
     setPrice(trip.seat_price ?? 1500);
     setSelectedSeatNumbers([]); // Reset selected seats when trip changes
   }, [trip]);
 
+  // Load the seat map, then poll for seats that changed since its version
+  useEffect(() => {
+    if (!trip) return;
+
+    let version = null;
+    let unavailable = new Set();
+    let cancelled = false;
+
+    const refresh = async () => {
+      try {
+        const query = version === null ? "" : `?since=${version}`;
+        const res = await fetch(`${API_BASE_URL}/trips/${trip.id}/seats/${query}`);
+        if (!res.ok) throw new Error("Failed to fetch seat map");
+        const map = await res.json();
+        if (cancelled) return;
+
+        version = map.version;
+        if (map.full) {
+          unavailable = new Set([...decodeSeats(map.occupied), ...decodeSeats(map.held)]);
+        } else if (map.changes.length) {
+          unavailable = new Set(unavailable);
+          map.changes.forEach(({ seat, state }) =>
+            state === "free" ? unavailable.delete(seat) : unavailable.add(seat)
+          );
+        } else {
+          return; // Nothing changed, keep the current selection
+        }
+        setCurrentSeats((seats) => ({
+          ...seats,
+          takenSeats: unavailable.size,
+          bookedSeats: [...unavailable].sort((a, b) => a - b),
+        }));
+      } catch (error) {
+        console.error("Error fetching seat map:", error);
+      }
+    };
+
+    refresh();
+    const timer = setInterval(refresh, SEAT_MAP_POLL_MS);
+    return () => {
+      cancelled = true;
+      clearInterval(timer);
+    };
+  }, [trip, API_BASE_URL]);
+
+  // With no seats picked, the server picks seats that keep the group together
+  const autoAssign = selectedSeatNumbers.length === 0;
+
   // Check if enough seats remain and correct number of seats selected
   const isSeatAvailable =
     currentSeats.totalSeats - currentSeats.takenSeats >= bookedSeats &&
-    selectedSeatNumbers.length === bookedSeats;
+    (autoAssign || selectedSeatNumbers.length === bookedSeats);
 
   // Handle seat selection
   const handleSeatsSelected = (seats) => {
@@ -86,7 +136,7 @@ export default function SeatAvailability() {
       return;
     }
 
-    if (selectedSeatNumbers.length !== bookedSeats) {
+    if (!autoAssign && selectedSeatNumbers.length !== bookedSeats) {
       toast.error(
         `Please select exactly ${bookedSeats} seat(s). You have selected ${selectedSeatNumbers.length}.`,
         {
@@ -112,17 +162,23 @@ export default function SeatAvailability() {
     setLoading(true);
 
     try {
+      // Retries of this checkout (e.g. after a token refresh) replay the first result
+      const checkoutKey = crypto.randomUUID();
+
       // Create the booking
       const bookingPayload = {
         trip: Number(selectedTripId),
         seat_count: bookedSeats,
         price: price * bookedSeats,
-        seat_numbers: selectedSeatNumbers, // Include selected seats
+        ...(autoAssign
+          ? { auto_assign: true }
+          : { seat_numbers: selectedSeatNumbers }), // Include selected seats
       };
       console.log("Calling /api/bookings/create/ with:", bookingPayload);
 
       const bookingResponse = await authFetch("/bookings/create/", {
         method: "POST",
+        headers: { "Idempotency-Key": checkoutKey },
         body: JSON.stringify(bookingPayload),
       });
 
@@ -161,6 +217,7 @@ export default function SeatAvailability() {
         headers: {
           "Content-Type": "application/json",
           Authorization: `Bearer ${token}`,
+          "Idempotency-Key": `${checkoutKey}-payment`,
         },
         body: JSON.stringify(paymentPayload),
       });
@@ -195,6 +252,7 @@ export default function SeatAvailability() {
           headers: {
             "Content-Type": "application/json",
             Authorization: `Bearer ${token}`,
+            "Idempotency-Key": `${checkoutKey}-payment`,
           },
           body: JSON.stringify(paymentPayload),
         });
@@ -378,7 +436,7 @@ export default function SeatAvailability() {
               <div>
                 <p className='font-medium text-yellow-800'>Action Required</p>
                 <p className='text-sm text-yellow-700'>
-                  {selectedSeatNumbers.length !== bookedSeats
+                  {!autoAssign && selectedSeatNumbers.length !== bookedSeats
                     ? `Please select exactly ${bookedSeats} seat(s).`
                     : `Only ${currentSeats.totalSeats - currentSeats.takenSeats} seat(s) available. Please reduce number of seats or change your departure time.`}
                 </p>
@@ -398,10 +456,14 @@ export default function SeatAvailability() {
           bookedSeats={currentSeats.bookedSeats}
           onSeatsSelected={handleSeatsSelected}
         />
-        {selectedSeatNumbers.length > 0 && (
+        {selectedSeatNumbers.length > 0 ? (
           <p className='mt-4 text-gray-600'>
             Selected Seats: {selectedSeatNumbers.join(", ")}
           </p>
+        ) : (
+          <p className='mt-4 text-gray-600'>
+            No preference? Skip this and we&apos;ll seat your group together.
+          </p>
         )}
       </div>
 
@@ -444,8 +506,10 @@ export default function SeatAvailability() {
           {loading
             ? "Processing..."
             : isSeatAvailable
-              ? `Proceed to Book ${bookedSeats} Seat(s)`
-              : selectedSeatNumbers.length !== bookedSeats
+              ? autoAssign
+                ? `Book ${bookedSeats} Best Available Seat(s)`
+                : `Proceed to Book ${bookedSeats} Seat(s)`
+              : !autoAssign && selectedSeatNumbers.length !== bookedSeats
                 ? `Select ${bookedSeats} Seat(s)`
                 : "Not Enough Seats"}
         </button>
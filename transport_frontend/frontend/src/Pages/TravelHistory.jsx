@@ -9,7 +9,8 @@ import Pagination from "../components/TravelHistory/Pagination";
 import CancelModal from "../components/TravelHistory/CancelModal";
 
 export default function TravelHistory() {
-  const [trips, setTrips] = useState([]);
+  const [pages, setPages] = useState([]); // Pages of trips fetched so far
+  const [nextUrl, setNextUrl] = useState(null); // Cursor link to the page after the last one fetched
   const [filter, setFilter] = useState("all");
   const [showModal, setShowModal] = useState(false);
   const [cancelTrip, setCancelTrip] = useState(null);
@@ -17,57 +18,59 @@ export default function TravelHistory() {
   const tripsPerPage = 5; // Number of trips per page
   const navigate = useNavigate();
 
-  // Fetch bookings
+  const formatBooking = (booking) => {
+    const trip = booking.trip || {};
+    const route = trip.route || {};
+    const datetime = new Date(trip.departure_datetime);
+    const createdAt = new Date(booking.created_at);
+
+    return {
+      id: booking.id,
+      from: route.origin_park?.name || "—",
+      fromCity: route.origin_city?.name || "",
+      to: route.destination_park?.name || "—",
+      toCity: route.destination_city?.name || "",
+      date: datetime.toLocaleDateString("en-NG", {
+        weekday: "short",
+        month: "short",
+        day: "numeric",
+        year: "numeric",
+      }),
+      time: datetime.toLocaleTimeString("en-NG", {
+        hour: "2-digit",
+        minute: "2-digit",
+        hour12: true,
+      }),
+      seats: booking.seats ?? booking.seat_count ?? "—",
+      price: `₦${Number(booking.price).toLocaleString()}`,
+      bookingRef: booking.ref_number ?? booking.payment_reference,
+      status: booking.status?.toLowerCase() || "confirmed",
+      originalBooking: booking,
+      datetime,
+      createdAt,
+    };
+  };
+
+  // Fetch one page of bookings; `next` is the cursor link to the page after it
+  const fetchPage = async (url) => {
+    const response = await authFetch(url);
+    if (!response.ok) throw new Error(`Request failed with status ${response.status}`);
+    const { next, results } = await response.json();
+    return { next, trips: results.map(formatBooking) };
+  };
+
+  // Fetch the first page for the selected filter; the server orders it
+  // (upcoming soonest first, the others latest first)
   useEffect(() => {
+    let ignore = false;
     const fetchTrips = async () => {
       try {
-        const response = await authFetch("/bookings/");
-        const data = await response.json();
-
-        const formatted = data.map((booking) => {
-          const trip = booking.trip || {};
-          const route = trip.route || {};
-          const datetime = new Date(trip.departure_datetime);
-          const createdAt = new Date(booking.created_at);
-
-          return {
-            id: booking.id,
-            from: route.origin_park?.name || "—",
-            fromCity: route.origin_city?.name || "",
-            to: route.destination_park?.name || "—",
-            toCity: route.destination_city?.name || "",
-            date: datetime.toLocaleDateString("en-NG", {
-              weekday: "short",
-              month: "short",
-              day: "numeric",
-              year: "numeric",
-            }),
-            time: datetime.toLocaleTimeString("en-NG", {
-              hour: "2-digit",
-              minute: "2-digit",
-              hour12: true,
-            }),
-            seats: booking.seats ?? booking.seat_count ?? "—",
-            price: `₦${Number(booking.price).toLocaleString()}`,
-            bookingRef: booking.ref_number ?? booking.payment_reference,
-            status: booking.status?.toLowerCase() || "confirmed",
-            originalBooking: booking,
-            datetime,
-            createdAt,
-          };
-        });
-
-        // Sort trips: confirmed first (by created_at, newest first), then others (by departure_datetime, newest first)
-        formatted.sort((a, b) => {
-          if (a.status === "confirmed" && b.status !== "confirmed") return -1;
-          if (a.status !== "confirmed" && b.status === "confirmed") return 1;
-          if (a.status === "confirmed" && b.status === "confirmed") {
-            return b.createdAt - a.createdAt;
-          }
-          return b.datetime - a.datetime;
-        });
-
-        setTrips(formatted);
+        const query = new URLSearchParams({ page_size: tripsPerPage });
+        if (filter !== "all") query.set("filter", filter);
+        const { next, trips } = await fetchPage(`/bookings/history/?${query}`);
+        if (ignore) return;
+        setPages([trips]);
+        setNextUrl(next);
         setCurrentPage(1); // Reset to first page when data is fetched
       } catch (err) {
         console.error("Failed to fetch bookings:", err);
@@ -75,7 +78,10 @@ export default function TravelHistory() {
     };
 
     fetchTrips();
-  }, []);
+    return () => {
+      ignore = true;
+    };
+  }, [filter]);
 
   // Helper to check if cancellation is allowed (more than 12 hours until departure)
   const canCancel = (trip) => {
@@ -85,20 +91,25 @@ export default function TravelHistory() {
     return hoursUntilDeparture > 12;
   };
 
-  // Filtering and Pagination
-  const filteredTrips =
-    filter === "all" ? trips : trips.filter((trip) => trip.status === filter);
-
-  // Calculate pagination data
-  const totalTrips = filteredTrips.length;
-  const totalPages = Math.ceil(totalTrips / tripsPerPage);
-  const indexOfLastTrip = currentPage * tripsPerPage;
-  const indexOfFirstTrip = indexOfLastTrip - tripsPerPage;
-  const currentTrips = filteredTrips.slice(indexOfFirstTrip, indexOfLastTrip);
+  // Pagination: pages already fetched, plus the next one if there is more
+  const totalPages = pages.length + (nextUrl ? 1 : 0);
+  const currentTrips = pages[currentPage - 1] || [];
 
   // Handle page change
-  const handlePageChange = (pageNumber) => {
+  const handlePageChange = async (pageNumber) => {
     if (pageNumber < 1 || pageNumber > totalPages) return;
+    if (pageNumber > pages.length) {
+      // Not fetched yet: follow the cursor
+      try {
+        const { next, trips } = await fetchPage(nextUrl);
+        setPages((prev) => [...prev, trips]);
+        setNextUrl(next);
+      } catch (err) {
+        console.error("Failed to fetch bookings:", err);
+        toast.error("Failed to load more trips.");
+        return;
+      }
+    }
     setCurrentPage(pageNumber);
     window.scrollTo({ top: 0, behavior: "smooth" }); // Scroll to top
   };
@@ -130,9 +141,11 @@ export default function TravelHistory() {
       });
 
       if (response.ok) {
-        setTrips((prev) =>
-          prev.map((trip) =>
-            trip.id === cancelTrip.id ? { ...trip, status: "cancelled" } : trip
+        setPages((prev) =>
+          prev.map((page) =>
+            page.map((trip) =>
+              trip.id === cancelTrip.id ? { ...trip, status: "cancelled" } : trip
+            )
           )
         );
         toast.success(
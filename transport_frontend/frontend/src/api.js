@@ -1,4 +1,5 @@
 import authFetch from "./utils/authFetch";
+import fetchAllPages from "./utils/fetchAllPages";
 
 const API_BASE_URL = import.meta.env.VITE_API_URL;
 
@@ -35,9 +36,9 @@ export const signup = async (form) => {
 
 
 export const getBusParks = async () => {
-  const res = await fetch(`${API_BASE_URL}/parks/`);
+  const { res, results } = await fetchAllPages(`${API_BASE_URL}/parks/?page_size=200`, fetch);
   if (!res.ok) throw new Error("Failed to fetch parks");
-  return res.json(); // Should return list of park objects
+  return results; // List of park objects
 };
 
 
@@ -1,7 +1,7 @@
 import { useState, useRef, useEffect } from "react";
 import { motion, AnimatePresence } from "framer-motion";
 import { getBusParks } from "../api";
-import authFetch from "../utils/authFetch";
+import fetchAllPages from "../utils/fetchAllPages";
 import { useNavigate } from "react-router-dom";
 import { toast } from "react-toastify";
 import {
@@ -116,11 +116,10 @@ export const BookingInput = ({ submitType }) => {
         date: travel_date,
       });
 
-      const response = await authFetch(
+      const { res: response, results: tripResults } = await fetchAllPages(
         `/trips/search/?${queryParams.toString()}`
       );
-
-      const tripResults = await response.json();
+      if (!response.ok) throw new Error("Trip search failed");
 
       console.log("Trip search response:", tripResults);
 
@@ -1,5 +1,5 @@
 export default function FilterButtons({ filter, setFilter }) {
-  const filters = ["all", "confirmed", "completed", "cancelled"];
+  const filters = ["all", "upcoming", "past", "cancelled"];
   return (
     <div className='flex flex-wrap gap-3 mb-8'>
       {filters.map((type) => (
@@ -1,5 +1,6 @@
 import { useState, useEffect } from "react";
 import authFetch from "../..//utils/authFetch"; // Adjust your import
+import fetchAllPages from "../../utils/fetchAllPages";
 import { toast } from "react-toastify";
 
 const ParkAdminDashboard = () => {
@@ -57,10 +58,9 @@ const ParkAdminDashboard = () => {
 
   const loadTrips = async () => {
     try {
-      const res = await authFetch(`/parks/${parkId}/trips/`);
+      const { res, results } = await fetchAllPages(`/parks/${parkId}/trips/?page_size=200`);
       if (res.ok) {
-        const data = await res.json();
-        setScheduledTrips(data);
+        setScheduledTrips(results);
       }
     } catch (error) {
       console.error(error);
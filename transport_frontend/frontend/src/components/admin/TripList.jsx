@@ -1,5 +1,5 @@
 import { useState, useEffect } from "react";
-import authFetch from "../../utils/authFetch";
+import fetchAllPages from "../../utils/fetchAllPages";
 import { showToast } from "../../utils/toastUtils";
 import { parseISO, format } from "date-fns";
 
@@ -9,10 +9,9 @@ export default function TripList({ parkId, onEdit, refreshTrigger }) {
 
   const fetchTrips = async () => {
     try {
-      const res = await authFetch(`/parks/${parkId}/trips/`);
+      const { res, results } = await fetchAllPages(`/parks/${parkId}/trips/?page_size=200`);
       if (!res.ok) throw new Error("Failed to fetch trips");
-      const data = await res.json();
-      setTrips(data);
+      setTrips(results);
     } catch (error) {
       console.error("Error fetching trips:", error);
       showToast("error", "Failed to load trips.");
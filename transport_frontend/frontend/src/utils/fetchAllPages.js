@@ -0,0 +1,18 @@
+import authFetch from "./authFetch";
+
+// Walks a cursor-paged list endpoint ({next, previous, results}) by following
+// `next`. Returns the last response, so callers can check `ok`/`status`, and
+// the results of every page fetched.
+export default async function fetchAllPages(url, fetcher = authFetch) {
+  const results = [];
+  let res;
+  let next = url;
+  while (next) {
+    res = await fetcher(next);
+    if (!res.ok) break;
+    const page = await res.json();
+    results.push(...page.results);
+    next = page.next;
+  }
+  return { res, results };
+}